@@ -0,0 +1,293 @@
+"""
+answer_cache.py
+
+Response cache for the /chat endpoint.
+
+Entries are keyed by the normalized user message plus the agent mode and are
+stored in a local SQLite file so they survive restarts. Lookups first try an
+exact key match and then fall back to cosine similarity between the query
+embedding and the embeddings of cached messages (same agent mode only).
+
+Eviction is TTL + LRU (least recently accessed entries go first once
+max_entries is exceeded). The whole cache is dropped when the source
+database (olist.db) is rebuilt, as told by the build id preprocess_sql.py
+writes into it.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import hashlib
+from typing import Optional
+
+import numpy as np
+
+
+def normalize_message(message: str) -> str:
+    """Canonical form of a user message used for cache keys."""
+    text = unicodedata.normalize("NFKC", message or "").lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    # Trailing punctuation does not change the question ("...dijual?" == "...dijual")
+    return text.rstrip(" ?!.。")
+
+
+# written by preprocess_sql.finish_build on every build
+BUILD_TABLE = "_build_info"
+# db_path -> (stat key, fingerprint): the DB is only opened when the file changed
+_fingerprints = {}
+
+
+def _read_build_id(db_path: str) -> Optional[str]:
+    """The build id, else a digest of the _etl_metadata checksums (builds before build ids)."""
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return None
+    try:
+        for query in (f"SELECT build_id FROM {BUILD_TABLE}",
+                      "SELECT table_name, checksum, loaded_at FROM _etl_metadata ORDER BY table_name"):
+            try:
+                rows = conn.execute(query).fetchall()
+            except sqlite3.Error:
+                continue
+            if rows:
+                return hashlib.sha256(json.dumps(rows).encode("utf-8")).hexdigest()[:16]
+    finally:
+        conn.close()
+    return None
+
+
+def source_fingerprint(db_path: str) -> str:
+    """Identify a build of the source DB.
+
+    Inode numbers are not enough: after remove + recreate or an atomic
+    rename the filesystem may hand the new file the old inode. The build id
+    changes on every build and regular writes such as chat_history inserts
+    keep it. DBs without one (created by app.py's CSV fallback) fall back to
+    the inode.
+    """
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return "missing"
+    stat_key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _fingerprints.get(db_path)
+    if cached and cached[0] == stat_key:
+        return cached[1]
+    build_id = _read_build_id(db_path)
+    fingerprint = f"build:{build_id}" if build_id else f"{st.st_dev}:{st.st_ino}"
+    _fingerprints[db_path] = (stat_key, fingerprint)
+    return fingerprint
+
+
+class AnswerCache:
+    """Exact + semantic answer cache persisted in SQLite."""
+
+    def __init__(
+        self,
+        path: str = "answer_cache.db",
+        similarity_threshold: float = 0.95,
+        ttl_seconds: float = 86400,
+        max_entries: int = 2000,
+        source_db_path: Optional[str] = None,
+    ):
+        self.path = path
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.source_db_path = source_db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                cache_key TEXT PRIMARY KEY,
+                agent_mode TEXT,
+                normalized_message TEXT,
+                response TEXT,
+                embedding BLOB,
+                created_at REAL,
+                last_access REAL
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+        self.stats_counters = {
+            "hits_exact": 0,
+            "hits_semantic": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+        # In-memory mirror of stored embeddings: cache_key -> (agent_mode, unit vector)
+        self._vectors = {}
+        self._check_source()
+        self._load_vectors()
+
+    # ---------------- internals ----------------
+
+    @staticmethod
+    def _key(normalized: str, agent_mode: str) -> str:
+        return hashlib.sha256(f"{agent_mode}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _unit(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else v
+
+    def _load_vectors(self):
+        self._vectors = {}
+        rows = self._conn.execute(
+            "SELECT cache_key, agent_mode, embedding FROM answer_cache WHERE embedding IS NOT NULL"
+        ).fetchall()
+        for key, mode, blob in rows:
+            self._vectors[key] = (mode, np.frombuffer(blob, dtype=np.float32))
+
+    def _check_source(self):
+        """Drop everything if the source DB was rebuilt since the entries were written."""
+        if not self.source_db_path:
+            return
+        current = source_fingerprint(self.source_db_path)
+        row = self._conn.execute("SELECT value FROM cache_meta WHERE key = 'source_fingerprint'").fetchone()
+        if row and row[0] == current:
+            return
+        if row:
+            self._conn.execute("DELETE FROM answer_cache")
+            self._vectors = {}
+            self.stats_counters["invalidations"] += 1
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache_meta (key, value) VALUES ('source_fingerprint', ?)", (current,)
+        )
+        self._conn.commit()
+
+    def _delete(self, keys):
+        if not keys:
+            return
+        self._conn.executemany("DELETE FROM answer_cache WHERE cache_key = ?", [(k,) for k in keys])
+        for k in keys:
+            self._vectors.pop(k, None)
+
+    def _purge_expired(self, now: float):
+        if not self.ttl_seconds:
+            return
+        expired = [r[0] for r in self._conn.execute(
+            "SELECT cache_key FROM answer_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).fetchall()]
+        self._delete(expired)
+        self.stats_counters["evictions"] += len(expired)
+
+    def _enforce_capacity(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        victims = [r[0] for r in self._conn.execute(
+            "SELECT cache_key FROM answer_cache ORDER BY last_access ASC LIMIT ?", (overflow,)
+        ).fetchall()]
+        self._delete(victims)
+        self.stats_counters["evictions"] += len(victims)
+
+    def _nearest(self, agent_mode: str, embedding):
+        query = self._unit(embedding)
+        # entries embedded at another size (EMBEDDING_DIMENSIONS / provider changed) are skipped
+        candidates = [(k, v) for k, (mode, v) in self._vectors.items() if mode == agent_mode and v.shape == query.shape]
+        if not candidates:
+            return None, 0.0
+        keys = [k for k, _ in candidates]
+        matrix = np.vstack([v for _, v in candidates])
+        sims = matrix @ query
+        best = int(np.argmax(sims))
+        return keys[best], float(sims[best])
+
+    # ---------------- public API ----------------
+
+    def get(self, message: str, agent_mode: str, embedding=None, record_miss: bool = True) -> Optional[dict]:
+        """Return the cached response dict or None.
+
+        Without an embedding only the exact key is tried; callers can do a
+        cheap exact probe with record_miss=False before paying for an
+        embedding. The returned dict carries a 'cache' entry describing the
+        hit type ("exact" or "semantic") and the similarity.
+        """
+        normalized = normalize_message(message)
+        now = time.time()
+        with self._lock:
+            self._check_source()
+            self._purge_expired(now)
+
+            key = self._key(normalized, agent_mode)
+            hit_type, similarity = "exact", 1.0
+            row = self._conn.execute("SELECT response FROM answer_cache WHERE cache_key = ?", (key,)).fetchone()
+            if row is None and embedding is not None:
+                best_key, similarity = self._nearest(agent_mode, embedding)
+                if best_key and similarity >= self.similarity_threshold:
+                    key, hit_type = best_key, "semantic"
+                    row = self._conn.execute(
+                        "SELECT response FROM answer_cache WHERE cache_key = ?", (key,)
+                    ).fetchone()
+
+            if row is None:
+                if record_miss:
+                    self.stats_counters["misses"] += 1
+                self._conn.commit()
+                return None
+
+            self._conn.execute("UPDATE answer_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+            self._conn.commit()
+            self.stats_counters["hits_exact" if hit_type == "exact" else "hits_semantic"] += 1
+
+        response = json.loads(row[0])
+        response["cache"] = {"type": hit_type, "similarity": round(similarity, 4)}
+        return response
+
+    def put(self, message: str, agent_mode: str, response: dict, embedding=None):
+        """Store a response dict (must be JSON serializable)."""
+        normalized = normalize_message(message)
+        key = self._key(normalized, agent_mode)
+        now = time.time()
+        blob = None
+        vec = None
+        if embedding is not None:
+            vec = self._unit(embedding)
+            blob = vec.tobytes()
+        with self._lock:
+            self._check_source()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache "
+                "(cache_key, agent_mode, normalized_message, response, embedding, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, agent_mode, normalized, json.dumps(response), blob, now, now),
+            )
+            if vec is not None:
+                self._vectors[key] = (agent_mode, vec)
+            self.stats_counters["stores"] += 1
+            self._enforce_capacity()
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answer_cache")
+            self._conn.commit()
+            self._vectors = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()
+        hits = self.stats_counters["hits_exact"] + self.stats_counters["hits_semantic"]
+        lookups = hits + self.stats_counters["misses"]
+        return {
+            **self.stats_counters,
+            "entries": entries,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "similarity_threshold": self.similarity_threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "max_entries": self.max_entries,
+            "path": self.path,
+        }
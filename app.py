@@ -9,9 +9,10 @@ This module contains the FastAPI web service that exposes the agent functionalit
 
 from xmlrpc import client
 from fastapi import FastAPI, HTTPException, UploadFile, File, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 from agent import SimpleAgent
 import os
 import json
@@ -21,17 +22,18 @@ import logging
 import pandas as pd
 import numpy as np
 from qdrant_client.http import models
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 from sqlalchemy import create_engine, text
 import requests
 import re
 import asyncio
+import itertools
 # import streamlit as st  # Not used in FastAPI app
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.tools import tool
 # from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from uuid import uuid4
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
 from langchain_core.documents import Document
 # from langchain_community.vectorstores import qdrant as QdrantVectorStore  # Deprecated
 from langgraph.prebuilt import create_react_agent
@@ -49,6 +51,23 @@ from langchain_community.utilities import SQLDatabase
 from langchain_qdrant import QdrantVectorStore
 # from langchain_community.retrievers import QdrantPointsRetriever
 import sqlite3
+from answer_cache import AnswerCache, normalize_message
+from embedding_cache import CachedEmbeddings, uncached
+from embedding_batcher import EMBED_BATCH_MAX_ITEMS, TokenBatchedEmbeddings, TokenBucket
+from embedding_providers import EMBEDDING_PROVIDER, embedding_dimension, is_local as is_local_embeddings, make_embeddings
+from qdrant_profiles import collection_vector_size, profile_for
+from create_qdrant_index import ensure_payload_indexes
+from query_filters import describe_constraints, merge_filter, parse_range_constraints, range_conditions
+from sparse_bm25 import bm25_encoder, fusion_query, has_sparse_vector, hybrid_prefetch
+from rerank import RERANK_CANDIDATES, RERANK_ENABLED, RERANK_TOP_N, rerank
+from sql_cache import SQLGenerationCache, schema_fingerprint
+from schema_digest import SchemaDigest
+from sqlite_pool import SQLitePool
+from sql_guard import QueryAbortedError, SQLGovernor, strip_terminator
+from duckdb_engine import DuckDBEngine, duckdb_available, is_analytical
+from sql_streaming import (
+    PageTokenError, arrow_available, decode_page_token, fetch_page, stream_arrow, stream_ndjson,
+)
 
 
 # from langchain.chains import RetrievalQA
@@ -80,6 +99,32 @@ except Exception:
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 # Feature flags / controls
 DISABLE_INGEST = os.getenv("DISABLE_INGEST", "0").strip().lower() in ("1", "true", "yes", "on")
+# /chat answer cache (exact + embedding-similarity lookups, persisted in SQLite)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "yes", "on")
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.db")
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+# Query-embedding cache shared by every search path (memory LRU + SQLite on disk)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "50000"))   # on-disk cap, oldest dropped (0: none)
+# Memoized NL -> SQL generation (keyed by normalized question + schema fingerprint)
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "yes", "on")
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "86400"))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000"))
+# Page size used by /sqlite and /sqlite/raw when only page_token is given
+SQL_DEFAULT_PAGE_SIZE = int(os.getenv("SQL_DEFAULT_PAGE_SIZE", "500"))
+# format=arrow: type columns from one pass over the whole result instead of the first batch
+SQL_ARROW_EXACT_TYPES = os.getenv("SQL_ARROW_EXACT_TYPES", "0").strip().lower() in ("1", "true", "yes", "on")
+# Execution guardrails for generated / raw SQL (time budget, row cap, plan check)
+SQL_TIME_BUDGET_S = float(os.getenv("SQL_TIME_BUDGET_S", "5"))
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "5000"))
+SQL_LARGE_TABLE_ROWS = int(os.getenv("SQL_LARGE_TABLE_ROWS", "50000"))
+# SQL execution engine for SQLRagAgent: "sqlite" (default), "duckdb" (every SELECT on
+# the Parquet copy) or "auto" (DuckDB for aggregates, SQLite for point lookups)
+SQL_ENGINE = os.getenv("SQL_ENGINE", "sqlite").strip().lower()
+PARQUET_DIR = os.getenv("PARQUET_DIR", os.path.join("FP", "parquet"))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -87,6 +132,68 @@ logger = logging.getLogger(__name__)
 # CSV loading will happen in startup_event to ensure proper initialization in Docker
 # sqlite_db_path will be set at runtime
 
+# One rate limiter for every OpenAI embeddings object (collections may differ in dimensions)
+embedding_limiter = TokenBucket()
+
+def build_embeddings(dimensions: Optional[int] = None):
+    """Embeddings for EMBEDDING_PROVIDER.
+
+    OpenAI: wrapped in the shared memory + disk query cache; cache misses go
+    through TokenBatchedEmbeddings (requests packed to a token budget and paced
+    by an adaptive tokens/requests-per-minute bucket). Document ingestion uses
+    uncached(embeddings) so it does not flood the cache. dimensions overrides
+    EMBEDDING_DIMENSIONS. Local: the in-process model is faster than any
+    cache lookup, so it is returned as is.
+    """
+    if is_local_embeddings():
+        return make_embeddings()
+    return CachedEmbeddings(
+        TokenBatchedEmbeddings(
+            make_embeddings(dimensions=dimensions, openai_api_key=os.getenv("OPENAI_API_KEY")),
+            limiter=embedding_limiter,
+        ),
+        path=EMBEDDING_CACHE_PATH or None,
+        max_memory_items=EMBEDDING_CACHE_MEMORY_ITEMS,
+        max_disk_rows=EMBEDDING_CACHE_MAX_ROWS,
+    )
+
+def embeddings_for_collection(client, collection_name: str, current=None):
+    """Embeddings producing vectors of collection_name's size.
+
+    A collection only answers queries embedded at the size it was built
+    with, which may differ from the current EMBEDDING_DIMENSIONS. current is
+    reused when it already matches or the collection does not exist yet.
+    """
+    current = current or build_embeddings()
+    try:
+        size = collection_vector_size(client, collection_name) if client is not None else None
+    except Exception as e:
+        logger.warning(f"⚠️  Could not read the vector size of '{collection_name}': {e}")
+        size = None
+    if size is None or embedding_dimension(current) == size:
+        return current
+    try:
+        matched = build_embeddings(dimensions=size)
+    except ValueError as e:
+        logger.error(f"❌ Cannot embed queries for '{collection_name}' ({size}-d vectors): {e}")
+        return current
+    if embedding_dimension(matched) != size:
+        logger.error(f"❌ {EMBEDDING_PROVIDER} embeddings are {embedding_dimension(matched)}-d but "
+                     f"'{collection_name}' stores {size}-d vectors; re-create the collection or switch provider")
+        return current
+    logger.info(f"📐 '{collection_name}' stores {size}-d vectors; embedding its queries at {size} dimensions")
+    return matched
+
+def build_schema_digest(sqlite_db_path: str):
+    """Schema digest for SQL prompts; None (full get_table_info) if it cannot be built."""
+    try:
+        digest = SchemaDigest(sqlite_db_path, category_synonyms=CATEGORY_SYNONYMS)
+        logger.info(f"✅ Schema digest built ({len(digest.tables)} tables)")
+        return digest
+    except Exception as e:
+        logger.warning(f"⚠️  Schema digest unavailable, using full table info: {e}")
+        return None
+
 # Helper function to verify database (can be called after startup)
 def show_data_from_sqlite():
     sqlite_db_path = os.getenv("SQLITE_DB_PATH", "olist.db")
@@ -156,8 +263,10 @@ def show_data_from_sqlite():
 # ================= PYDANTIC MODELS =================
 class ChatRequest(BaseModel):
     message: str
-    agent: Optional[Literal["auto", "sql", "qdrant"]] = "auto"
+    agent: Optional[Literal["auto", "sql", "qdrant", "hybrid"]] = "auto"
     session_id: Optional[str] = None
+    # Qdrant retrieval: dense only, or dense + BM25 fused (default QDRANT_SEARCH_MODE)
+    search_mode: Optional[Literal["dense", "hybrid"]] = None
     
     class Config:
         schema_extra = {
@@ -168,6 +277,30 @@ class ChatRequest(BaseModel):
         }
 
 
+class BatchSearchQuery(BaseModel):
+    q: str
+    k: int = 5
+    # Qdrant filter JSON, ANDed with the category / rating filters detected in q
+    filter: Optional[Dict[str, Any]] = None
+    detect_filters: bool = True
+    mode: Optional[Literal["dense", "hybrid"]] = None
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "queries": [
+                    {"q": "parfum wangi tahan lama", "k": 3},
+                    {"q": "jam tangan rating di atas 4", "k": 5,
+                     "filter": {"must": [{"key": "num_reviews", "range": {"gte": 10}}]}}
+                ]
+            }
+        }
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="LLM Agent Service with Dual RAG Agents",
@@ -191,6 +324,7 @@ db = None
 llm = None
 sql_chain = None
 qdrant_client = None
+async_qdrant_client = None
 vectorstore = None
 vectorstore_products = None
 retriever = None
@@ -198,11 +332,41 @@ agent_a = None
 rag_chain = None
 embeddings = None
 reviews_df = None
+answer_cache = None
+schema_digest = None
+# Thread-local read-only connections for every query path + one writer for chat_history
+sqlite_pool = SQLitePool(os.getenv("SQLITE_DB_PATH", "olist.db"))
+sql_cache = SQLGenerationCache(max_entries=SQL_CACHE_MAX_ENTRIES, ttl_seconds=SQL_CACHE_TTL) if SQL_CACHE_ENABLED else None
+
+
+def digest_row_counts() -> dict:
+    """Per-table row counts from the schema digest (empty until it is built)."""
+    if schema_digest is None:
+        return {}
+    return {name: info["rows"] for name, info in schema_digest.tables.items()}
+
+
+sql_governor = SQLGovernor(
+    time_budget_s=SQL_TIME_BUDGET_S,
+    max_rows=SQL_MAX_ROWS,
+    large_table_rows=SQL_LARGE_TABLE_ROWS,
+    table_rows=digest_row_counts,
+)
+# In-process DuckDB over the Parquet export (optional dependency)
+duckdb_engine = DuckDBEngine(PARQUET_DIR) if SQL_ENGINE != "sqlite" and duckdb_available() else None
 # Qdrant defaults (can be overridden via env)
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 # QDRANT_URL = os.getenv("QDRANT_URL", "http://host.docker.internal:6338")
 QDRANT_URL = os.getenv("QDRANT_URL", "https://acb9e0ed-c7e4-4abc-9495-1382817b533e.europe-west3-0.gcp.cloud.qdrant.io")
 QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "olist_reviews")
+QDRANT_PRODUCTS_COLLECTION = os.getenv("QDRANT_PRODUCTS_COLLECTION", "olist_products_semantic")
+# HNSW / quantization / on-disk profile per collection (applied on creation and at query time)
+QDRANT_REVIEWS_PROFILE = profile_for(QDRANT_COLLECTION)
+QDRANT_PRODUCTS_PROFILE = profile_for(QDRANT_PRODUCTS_COLLECTION)
+# hybrid: dense + BM25 sparse prefetch fused with RRF in Qdrant (dense for collections without sparse vectors)
+QDRANT_SEARCH_MODE = os.getenv("QDRANT_SEARCH_MODE", "hybrid").strip().lower()
+QDRANT_HYBRID_PREFETCH = int(os.getenv("QDRANT_HYBRID_PREFETCH", "20"))  # candidates per branch before fusion
+QDRANT_BATCH_MAX_QUERIES = int(os.getenv("QDRANT_BATCH_MAX_QUERIES", "1000"))  # per /qdrant/search/batch call
 headers = {"Content-Type": "application/json"}
 if QDRANT_API_KEY:
     headers["Authorization"] = f"Bearer {QDRANT_API_KEY}"
@@ -212,9 +376,24 @@ if QDRANT_API_KEY:
 @app.on_event("startup")
 async def startup_event():
     """Initialize the agent on startup - optimized for fast Cloud Run startup"""
-    global agent, db, llm, toolkit, sql_chain, qdrant_client, vectorstore, retriever, agent_a, rag_chain, embeddings, QDRANT_API_KEY, QDRANT_URL, headers, reviews_df, sql_rag_agent, qdrant_rag_agent
+    global agent, db, llm, toolkit, sql_chain, qdrant_client, async_qdrant_client, vectorstore, retriever, agent_a, rag_chain, embeddings, QDRANT_API_KEY, QDRANT_URL, headers, reviews_df, sql_rag_agent, qdrant_rag_agent, answer_cache, schema_digest
 
     logger.info("🚀 Starting FastAPI application...")
+
+    # Answer cache is local and cheap to open; initialize it in both startup modes
+    if ANSWER_CACHE_ENABLED:
+        try:
+            answer_cache = AnswerCache(
+                path=ANSWER_CACHE_PATH,
+                similarity_threshold=ANSWER_CACHE_SIMILARITY,
+                ttl_seconds=ANSWER_CACHE_TTL,
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                source_db_path=os.getenv("SQLITE_DB_PATH", "olist.db"),
+            )
+            logger.info(f"✅ Answer cache ready at {ANSWER_CACHE_PATH}")
+        except Exception as ce:
+            logger.warning(f"⚠️  Answer cache disabled: {ce}")
+            answer_cache = None
     
     # Skip heavy initialization on Cloud Run - do lazy loading instead
     if os.getenv("DISABLE_INGEST") == "1":
@@ -227,7 +406,7 @@ async def startup_event():
                 temperature=float(os.getenv("LLM_TEMPERATURE", "0")),
                 api_key=os.getenv("OPENAI_API_KEY")
             )
-            embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+            embeddings = build_embeddings()
             logger.info("✅ LLM and embeddings initialized")
             
             # Initialize SQL Database (fast - connects to existing olist.db)
@@ -237,8 +416,9 @@ async def startup_event():
                 
                 if os.path.exists(sqlite_db_path):
                     db = SQLDatabase.from_uri(db_uri, sample_rows_in_table_info=3)
-                    sql_chain = SimpleSQLQueryChain(llm, db)
-                    sql_rag_agent = SQLRagAgent(db, llm, sql_chain)
+                    schema_digest = build_schema_digest(sqlite_db_path)
+                    sql_chain = SimpleSQLQueryChain(llm, db, sql_cache=sql_cache, schema_digest=schema_digest)
+                    sql_rag_agent = SQLRagAgent(db, llm, sql_chain, engine=SQL_ENGINE)
                     logger.info("✅ SQL RAG agent initialized")
                 else:
                     logger.warning(f"⚠️  SQLite database not found at {sqlite_db_path}")
@@ -259,8 +439,17 @@ async def startup_event():
                     prefer_grpc=False,
                     api_key=QDRANT_API_KEY if QDRANT_API_KEY else None
                 )
+                # Async twin used by the non-blocking /chat path
+                async_qdrant_client = AsyncQdrantClient(
+                    url=QDRANT_URL,
+                    timeout=3,
+                    prefer_grpc=False,
+                    api_key=QDRANT_API_KEY if QDRANT_API_KEY else None
+                )
                 
-                # Initialize vectorstore (points to existing collection, no upload)
+                # Initialize vectorstore (points to existing collection, no upload);
+                # queries must be embedded at the collection's vector size
+                embeddings = embeddings_for_collection(qdrant_client, QDRANT_COLLECTION, embeddings)
                 from langchain_qdrant import QdrantVectorStore
                 vectorstore = QdrantVectorStore(
                     client=qdrant_client,
@@ -270,8 +459,10 @@ async def startup_event():
                 logger.info("✅ Qdrant vectorstore initialized")
                 
                 # Initialize RAG agents with existing vectorstore
-                qdrant_rag_agent = QdrantRagAgent(vectorstore, llm, embeddings)
+                qdrant_rag_agent = QdrantRagAgent(vectorstore, llm, embeddings, async_client=async_qdrant_client)
                 logger.info("✅ Qdrant RAG agent initialized")
+                # checks for BM25 sparse vectors and loads the BM25 model once, off the request path
+                sparse_encoder_for(qdrant_client, QDRANT_COLLECTION)
             except Exception as qe:
                 logger.warning(f"⚠️  Qdrant initialization failed (will use lazy init): {qe}")
                 qdrant_rag_agent = None
@@ -366,7 +557,8 @@ async def startup_event():
             api_key=os.getenv("OPENAI_API_KEY")
         )
         # Lightweight SQL generation chain implemented locally to avoid version mismatch
-        sql_chain = SimpleSQLQueryChain(llm, db)
+        schema_digest = build_schema_digest(sqlite_db_path)
+        sql_chain = SimpleSQLQueryChain(llm, db, sql_cache=sql_cache, schema_digest=schema_digest)
         logger.info("SQL Database and chain initialized with SQLite3")
     except Exception as e:
         logger.exception("Failed to initialize SQL components: %s", e)
@@ -379,7 +571,7 @@ async def startup_event():
         collection_name = QDRANT_COLLECTION
         
         # Initialize embeddings first (fast operation)
-        embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+        embeddings = build_embeddings()
         
         # Check if Qdrant is reachable (reduced timeout for faster startup)
         try:
@@ -390,6 +582,12 @@ async def startup_event():
                 api_key=QDRANT_API_KEY if QDRANT_API_KEY else None
             )
             collections_response = qdrant_client.get_collections()
+            async_qdrant_client = AsyncQdrantClient(
+                url=QDRANT_URL,
+                timeout=3,
+                prefer_grpc=False,
+                api_key=QDRANT_API_KEY if QDRANT_API_KEY else None
+            )
             qdrant_connected = True
             logger.info(f"✅ Qdrant connected")
         except Exception as e:
@@ -397,6 +595,7 @@ async def startup_event():
             logger.warning(f"⚠️  Could not connect to Qdrant during startup: {e}")
             logger.warning("Application will continue without Qdrant (lazy init on first use)")
             qdrant_client = None
+            async_qdrant_client = None
             vectorstore = None
             # Skip Qdrant initialization but continue with RAG agents setup
         
@@ -406,6 +605,7 @@ async def startup_event():
             
             if collection_exists:
                 logger.info(f"📦 Collection '{collection_name}' already exists. Loading existing collection...")
+                embeddings = embeddings_for_collection(qdrant_client, collection_name, embeddings)
                 # Load existing collection WITHOUT re-uploading documents
                 from langchain_qdrant import QdrantVectorStore
                 vectorstore = QdrantVectorStore(
@@ -414,6 +614,8 @@ async def startup_event():
                     embedding=embeddings
                 )
                 logger.info(f"✅ Loaded existing collection: {collection_name}")
+                # range filters rely on these; a no-op once they exist
+                ensure_indexes(qdrant_client, collection_name)
             else:
                 if DISABLE_INGEST:
                     logger.warning(
@@ -450,15 +652,20 @@ async def startup_event():
                     
                     logger.info(f"Created {len(chunked_documents)} document chunks")
                     
-                    # Create collection with documents
+                    # Create collection with documents (storage layout from the collection profile)
                     from langchain_qdrant import QdrantVectorStore
                     qdrant_kwargs = {
                         "documents": chunked_documents,
-                        "embedding": embeddings,
+                        # bulk ingest bypasses the query cache
+                        "embedding": uncached(embeddings),
                         "collection_name": collection_name,
                         "url": QDRANT_URL,
                         "prefer_grpc": False,
                         "force_recreate": False,
+                        # hand the token batcher enough texts to pack full requests
+                        "batch_size": EMBED_BATCH_MAX_ITEMS,
+                        "vector_params": QDRANT_REVIEWS_PROFILE.vector_params(),
+                        "collection_create_options": QDRANT_REVIEWS_PROFILE.collection_create_options(),
                     }
                     
                     if QDRANT_API_KEY and QDRANT_URL and QDRANT_URL.lower().startswith("https"):
@@ -467,7 +674,14 @@ async def startup_event():
                         logger.warning("QDRANT_API_KEY is set but QDRANT_URL is not HTTPS. Not sending API key.")
                     
                     vectorstore = QdrantVectorStore.from_documents(**qdrant_kwargs)
+                    # searches through the store use the cached query embeddings
+                    vectorstore = QdrantVectorStore(
+                        client=qdrant_client,
+                        collection_name=collection_name,
+                        embedding=embeddings
+                    )
                     logger.info(f"✅ Successfully stored {len(chunked_documents)} documents to collection: {collection_name}")
+                    ensure_indexes(qdrant_client, collection_name)
                     
                 except FileNotFoundError:
                     logger.warning(f"Reviews CSV not found at {reviews_csv_path}. Collection will be empty.")
@@ -480,14 +694,14 @@ async def startup_event():
 
             # Initialize products semantic collection (optional)
             try:
-                products_collection = os.getenv("QDRANT_PRODUCTS_COLLECTION", "olist_products_semantic")
+                products_collection = QDRANT_PRODUCTS_COLLECTION
                 exists_products = any(c.name == products_collection for c in qdrant_client.get_collections().collections)
                 from langchain_qdrant import QdrantVectorStore as QdrantVS
                 if exists_products:
                     vectorstore_products = QdrantVS(
                         client=qdrant_client,
                         collection_name=products_collection,
-                        embeddings=embeddings,
+                        embedding=embeddings_for_collection(qdrant_client, products_collection, embeddings),
                     )
                     logger.info(f"✅ Loaded products semantic collection: {products_collection}")
                 else:
@@ -511,15 +725,24 @@ async def startup_event():
                                     "product_description_length": r.get("product_description_length", None),
                                 }
                                 docs.append(Document(page_content=text, metadata=meta))
-                            vectorstore_products = QdrantVS.from_documents(
+                            QdrantVS.from_documents(
                                 documents=docs,
-                                embedding=embeddings,
+                                embedding=uncached(embeddings),
                                 collection_name=products_collection,
                                 url=QDRANT_URL,
                                 prefer_grpc=False,
                                 api_key=QDRANT_API_KEY if (QDRANT_API_KEY and QDRANT_URL.lower().startswith("https")) else None,
+                                batch_size=EMBED_BATCH_MAX_ITEMS,
+                                vector_params=QDRANT_PRODUCTS_PROFILE.vector_params(),
+                                collection_create_options=QDRANT_PRODUCTS_PROFILE.collection_create_options(),
+                            )
+                            vectorstore_products = QdrantVS(
+                                client=qdrant_client,
+                                collection_name=products_collection,
+                                embedding=embeddings,
                             )
                             logger.info(f"✅ Created products semantic collection '{products_collection}' with {len(dfp)} items")
+                            ensure_indexes(qdrant_client, products_collection)
                         except Exception as pe:
                             logger.warning(f"Failed to create products collection: {pe}")
                             vectorstore_products = None
@@ -528,18 +751,20 @@ async def startup_event():
     except Exception as e:
         logger.exception(f"❌ Error initializing Qdrant vector store: {e}")
         qdrant_client = None
+        async_qdrant_client = None
         vectorstore = None
 
     # Initialize RAG Agents (must be inside startup_event where variables are defined)
     if llm and db and sql_chain:
-        sql_rag_agent = SQLRagAgent(db, llm, sql_chain)
+        sql_rag_agent = SQLRagAgent(db, llm, sql_chain, engine=SQL_ENGINE)
         logger.info("✅ SQL RAG Agent initialized")
     else:
         logger.warning("⚠️  SQL RAG Agent not initialized (missing llm, db, or sql_chain)")
 
     if vectorstore and llm and embeddings:
-        qdrant_rag_agent = QdrantRagAgent(vectorstore, llm, embeddings)
+        qdrant_rag_agent = QdrantRagAgent(vectorstore, llm, embeddings, async_client=async_qdrant_client)
         logger.info("✅ Qdrant RAG Agent initialized")
+        sparse_encoder_for(qdrant_client, QDRANT_COLLECTION)
     else:
         logger.warning("⚠️  Qdrant RAG Agent not initialized (missing vectorstore, llm, or embeddings)")
 
@@ -554,19 +779,25 @@ class SimpleSQLQueryChain:
     """Minimal wrapper to generate a single SELECT SQL statement using LLM.
 
     This avoids depending on moving targets in langchain.chains.
+
+    With a SQLGenerationCache attached, a question that was already answered
+    (same normalized text, same schema) returns the stored SQL without an LLM
+    call. Callers report successful executions back through remember().
+
+    With a SchemaDigest attached, the prompt only carries the tables and
+    columns relevant to the question instead of the full get_table_info().
     """
-    def __init__(self, llm: ChatOpenAI, db: SQLDatabase):
+    def __init__(self, llm: ChatOpenAI, db: SQLDatabase, sql_cache: Optional[SQLGenerationCache] = None,
+                 schema_digest: Optional[SchemaDigest] = None):
         self.llm = llm
         self.db = db
+        self.sql_cache = sql_cache
+        self.schema_digest = schema_digest
 
-    def invoke(self, inputs):
-        question = inputs.get("question") if isinstance(inputs, dict) else str(inputs)
-        try:
-            schema = self.db.get_table_info()
-        except Exception:
-            schema = ""
-        prompt = f"""
+    def _build_prompt(self, question: str, schema: str) -> str:
+        return f"""
 You are a SQL assistant for SQLite. Given the schema and the user's question, output ONLY a single valid SELECT SQL query. No narration.
+When a pre-aggregated table (category_stats, monthly_sales, seller_stats, order_item_full) can answer the question, query it instead of joining the base tables.
 
 Schema:
 {schema}
@@ -576,7 +807,50 @@ Question:
 
 SQL:
 """.strip()
-        return self.llm.predict(prompt)
+
+    def _get_schema(self, question: str = "") -> str:
+        try:
+            if self.schema_digest is not None:
+                return self.schema_digest.render(question)
+            return self.db.get_table_info()
+        except Exception:
+            return ""
+
+    def _fingerprint(self) -> str:
+        if self.schema_digest is not None:
+            self.schema_digest.refresh()
+            return self.schema_digest.fingerprint
+        return schema_fingerprint(os.getenv("SQLITE_DB_PATH", "olist.db"))
+
+    def lookup(self, question: str) -> Optional[str]:
+        """Return memoized SQL for the question, or None."""
+        if self.sql_cache is None:
+            return None
+        return self.sql_cache.get(question, self._fingerprint())
+
+    def remember(self, question: str, sql: str):
+        """Record SQL that executed successfully for this question."""
+        if self.sql_cache is not None:
+            self.sql_cache.put(question, self._fingerprint(), sql)
+
+    def invoke(self, inputs):
+        question = inputs.get("question") if isinstance(inputs, dict) else str(inputs)
+        cached = self.lookup(question)
+        if cached:
+            logger.info(f"⚡ SQL cache hit: {cached}")
+            return cached
+        schema = self._get_schema(question)
+        return self.llm.predict(self._build_prompt(question, schema))
+
+    async def ainvoke(self, inputs):
+        """Async variant of invoke(); schema introspection runs in a worker thread."""
+        question = inputs.get("question") if isinstance(inputs, dict) else str(inputs)
+        cached = await asyncio.to_thread(self.lookup, question)
+        if cached:
+            logger.info(f"⚡ SQL cache hit: {cached}")
+            return cached
+        schema = await asyncio.to_thread(self._get_schema, question)
+        return await self.llm.apredict(self._build_prompt(question, schema))
 
 
 # ================= AGENTIC RAG SYSTEMS =================
@@ -604,15 +878,150 @@ def normalize_category(query: str) -> str:
     return None
 
 
+def ensure_indexes(client, collection_name: str):
+    """Create the payload indexes declared for a collection (idempotent; failures only logged)."""
+    try:
+        actions = ensure_payload_indexes(client, collection_name)
+        created = [field for field, action in actions.items() if action != "ok"]
+        if created:
+            logger.info(f"🗂️  Payload indexes on '{collection_name}': {', '.join(created)}")
+    except Exception as e:
+        logger.warning(f"⚠️  Could not create payload indexes on '{collection_name}': {e}")
+
+
+def build_qdrant_filter(collection_name: str, query: str):
+    """(category, range constraints, Filter or None) for a question.
+
+    Rating / review-count phrases become range conditions on the collection's
+    indexed payload fields (create_qdrant_index.PAYLOAD_INDEXES), so Qdrant
+    applies them during the search.
+    """
+    normalized_cat = normalize_category(query)
+    query_filter = None
+    if normalized_cat:
+        logger.info(f"✅ Category identified: {query} -> {normalized_cat}")
+        query_filter = models.Filter(must=[
+            models.FieldCondition(key="product_category", match=models.MatchValue(value=normalized_cat))
+        ])
+    constraints = parse_range_constraints(query)
+    conditions = range_conditions(collection_name, constraints)
+    if constraints:
+        if conditions:
+            logger.info(f"🎯 Range filter on '{collection_name}': {describe_constraints(constraints)}")
+        else:
+            logger.warning(f"⚠️  '{collection_name}' has no indexed field for {list(constraints)}; range ignored")
+    return normalized_cat, constraints, merge_filter(query_filter, conditions)
+
+
+# collection -> BM25 encoder, or None when the collection has no sparse vector
+_sparse_encoders = {}
+
+
+def sparse_encoder_for(client, collection_name: str):
+    """BM25 encoder for a collection built with sparse vectors (upload_to_qdrant.py), else None."""
+    if collection_name not in _sparse_encoders:
+        try:
+            available = client is not None and has_sparse_vector(client, collection_name)
+        except Exception as e:
+            logger.warning(f"⚠️  Could not check sparse vectors of '{collection_name}': {e}")
+            return None
+        encoder = bm25_encoder() if available else None
+        if available and encoder is None:
+            logger.warning(f"⚠️  '{collection_name}' has BM25 vectors but no BM25 model was found; dense search only")
+        elif encoder is not None:
+            logger.info(f"🔤 Hybrid dense + BM25 search available on '{collection_name}' ({encoder.model})")
+        _sparse_encoders[collection_name] = encoder
+    return _sparse_encoders[collection_name]
+
+
+def sparse_query(client, collection_name: str, query: str, mode: Optional[str] = None):
+    """BM25 query vector when a hybrid search applies, else None (dense search)."""
+    if (mode or QDRANT_SEARCH_MODE) != "hybrid":
+        return None
+    encoder = sparse_encoder_for(client, collection_name)
+    sparse = encoder.encode_query(query) if encoder else None
+    return sparse if sparse is not None and sparse.indices else None
+
+
+def qdrant_query_kwargs(collection_name: str, dense, sparse, query_filter, search_params, limit: int) -> dict:
+    """query_points() kwargs: dense search, or dense + BM25 prefetch fused with RRF when sparse is given."""
+    kwargs = dict(collection_name=collection_name, limit=limit, with_payload=True)
+    if sparse is None:
+        return {**kwargs, "query": dense, "query_filter": query_filter, "search_params": search_params}
+    prefetch = hybrid_prefetch(dense, sparse, max(limit, QDRANT_HYBRID_PREFETCH), query_filter, search_params)
+    return {**kwargs, "prefetch": prefetch, "query": fusion_query()}
+
+
+def qdrant_query_request(dense, sparse, query_filter, search_params, limit: int) -> models.QueryRequest:
+    """qdrant_query_kwargs() as one QueryRequest of a query_batch_points() call."""
+    if sparse is None:
+        return models.QueryRequest(query=dense, filter=query_filter, params=search_params, limit=limit,
+                                   with_payload=True)
+    prefetch = hybrid_prefetch(dense, sparse, max(limit, QDRANT_HYBRID_PREFETCH), query_filter, search_params)
+    return models.QueryRequest(prefetch=prefetch, query=fusion_query(), limit=limit, with_payload=True)
+
+
 # ================= SQL RAG AGENT =================
 class SQLRagAgent:
     """RAG Agent for SQL database queries and analysis."""
     
-    def __init__(self, db, llm, sql_chain):
+    def __init__(self, db, llm, sql_chain, engine: str = "sqlite"):
         self.db = db
         self.llm = llm
         self.sql_chain = sql_chain
+        self.engine = engine
+
+    @staticmethod
+    def _clean_sql(text: str) -> str:
+        """Strip markdown fences, 'SQLQuery:' labels and the trailing ';' from LLM output."""
+        cleaned = re.sub(r"```sql|```", "", text, flags=re.IGNORECASE).strip()
+        cleaned = re.sub(r"^SQLQuery:\s*", "", cleaned, flags=re.IGNORECASE).strip()
+        cleaned = re.sub(r"^\s*\n", "", cleaned).strip()
+        return strip_terminator(cleaned)
+
+    def _use_duckdb(self, sql: str) -> bool:
+        if self.engine == "sqlite" or duckdb_engine is None or not duckdb_engine.available():
+            return False
+        return self.engine == "duckdb" or is_analytical(sql)
+
+    def _run(self, sql: str):
+        """(columns, rows, truncated) from DuckDB for aggregates when enabled, else SQLite."""
+        if self._use_duckdb(sql):
+            try:
+                return duckdb_engine.execute(sql, sql_governor.max_rows, sql_governor.time_budget_s)
+            except QueryAbortedError:
+                raise
+            except Exception as e:
+                # Usually SQLite-only syntax (julianday, strftime argument order); SQLite handles it
+                logger.info(f"↩️ DuckDB could not run query, falling back to SQLite: {e}")
+        return sql_governor.execute(sqlite_pool.reader(), sql)
+
+    def _execute(self, sql: str) -> str:
+        """Run SQL under the governor and format the result (blocking)."""
+        columns, rows, truncated = self._run(sql)
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        
+        if df.empty:
+            return "Query returned no results."
+        
+        # Format results
+        result = f"SQL Query Results ({len(df)} rows):\n\n"
+        result += df.to_string(index=False, max_rows=10)
+        
+        if len(df) > 10:
+            result += f"\n\n... and {len(df) - 10} more rows"
+        if truncated:
+            result += f"\n\n(Result capped at {sql_governor.max_rows} rows)"
+        
+        return result
         
+    def _execute_generated(self, question: Optional[str], sql: str) -> str:
+        """Execute SQL and, if it was generated from a question, memoize it on success."""
+        result = self._execute(sql)
+        if question is not None and hasattr(self.sql_chain, "remember"):
+            self.sql_chain.remember(question, sql)
+        return result
+
     def query(self, question: str) -> str:
         """Execute SQL query based on natural language question."""
         if not self.db or not self.sql_chain:
@@ -620,12 +1029,13 @@ class SQLRagAgent:
         
         try:
             # Clean markdown code blocks
-            import re
             cleaned = question.strip()
             cleaned = re.sub(r"```sql|```", "", cleaned, flags=re.IGNORECASE).strip()
+            nl_question = None
             
             # Generate SQL if natural language
             if not cleaned.upper().startswith("SELECT"):
+                nl_question = cleaned
                 try:
                     generated_sql = self.sql_chain.invoke({"question": cleaned})
                     if isinstance(generated_sql, str):
@@ -634,42 +1044,47 @@ class SQLRagAgent:
                 except Exception as e:
                     return f"Error generating SQL: {str(e)}"
             
-            # Clean markdown from generated SQL
-            cleaned = re.sub(r"```sql|```", "", cleaned, flags=re.IGNORECASE).strip()
-            cleaned = re.sub(r"^SQLQuery:\s*", "", cleaned, flags=re.IGNORECASE).strip()
-            cleaned = re.sub(r"^\s*\n", "", cleaned).strip()
-            
-            # Execute SQL
-            sqlite_db_path = os.getenv("SQLITE_DB_PATH", "olist.db")
-            conn = sqlite3.connect(sqlite_db_path)
-            df = pd.read_sql_query(cleaned, conn)
-            conn.close()
+            return self._execute_generated(nl_question, self._clean_sql(cleaned))
             
-            if df.empty:
-                return "Query returned no results."
-            
-            # Format results
-            result = f"SQL Query Results ({len(df)} rows):\n\n"
-            result += df.to_string(index=False, max_rows=10)
+        except QueryAbortedError as e:
+            logger.warning(f"⛔ SQL aborted ({e.reason}): {e.message}")
+            return e.to_context()
+        except Exception as e:
+            logger.exception("SQL query error")
+            return f"SQL Error: {str(e)}"
+
+    async def aquery(self, question: str) -> str:
+        """Async variant of query(): awaits the LLM and runs SQLite off the event loop."""
+        if not self.db or not self.sql_chain:
+            return "SQL database not initialized."
+        
+        try:
+            cleaned = question.strip()
+            cleaned = re.sub(r"```sql|```", "", cleaned, flags=re.IGNORECASE).strip()
+            nl_question = None
             
-            if len(df) > 10:
-                result += f"\n\n... and {len(df) - 10} more rows"
+            if not cleaned.upper().startswith("SELECT"):
+                nl_question = cleaned
+                try:
+                    generated_sql = await self.sql_chain.ainvoke({"question": cleaned})
+                    if isinstance(generated_sql, str):
+                        cleaned = generated_sql
+                    logger.info(f"Generated SQL: {cleaned}")
+                except Exception as e:
+                    return f"Error generating SQL: {str(e)}"
             
-            return result
+            return await asyncio.to_thread(self._execute_generated, nl_question, self._clean_sql(cleaned))
             
+        except QueryAbortedError as e:
+            logger.warning(f"⛔ SQL aborted ({e.reason}): {e.message}")
+            return e.to_context()
         except Exception as e:
             logger.exception("SQL query error")
             return f"SQL Error: {str(e)}"
-    
-    def analyze(self, query: str) -> str:
-        """Analyze data and provide insights."""
-        raw_data = self.query(query)
-        
-        if "Error" in raw_data or "not initialized" in raw_data:
-            return raw_data
-        
-        # Use LLM to generate insights
-        prompt = f"""
+
+    @staticmethod
+    def _analysis_prompt(query: str, raw_data: str) -> str:
+        return f"""
 Analyze the following SQL query results and provide business insights:
 
 User Question: {query}
@@ -684,141 +1099,184 @@ Provide:
 
 Keep the analysis concise and actionable.
 """
+    
+    def analyze(self, query: str) -> str:
+        """Analyze data and provide insights."""
+        raw_data = self.query(query)
+        
+        if "Error" in raw_data or "not initialized" in raw_data or raw_data.startswith("SQL Query Aborted"):
+            return raw_data
+        
+        # Use LLM to generate insights
         try:
-            response = self.llm.predict(prompt)
+            response = self.llm.predict(self._analysis_prompt(query, raw_data))
             return response
         except Exception as e:
             return f"Analysis error: {str(e)}"
 
+    async def aanalyze(self, query: str) -> str:
+        """Async variant of analyze()."""
+        raw_data = await self.aquery(query)
+        
+        if "Error" in raw_data or "not initialized" in raw_data or raw_data.startswith("SQL Query Aborted"):
+            return raw_data
+        
+        try:
+            return await self.llm.apredict(self._analysis_prompt(query, raw_data))
+        except Exception as e:
+            return f"Analysis error: {str(e)}"
+
 
 # ================= QDRANT RAG AGENT =================
 class QdrantRagAgent:
     """RAG Agent for Qdrant vector search and review analysis."""
     
-    def __init__(self, vectorstore, llm, embeddings):
+    def __init__(self, vectorstore, llm, embeddings, async_client=None):
         self.vectorstore = vectorstore
         self.llm = llm
         self.embeddings = embeddings
+        # Optional AsyncQdrantClient; asearch() falls back to the sync client in a thread
+        self.async_client = async_client
+
+    def _prepare_search(self, query: str):
+        """Detect the category and rating / review-count constraints and build the matching Qdrant filter."""
+        normalized_cat, _, query_filter = build_qdrant_filter(self.vectorstore.collection_name, query)
+        if not normalized_cat:
+            logger.info(f"ℹ️  No specific category detected in query: {query}")
+        return normalized_cat, query_filter
+
+    def _format_results(self, query: str, normalized_cat, search_results) -> str:
+        """Turn raw Qdrant points into the text context used for synthesis."""
+        logger.info(f"Found {len(search_results)} results from Qdrant")
+        if normalized_cat:
+            logger.info(f"📊 Filtered by category: {normalized_cat}")
         
-    def search(self, query: str, k: int = 5) -> str:
-        """Search for relevant reviews."""
+        # Convert Qdrant results to Document-like format
+        from langchain_core.documents import Document
+        results = []
+        for hit in search_results:
+            payload = hit.payload or {}
+            # Use 'text' field as page_content
+            page_content = payload.get('text', '')
+            # Keep other fields as metadata
+            metadata = {k: v for k, v in payload.items() if k != 'text'}
+            metadata['_id'] = hit.id
+            metadata['_score'] = hit.score
+            results.append(Document(page_content=page_content, metadata=metadata))
+        
+        if not results:
+            category_info = f" (category: {normalized_cat})" if normalized_cat else ""
+            return f"No reviews found for: {query}{category_info}"
+        
+        # Filter by category if normalized
+        if normalized_cat:
+            filtered = []
+            for doc in results:
+                # Check both field names: product_category (from olist_products) and product_category_name (from olist_reviews)
+                cat = doc.metadata.get("product_category", doc.metadata.get("product_category_name", ""))
+                if cat and normalized_cat.lower() in cat.lower():
+                    filtered.append(doc)
+            if filtered:
+                results = filtered
+                logger.info(f"📊 After category filter: {len(results)} results in category: {normalized_cat}")
+            else:
+                logger.warning(f"⚠️  Category filter removed all results. Using unfiltered results.")
+                # Don't filter if it removes everything - the Qdrant filter already constrained results
+        
+        # Format response - adapted for merged product format
+        category_header = f"[Searching in category: {normalized_cat}]\n\n" if normalized_cat else ""
+        review_texts = [category_header] if normalized_cat else []
+        for i, doc in enumerate(results[:5], 1):
+            meta = doc.metadata
+            # Handle both individual review format and merged product format
+            if 'review_score' in meta:
+                # Individual review format
+                review_texts.append(
+                    f"Review {i}:\n"
+                    f"Score: {meta.get('review_score', 'N/A')}/5\n"
+                    f"Content: {doc.page_content[:300]}...\n"
+                )
+            else:
+                # Merged product format
+                review_texts.append(
+                    f"Product {i}:\n"
+                    f"Category: {meta.get('product_category', 'N/A')} ({meta.get('product_category_en', 'N/A')})\n"
+                    f"Average Score: {meta.get('avg_review_score', 'N/A')}/5\n"
+                    f"Number of Reviews: {meta.get('num_reviews', 'N/A')}\n"
+                    f"Content: {doc.page_content[:500]}...\n"
+                )
+        
+        return "\n".join(review_texts)
+        
+    def _query_kwargs(self, query: str, query_embedding, query_filter, k: int, mode: Optional[str]) -> dict:
+        collection_name = self.vectorstore.collection_name
+        sparse = sparse_query(self.vectorstore.client, collection_name, query, mode)
+        logger.info(f"🔎 Qdrant {'hybrid (dense + BM25)' if sparse is not None else 'dense'} search")
+        # over-fetch candidates with their vectors for the local rerank
+        limit = max(k, RERANK_CANDIDATES) if RERANK_ENABLED else k
+        kwargs = qdrant_query_kwargs(collection_name, query_embedding, sparse, query_filter,
+                                     QDRANT_REVIEWS_PROFILE.search_params(), limit)
+        if RERANK_ENABLED:
+            kwargs["with_vectors"] = True
+        return kwargs
+
+    def _rerank(self, query: str, query_embedding, points, k: int) -> list:
+        """The best min(k, RERANK_TOP_N) of the over-fetched points (rerank.py)."""
+        if not RERANK_ENABLED:
+            return points[:k]
+        encoder = sparse_encoder_for(self.vectorstore.client, self.vectorstore.collection_name)
+        kept = rerank(query, query_embedding, points, top_n=min(k, RERANK_TOP_N), idf=encoder.idf if encoder else None)
+        logger.info(f"🏅 Reranked {len(points)} candidates -> {len(kept)}")
+        return kept
+
+    def search(self, query: str, k: int = 5, mode: Optional[str] = None) -> str:
+        """Search for relevant reviews (mode: "dense" | "hybrid", default QDRANT_SEARCH_MODE)."""
         if not self.vectorstore:
             return "Qdrant vector store not initialized."
         
         try:
-            # Normalize category if present
-            normalized_cat = normalize_category(query)
-            if normalized_cat:
-                logger.info(f"✅ Category identified: {query} -> {normalized_cat}")
-            else:
-                logger.info(f"ℹ️  No specific category detected in query: {query}")
+            normalized_cat, query_filter = self._prepare_search(query)
             
             # Use raw Qdrant search since vectorstore doesn't populate page_content from existing collection
             # Get embedding for query
             query_embedding = self.embeddings.embed_query(query)
             
-            # Search using Qdrant client directly
-            from qdrant_client import QdrantClient
-            from qdrant_client.models import Filter, FieldCondition, MatchValue
-            qdrant_client = self.vectorstore.client
-            collection_name = self.vectorstore.collection_name
-            
-            # Build query filter if category is detected
-            query_filter = None
-            if normalized_cat:
-                query_filter = Filter(
-                    must=[
-                        FieldCondition(
-                            key="product_category",
-                            match=MatchValue(value=normalized_cat)
-                        )
-                    ]
-                )
-                logger.info(f"🔍 Applying Qdrant filter for category: {normalized_cat}")
-            
-            search_results = qdrant_client.query_points(
-                collection_name=collection_name,
-                query=query_embedding,
-                query_filter=query_filter,
-                limit=k,
-                with_payload=True
+            search_results = self.vectorstore.client.query_points(
+                **self._query_kwargs(query, query_embedding, query_filter, k, mode)
             ).points
+            search_results = self._rerank(query, query_embedding, search_results, k)
             
-            logger.info(f"Found {len(search_results)} results from Qdrant")
-            if normalized_cat:
-                logger.info(f"📊 Filtered by category: {normalized_cat}")
-            
-            # Convert Qdrant results to Document-like format
-            from langchain_core.documents import Document
-            results = []
-            for hit in search_results:
-                payload = hit.payload or {}
-                # Use 'text' field as page_content
-                page_content = payload.get('text', '')
-                # Keep other fields as metadata
-                metadata = {k: v for k, v in payload.items() if k != 'text'}
-                metadata['_id'] = hit.id
-                metadata['_score'] = hit.score
-                results.append(Document(page_content=page_content, metadata=metadata))
-            
-            if not results:
-                category_info = f" (category: {normalized_cat})" if normalized_cat else ""
-                return f"No reviews found for: {query}{category_info}"
+            return self._format_results(query, normalized_cat, search_results)
             
-            # Filter by category if normalized
-            if normalized_cat:
-                filtered = []
-                for doc in results:
-                    # Check both field names: product_category (from olist_products) and product_category_name (from olist_reviews)
-                    cat = doc.metadata.get("product_category", doc.metadata.get("product_category_name", ""))
-                    if cat and normalized_cat.lower() in cat.lower():
-                        filtered.append(doc)
-                if filtered:
-                    results = filtered
-                    logger.info(f"📊 After category filter: {len(results)} results in category: {normalized_cat}")
-                else:
-                    logger.warning(f"⚠️  Category filter removed all results. Using unfiltered results.")
-                    # Don't filter if it removes everything - the Qdrant filter already constrained results
+        except Exception as e:
+            logger.exception("Qdrant search error")
+            return f"Search error: {str(e)}"
+
+    async def asearch(self, query: str, k: int = 5, mode: Optional[str] = None) -> str:
+        """Async variant of search(): awaits the embedding call and the Qdrant query."""
+        if not self.vectorstore:
+            return "Qdrant vector store not initialized."
+        
+        try:
+            normalized_cat, query_filter = self._prepare_search(query)
+            query_embedding = await self.embeddings.aembed_query(query)
             
-            # Format response - adapted for merged product format
-            category_header = f"[Searching in category: {normalized_cat}]\n\n" if normalized_cat else ""
-            review_texts = [category_header] if normalized_cat else []
-            for i, doc in enumerate(results[:5], 1):
-                meta = doc.metadata
-                # Handle both individual review format and merged product format
-                if 'review_score' in meta:
-                    # Individual review format
-                    review_texts.append(
-                        f"Review {i}:\n"
-                        f"Score: {meta.get('review_score', 'N/A')}/5\n"
-                        f"Content: {doc.page_content[:300]}...\n"
-                    )
-                else:
-                    # Merged product format
-                    review_texts.append(
-                        f"Product {i}:\n"
-                        f"Category: {meta.get('product_category', 'N/A')} ({meta.get('product_category_en', 'N/A')})\n"
-                        f"Average Score: {meta.get('avg_review_score', 'N/A')}/5\n"
-                        f"Number of Reviews: {meta.get('num_reviews', 'N/A')}\n"
-                        f"Content: {doc.page_content[:500]}...\n"
-                    )
+            search_kwargs = self._query_kwargs(query, query_embedding, query_filter, k, mode)
+            if self.async_client is not None:
+                response = await self.async_client.query_points(**search_kwargs)
+            else:
+                response = await asyncio.to_thread(self.vectorstore.client.query_points, **search_kwargs)
             
-            return "\n".join(review_texts)
+            search_results = self._rerank(query, query_embedding, response.points, k)
+            return self._format_results(query, normalized_cat, search_results)
             
         except Exception as e:
             logger.exception("Qdrant search error")
             return f"Search error: {str(e)}"
-    
-    def analyze(self, query: str) -> str:
-        """Search reviews and provide sentiment analysis."""
-        raw_reviews = self.search(query)
-        logger.info(f"Search returned {len(raw_reviews)} chars: {raw_reviews[:200]}...")
-        
-        if "Error" in raw_reviews or "not initialized" in raw_reviews:
-            return raw_reviews
-        
-        # Use LLM to analyze sentiment
-        prompt = f"""
+
+    @staticmethod
+    def _analysis_prompt(query: str, raw_reviews: str) -> str:
+        return f"""
 Analyze the following customer reviews and provide insights:
 
 User Question: {query}
@@ -834,12 +1292,35 @@ Provide a structured analysis:
 
 Use the same language as the user's question. Be concise and actionable.
 """
+    
+    def analyze(self, query: str, mode: Optional[str] = None) -> str:
+        """Search reviews and provide sentiment analysis."""
+        raw_reviews = self.search(query, mode=mode)
+        logger.info(f"Search returned {len(raw_reviews)} chars: {raw_reviews[:200]}...")
+        
+        if "Error" in raw_reviews or "not initialized" in raw_reviews:
+            return raw_reviews
+        
+        # Use LLM to analyze sentiment
         try:
-            response = self.llm.predict(prompt)
+            response = self.llm.predict(self._analysis_prompt(query, raw_reviews))
             return response
         except Exception as e:
             return f"Analysis error: {str(e)}"
 
+    async def aanalyze(self, query: str, mode: Optional[str] = None) -> str:
+        """Async variant of analyze()."""
+        raw_reviews = await self.asearch(query, mode=mode)
+        logger.info(f"Search returned {len(raw_reviews)} chars: {raw_reviews[:200]}...")
+        
+        if "Error" in raw_reviews or "not initialized" in raw_reviews:
+            return raw_reviews
+        
+        try:
+            return await self.llm.apredict(self._analysis_prompt(query, raw_reviews))
+        except Exception as e:
+            return f"Analysis error: {str(e)}"
+
 
 # ================= INITIALIZE RAG AGENTS =================
 # These will be initialized in startup_event
@@ -859,7 +1340,7 @@ def search_reviews(query: str) -> str:
     if not vectorstore:
         return "Vector store not initialized."
     try:
-        results = vectorstore.similarity_search(query, k=3)
+        results = vectorstore.similarity_search(query, k=3, search_params=QDRANT_REVIEWS_PROFILE.search_params())
         if not results:
             return "No relevant reviews found."
         response = "\n\n".join([f"Review: {d.page_content}\nMetadata: {d.metadata}" for d in results])
@@ -1009,6 +1490,7 @@ async def root():
             "sqlite_raw": "/sqlite/raw",
             "qdrant": "/qdrant",
             "chat": "/chat",
+            "cache_stats": "/cache/stats",
             "health": "/health",
             "history": "/history"
         }
@@ -1025,7 +1507,17 @@ async def upload_doc(file: UploadFile):
     docs = [text[i:i+500] for i in range(0, len(text), 500)]
     if not vectorstore:
         raise HTTPException(status_code=503, detail="Vectorstore not initialized")
-    vectorstore.add_texts(docs)
+    # embedded through the token batcher / rate limiter, bypassing the query cache
+    ingest_store = QdrantVectorStore(
+        client=vectorstore.client,
+        collection_name=vectorstore.collection_name,
+        embedding=uncached(vectorstore.embeddings),
+        vector_name=vectorstore.vector_name,
+        content_payload_key=vectorstore.content_payload_key,
+        metadata_payload_key=vectorstore.metadata_payload_key,
+        validate_collection_config=False,
+    )
+    ingest_store.add_texts(docs, batch_size=EMBED_BATCH_MAX_ITEMS)
 
     return {"status": "uploaded", "chunks": len(docs)}
 
@@ -1044,12 +1536,97 @@ async def ask_question(question: str):
     response = agent_a.run(question)
     return {"question": question, "answer": response}
 
+def df_to_markdown(dframe: pd.DataFrame, max_rows: int = 10) -> str:
+    """Small markdown table for Streamlit rendering."""
+    if dframe.empty:
+        return "No rows returned."
+    d = dframe.head(max_rows)
+    header = "| " + " | ".join(map(str, d.columns)) + " |\n"
+    sep = "| " + " | ".join(["---"] * len(d.columns)) + " |\n"
+    rows = "".join("| " + " | ".join(map(lambda x: str(x), row)) + " |\n" for row in d.values)
+    return header + sep + rows
+
+
+def validate_select_sql(sql: str) -> str:
+    """Return the stripped SQL or raise 400 unless it is a single SELECT statement.
+
+    A trailing ';' is dropped; one anywhere else is rejected.
+    """
+    if not sql or not isinstance(sql, str):
+        raise HTTPException(status_code=400, detail="Missing 'sql' query parameter")
+    sql_stripped = strip_terminator(sql.strip())
+    if ";" in sql_stripped:
+        raise HTTPException(status_code=400, detail="Multiple statements are not allowed")
+    if not sql_stripped.lower().startswith("select"):
+        raise HTTPException(status_code=400, detail="Only SELECT statements are permitted")
+    return sql_stripped
+
+
+def streaming_sql_response(sql: str, fmt: str):
+    """NDJSON / Arrow IPC response read incrementally from a dedicated SQLite cursor.
+
+    The first chunk is produced before the response starts so SQL errors still
+    map to an HTTP error status instead of a truncated stream.
+    """
+    if fmt == "arrow" and not arrow_available():
+        raise HTTPException(status_code=501, detail="Arrow output requires the optional 'pyarrow' package")
+    # Streams have no wall-clock budget (a slow client would trip it); the plan check still applies
+    sql_governor.check_plan(sqlite_pool.reader(), sql)
+    if fmt == "arrow":
+        body = stream_arrow(sqlite_pool.open_reader(), sql, exact_types=SQL_ARROW_EXACT_TYPES)
+        media_type = "application/vnd.apache.arrow.stream"
+    else:
+        body, media_type = stream_ndjson(sqlite_pool.open_reader(), sql), "application/x-ndjson"
+    first = next(body)
+    return StreamingResponse(itertools.chain([first], body), media_type=media_type)
+
+
+def sql_page_response(sql: str, page_size: Optional[int], cursor: Optional[dict]) -> dict:
+    """One JSON page of rows with a next_page_token (plan-checked, time-budgeted)."""
+    conn = sqlite_pool.reader()
+    with sql_governor.budget(conn, sql):
+        sql_governor.check_plan(conn, sql)
+        page = fetch_page(conn, sql, page_size or SQL_DEFAULT_PAGE_SIZE, cursor)
+    page["result"] = df_to_markdown(pd.DataFrame(page["rows"], columns=page["columns"]))
+    return page
+
+
+def governed_sql_response(sql: str) -> dict:
+    """Full (row-capped) result in the legacy JSON shape."""
+    columns, rows, truncated = sql_governor.execute(sqlite_pool.reader(), sql)
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    return {
+        "rows": df.to_dict(orient="records"),
+        "columns": list(df.columns),
+        "result": df_to_markdown(df),
+        "truncated": truncated,
+    }
+
+
 @app.post("/sqlite")
 # def query_sqlite(q: str = "List top 5 customers by total orders"):
-def query_sqlite(q: str = "List top 5 products from the products table"):
+def query_sqlite(
+    q: str = "List top 5 products from the products table",
+    page_size: Optional[int] = None,
+    page_token: Optional[str] = None,
+    format: Literal["json", "ndjson", "arrow"] = "json",
+):
+    """Generate SQL from a question and return rows.
+
+    - format=json without paging keeps the original response shape.
+    - page_size/page_token return one page plus next_page_token; follow-up
+      pages reuse the SQL stored in the token and skip generation.
+    - format=ndjson|arrow streams the full result incrementally.
+    """
     if not sql_chain:
         raise HTTPException(status_code=503, detail="SQL chain not initialized")
     try:
+        cursor = None
+        if page_token:
+            s, cursor = decode_page_token(page_token)
+            s = validate_select_sql(s)
+            return {"question": q, "sql": s, **sql_page_response(s, page_size, cursor)}
+
         # Generate SQL with the chain
         sql_text = sql_chain.invoke({"question": q})
         if isinstance(sql_text, dict):
@@ -1072,75 +1649,75 @@ def query_sqlite(q: str = "List top 5 products from the products table"):
         if ";" in s:
             # Keep only first statement
             s = s.split(";")[0].strip()
+        used_default = False
         if not s.lower().startswith("select"):
             # Fall back to a safe default if the chain emitted narration
             s = "SELECT product_id, product_category_name FROM products LIMIT 5"
+            used_default = True
 
-        # Execute SQL against SQLite and return rows
-        conn = sqlite3.connect(os.getenv("SQLITE_DB_PATH", "olist.db"))
-        df = pd.read_sql_query(s, conn)
-        conn.close()
+        if format != "json":
+            response = streaming_sql_response(s, format)
+        elif page_size:
+            response = {"question": q, "sql": s, **sql_page_response(s, page_size, cursor)}
+        else:
+            # Execute SQL against SQLite (pooled read-only connection, governed) and return rows
+            response = {"question": q, "sql": s, **governed_sql_response(s)}
 
-        # Build a small markdown table for Streamlit rendering
-        def df_to_markdown(dframe: pd.DataFrame, max_rows: int = 10) -> str:
-            if dframe.empty:
-                return "No rows returned."
-            d = dframe.head(max_rows)
-            header = "| " + " | ".join(map(str, d.columns)) + " |\n"
-            sep = "| " + " | ".join(["---"] * len(d.columns)) + " |\n"
-            rows = "".join("| " + " | ".join(map(lambda x: str(x), row)) + " |\n" for row in d.values)
-            return header + sep + rows
-
-        result_md = df_to_markdown(df)
-        return {
-            "question": q,
-            "sql": s,
-            "rows": df.to_dict(orient="records"),
-            "columns": list(df.columns),
-            "result": result_md
-        }
+        # Memoize the generated statement now that it is known to run
+        if not used_default:
+            sql_chain.remember(q, s)
+        return response
+    except HTTPException:
+        raise
+    except QueryAbortedError as e:
+        raise HTTPException(status_code=422, detail=e.to_dict())
+    except PageTokenError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"SQLite query error: {e}")
 
 @app.post("/sqlite/raw")
-def sqlite_raw(sql: str):
+def sqlite_raw(
+    sql: Optional[str] = None,
+    page_size: Optional[int] = None,
+    page_token: Optional[str] = None,
+    format: Literal["json", "ndjson", "arrow"] = "json",
+):
     """Execute a raw SELECT SQL safely and return rows.
 
     Notes:
     - Only single-statement SELECT queries are allowed.
-    - Rejects semicolons to prevent multiple statements.
+    - Rejects semicolons to prevent multiple statements (a trailing one is dropped).
     - Returns columns, rows, and a small markdown preview for UIs.
+    - page_size/page_token paginate; the token carries the SQL, so follow-up
+      calls may pass only page_token.
+    - format=ndjson|arrow streams rows from the cursor with flat memory.
+    - Queries run under the SQL governor: a plan check rejects full scans of
+      several large tables, JSON results are capped at SQL_MAX_ROWS, and
+      non-streaming calls are stopped after SQL_TIME_BUDGET_S. Aborts return
+      422 with a structured detail (reason, message, hint).
     """
     try:
-        if not sql or not isinstance(sql, str):
-            raise HTTPException(status_code=400, detail="Missing 'sql' query parameter")
-        sql_stripped = sql.strip()
-        if ";" in sql_stripped:
-            raise HTTPException(status_code=400, detail="Multiple statements are not allowed")
-        if not sql_stripped.lower().startswith("select"):
-            raise HTTPException(status_code=400, detail="Only SELECT statements are permitted")
-
-        conn = sqlite3.connect(os.getenv("SQLITE_DB_PATH", "olist.db"))
-        df = pd.read_sql_query(sql_stripped, conn)
-        conn.close()
-
-        def df_to_markdown(dframe: pd.DataFrame, max_rows: int = 10) -> str:
-            if dframe.empty:
-                return "No rows returned."
-            d = dframe.head(max_rows)
-            header = "| " + " | ".join(map(str, d.columns)) + " |\n"
-            sep = "| " + " | ".join(["---"] * len(d.columns)) + " |\n"
-            rows = "".join("| " + " | ".join(map(lambda x: str(x), row)) + " |\n" for row in d.values)
-            return header + sep + rows
-
-        return {
-            "sql": sql_stripped,
-            "rows": df.to_dict(orient="records"),
-            "columns": list(df.columns),
-            "result": df_to_markdown(df),
-        }
+        cursor = None
+        if page_token:
+            token_sql, cursor = decode_page_token(page_token)
+            if sql and strip_terminator(sql.strip()) != token_sql:
+                raise HTTPException(status_code=400, detail="page_token does not belong to this query")
+            sql = token_sql
+        sql_stripped = validate_select_sql(sql)
+
+        if format != "json":
+            return streaming_sql_response(sql_stripped, format)
+        if page_size or page_token:
+            return {"sql": sql_stripped, **sql_page_response(sql_stripped, page_size, cursor)}
+
+        return {"sql": sql_stripped, **governed_sql_response(sql_stripped)}
     except HTTPException:
         raise
+    except QueryAbortedError as e:
+        raise HTTPException(status_code=422, detail=e.to_dict())
+    except PageTokenError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"SQLite RAW query error: {e}")
 
@@ -1164,9 +1741,11 @@ def query_qdrant():
     return r.json()
 
 @app.post("/qdrant/search")
-def qdrant_search(q: str, k: int = 5):
+def qdrant_search(q: str, k: int = 5, mode: Optional[Literal["dense", "hybrid"]] = None):
     """Search Qdrant collection using embeddings and return top-k results.
 
+    mode="hybrid" (default QDRANT_SEARCH_MODE) adds a BM25 sparse prefetch and
+    fuses both result lists with RRF when the collection has sparse vectors.
     Uses Qdrant REST API directly to avoid client version/method mismatches.
     """
     # Validate configuration
@@ -1178,37 +1757,48 @@ def qdrant_search(q: str, k: int = 5):
     global embeddings
     if embeddings is None:
         try:
-            embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+            embeddings = embeddings_for_collection(qdrant_client, QDRANT_COLLECTION)
         except Exception as ee:
             raise HTTPException(status_code=503, detail=f"Embeddings init failed: {ee}")
 
     try:
         vec = embeddings.embed_query(q)
-        # If the query mentions a known category, restrict search to it
-        normalized_cat = normalize_category(q)
-        if normalized_cat:
-            logger.info(f"✅ /qdrant/search - Category filter: {q} -> {normalized_cat}")
+        # Known category and rating / review-count constraints become a Qdrant filter
+        normalized_cat, constraints, query_filter = build_qdrant_filter(QDRANT_COLLECTION, q)
+        sparse = sparse_query(qdrant_client, QDRANT_COLLECTION, q, mode)
         base = QDRANT_URL.rstrip("/")
-        url = f"{base}/collections/{QDRANT_COLLECTION}/points/search"
-        body = {
-            "vector": vec,
-            "limit": int(k),
-            "with_payload": True,
-            "with_vector": False
-        }
-        if normalized_cat:
-            # Constrain results to the dataset category (Portuguese field)
-            body["filter"] = {
-                "must": [
-                    {"key": "product_category", "match": {"value": normalized_cat}}
-                ]
+        if sparse is not None:
+            # Query API: dense + BM25 candidates, fused server-side
+            url = f"{base}/collections/{QDRANT_COLLECTION}/points/query"
+            prefetch = hybrid_prefetch(vec, sparse, max(int(k), QDRANT_HYBRID_PREFETCH), query_filter,
+                                       QDRANT_REVIEWS_PROFILE.search_params())
+            body = {
+                "prefetch": [p.model_dump(mode="json", exclude_none=True) for p in prefetch],
+                "query": fusion_query().model_dump(mode="json"),
+                "limit": int(k),
+                "with_payload": True,
+                "with_vector": False
             }
+        else:
+            url = f"{base}/collections/{QDRANT_COLLECTION}/points/search"
+            body = {
+                "vector": vec,
+                "limit": int(k),
+                "with_payload": True,
+                "with_vector": False
+            }
+            search_params = QDRANT_REVIEWS_PROFILE.rest_search_params()
+            if search_params:
+                body["params"] = search_params
+            if query_filter is not None:
+                body["filter"] = query_filter.model_dump(exclude_none=True)
         resp = requests.post(url, headers=headers, json=body, timeout=30)
         resp.raise_for_status()
         data = resp.json()
+        hits = data.get("result", {}).get("points", []) if sparse is not None else data.get("result", [])
         # Normalize response
         results = []
-        for item in data.get("result", []):
+        for item in hits:
             results.append({
                 "score": item.get("score"),
                 "id": item.get("id"),
@@ -1218,6 +1808,8 @@ def qdrant_search(q: str, k: int = 5):
             "query": q,
             "k": k,
             "category_filter": normalized_cat,
+            "range_filters": describe_constraints(constraints),
+            "search_mode": "hybrid" if sparse is not None else "dense",
             "results": results
         }
     except requests.HTTPError as he:
@@ -1225,13 +1817,78 @@ def qdrant_search(q: str, k: int = 5):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Qdrant search error: {e}")
 
+@app.post("/qdrant/search/batch")
+def qdrant_search_batch(request: BatchSearchRequest):
+    """Many /qdrant/search queries in one call, results aligned to request.queries.
+
+    All queries are embedded with one embed_documents() call and searched with
+    one query_batch_points() request. Each query has its own k, mode and an
+    optional Qdrant filter (JSON, as in the REST API) that is ANDed with the
+    category / rating filters detected in its text (detect_filters=false
+    skips detection).
+    """
+    queries = request.queries
+    if not queries:
+        return {"count": 0, "results": []}
+    if len(queries) > QDRANT_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {QDRANT_BATCH_MAX_QUERIES} queries per batch "
+                                                    f"(got {len(queries)}); split the batch")
+    if qdrant_client is None:
+        raise HTTPException(status_code=503, detail="Qdrant client not initialized")
+    global embeddings
+    if embeddings is None:
+        try:
+            embeddings = embeddings_for_collection(qdrant_client, QDRANT_COLLECTION)
+        except Exception as ee:
+            raise HTTPException(status_code=503, detail=f"Embeddings init failed: {ee}")
+
+    # filters first: a malformed one fails the batch before any embedding cost
+    plans = []
+    for i, item in enumerate(queries):
+        if item.k < 1:
+            raise HTTPException(status_code=422, detail=f"queries[{i}].k must be >= 1")
+        try:
+            user_filter = models.Filter.model_validate(item.filter) if item.filter else None
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"queries[{i}].filter is not a valid Qdrant filter: {e}")
+        normalized_cat, constraints, detected = (build_qdrant_filter(QDRANT_COLLECTION, item.q)
+                                                 if item.detect_filters else (None, {}, None))
+        query_filter = user_filter if detected is None else detected
+        if detected is not None and user_filter is not None:
+            query_filter = models.Filter(must=[detected, user_filter])
+        plans.append((normalized_cat, constraints, query_filter,
+                      sparse_query(qdrant_client, QDRANT_COLLECTION, item.q, item.mode)))
+
+    try:
+        vectors = embeddings.embed_documents([item.q for item in queries])
+        search_params = QDRANT_REVIEWS_PROFILE.search_params()
+        responses = qdrant_client.query_batch_points(
+            collection_name=QDRANT_COLLECTION,
+            requests=[qdrant_query_request(vec, sparse, query_filter, search_params, item.k)
+                      for item, vec, (_, _, query_filter, sparse) in zip(queries, vectors, plans)],
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Qdrant batch search error: {e}")
+
+    results = []
+    for item, (normalized_cat, constraints, _, sparse), response in zip(queries, plans, responses):
+        results.append({
+            "query": item.q,
+            "k": item.k,
+            "category_filter": normalized_cat,
+            "range_filters": describe_constraints(constraints),
+            "search_mode": "hybrid" if sparse is not None else "dense",
+            "results": [{"score": p.score, "id": p.id, "payload": p.payload or {}} for p in response.points],
+        })
+    return {"count": len(results), "results": results}
+
 @app.post("/products/search")
 def products_search(q: str, k: int = 5):
     """Semantic search over SQLite products via Qdrant collection."""
     if not vectorstore_products:
         raise HTTPException(status_code=503, detail="Products vectorstore not initialized (collection missing or ingestion disabled)")
     try:
-        results = vectorstore_products.similarity_search(q, k=k)
+        results = vectorstore_products.similarity_search(q, k=k, search_params=QDRANT_PRODUCTS_PROFILE.search_params())
         return {
             "query": q,
             "k": k,
@@ -1242,6 +1899,20 @@ def products_search(q: str, k: int = 5):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Products search error: {e}")
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the answer, query-embedding and generated-SQL caches."""
+    inner_embeddings = uncached(embeddings)
+    return {
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "embedding_cache": embeddings.stats() if isinstance(embeddings, CachedEmbeddings) else None,
+        "embedding_rate_limiter": (
+            inner_embeddings.stats() if isinstance(inner_embeddings, TokenBatchedEmbeddings) else None
+        ),
+        "sql_cache": sql_cache.stats() if sql_cache else None,
+        "duckdb_engine": duckdb_engine.stats() if duckdb_engine else None,
+    }
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -1258,6 +1929,14 @@ async def debug_config():
         "qdrant_url_set": bool(QDRANT_URL),
         "qdrant_api_key_set": bool(QDRANT_API_KEY),
         "qdrant_collection": QDRANT_COLLECTION,
+        "embedding_dimensions": embedding_dimension(embeddings) if embeddings is not None else None,
+        "qdrant_profiles": {
+            QDRANT_COLLECTION: QDRANT_REVIEWS_PROFILE.describe(),
+            QDRANT_PRODUCTS_COLLECTION: QDRANT_PRODUCTS_PROFILE.describe(),
+        },
+        "qdrant_search_mode": QDRANT_SEARCH_MODE,
+        "bm25_collections": {name: enc.model for name, enc in _sparse_encoders.items() if enc is not None},
+        "rerank": {"enabled": RERANK_ENABLED, "candidates": RERANK_CANDIDATES, "top_n": RERANK_TOP_N},
         "openai_api_key_set": bool(os.getenv("OPENAI_API_KEY")),
         "disable_ingest": DISABLE_INGEST,
         "category_synonyms": CATEGORY_SYNONYMS,
@@ -1272,6 +1951,28 @@ async def debug_config():
 #     # No favicon served; return 204 to silence browser requests in logs
 #     return Response(status_code=204)
 
+FAILED_CONTEXT_PREFIXES = (
+    "SQL Error", "Error generating SQL", "SQL agent error", "SQL Query Aborted",
+    "Search error", "Qdrant agent error",
+)
+
+
+def is_failed_context(context) -> bool:
+    """True when a RAG context is an error/unavailable message rather than data."""
+    if not context:
+        return False
+    return context.startswith(FAILED_CONTEXT_PREFIXES) or "not initialized" in context
+
+
+def persist_chat_history(user_message: str, agent_response: str):
+    """Insert one chat turn into chat_history (blocking)."""
+    with sqlite_pool.writer() as conn:
+        conn.execute(
+            "INSERT INTO chat_history (user_message, agent_response) VALUES (?, ?)",
+            (user_message, agent_response),
+        )
+
+
 @app.post("/chat")
 async def chat_with_agent(request: ChatRequest):
     """
@@ -1280,13 +1981,18 @@ async def chat_with_agent(request: ChatRequest):
     Request Body:
         {
             "message": "your question here",
-            "agent": "auto" | "sql" | "qdrant" (optional, default: "auto")
+            "agent": "auto" | "sql" | "qdrant" | "hybrid" (optional, default: "auto"),
+            "search_mode": "dense" | "hybrid" (optional, Qdrant retrieval; default QDRANT_SEARCH_MODE)
         }
     
+    All LLM, embedding and Qdrant calls are awaited and SQLite work runs in a
+    worker thread, so one slow request does not stall the event loop.
+
     The system automatically routes queries to the appropriate agent:
     - SQL Agent: For quantitative analysis (counts, averages, statistics)
     - Qdrant Agent: For qualitative analysis (reviews, sentiments, opinions)
-    - Auto: Intelligently decides based on query content
+    - Hybrid: Runs both agents concurrently and merges their contexts into one synthesis
+    - Auto: Intelligently decides based on query content (hybrid when it mixes both)
     
     Returns:
         dict: Response with agent type used and analysis
@@ -1295,6 +2001,9 @@ async def chat_with_agent(request: ChatRequest):
         message = request.message
         agent_choice = request.agent.lower() if request.agent else "auto"
         session_id = request.session_id
+        search_mode = request.search_mode
+        # answers retrieved with an explicit search mode are cached apart from the default ones
+        cache_mode = f"{agent_choice}:{search_mode}" if search_mode else agent_choice
 
         if not message:
             raise HTTPException(status_code=400, detail="Message is required")
@@ -1308,6 +2017,36 @@ async def chat_with_agent(request: ChatRequest):
                 api_key=os.getenv("OPENAI_API_KEY")
             )
 
+        # Answer cache: cheap exact probe first, then an embedding-similarity lookup
+        cache_embedding = None
+        if answer_cache is not None:
+            cached = None
+            try:
+                cached = await asyncio.to_thread(answer_cache.get, message, cache_mode, None, False)
+                if cached is None and embeddings is not None:
+                    cache_embedding = await embeddings.aembed_query(normalize_message(message))
+                    cached = await asyncio.to_thread(answer_cache.get, message, cache_mode, cache_embedding)
+            except Exception as e:
+                logger.warning(f"Answer cache lookup failed: {e}")
+            if cached:
+                logger.info(f"⚡ /chat - answer cache {cached['cache']['type']} hit")
+                try:
+                    await asyncio.to_thread(
+                        persist_chat_history,
+                        message if not session_id else f"[{session_id}] {message}",
+                        cached["agent_response"],
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to persist chat history: {e}")
+                return {
+                    "user_message": message,
+                    "agent_response": cached["agent_response"],
+                    "agents_used": cached.get("agents_used", []),
+                    "agent_choice": agent_choice,
+                    "status": "success",
+                    "cached": True,
+                }
+
         # Determine which agent to use
         use_sql = False
         use_qdrant = False
@@ -1316,6 +2055,9 @@ async def chat_with_agent(request: ChatRequest):
             use_sql = True
         elif agent_choice == "qdrant":
             use_qdrant = True
+        elif agent_choice == "hybrid":
+            use_sql = True
+            use_qdrant = True
         else:  # auto routing
             sql_keywords = [
                 "berapa", "jumlah", "total", "count", "how many",
@@ -1328,9 +2070,15 @@ async def chat_with_agent(request: ChatRequest):
                 "pengalaman", "experience", "kata pelanggan",
             ]
             lower = message.lower()
-            if any(k in lower for k in sql_keywords):
+            wants_sql = any(k in lower for k in sql_keywords)
+            wants_qdrant = any(k in lower for k in qdrant_keywords)
+            if wants_sql and wants_qdrant:
+                # Mixed numbers + opinions question: fan out to both agents
                 use_sql = True
-            elif any(k in lower for k in qdrant_keywords):
+                use_qdrant = True
+            elif wants_sql:
+                use_sql = True
+            elif wants_qdrant:
                 use_qdrant = True
             else:
                 # Default to qualitative if unsure
@@ -1338,46 +2086,50 @@ async def chat_with_agent(request: ChatRequest):
 
         # Build RAG contexts
         agents_used = []
-        sql_context = None
-        qdrant_context = None
 
-        if use_sql:
-            if sql_rag_agent:
-                try:
-                    # Use query() to retrieve raw tabular context for RAG
-                    sql_context = sql_rag_agent.query(message)
-                    agents_used.append("SQL")
-                except Exception as e:
-                    logger.exception("SQL RAG agent error")
-                    sql_context = f"SQL agent error: {str(e)}"
-                    agents_used.append("SQL")
-            else:
-                sql_context = "SQL RAG agent not initialized."
+        async def build_sql_context():
+            if not sql_rag_agent:
+                return "SQL RAG agent not initialized."
+            agents_used.append("SQL")
+            try:
+                # Use aquery() to retrieve raw tabular context for RAG without blocking the loop
+                return await sql_rag_agent.aquery(message)
+            except Exception as e:
+                logger.exception("SQL RAG agent error")
+                return f"SQL agent error: {str(e)}"
 
-        if use_qdrant:
-            if qdrant_rag_agent:
-                try:
-                    # Use search() to retrieve top review snippets for RAG
-                    detected_category = normalize_category(message)
-                    if detected_category:
-                        logger.info(f"✅ /chat - Using category filter: {detected_category}")
-                    qdrant_context = qdrant_rag_agent.search(message)
-                    agents_used.append("Qdrant")
-                except Exception as e:
-                    logger.exception("Qdrant RAG agent error")
-                    qdrant_context = f"Qdrant agent error: {str(e)}"
-                    agents_used.append("Qdrant")
-            else:
-                qdrant_context = "Qdrant RAG agent not initialized."
+        async def build_qdrant_context():
+            if not qdrant_rag_agent:
+                return "Qdrant RAG agent not initialized."
+            agents_used.append("Qdrant")
+            try:
+                # Use asearch() to retrieve top review snippets for RAG
+                detected_category = normalize_category(message)
+                if detected_category:
+                    logger.info(f"✅ /chat - Using category filter: {detected_category}")
+                return await qdrant_rag_agent.asearch(message, mode=search_mode)
+            except Exception as e:
+                logger.exception("Qdrant RAG agent error")
+                return f"Qdrant agent error: {str(e)}"
+
+        # Run the selected retrieval stages concurrently: latency is the max of the two, not the sum
+        async def no_context():
+            return None
+
+        sql_context, qdrant_context = await asyncio.gather(
+            build_sql_context() if use_sql else no_context(),
+            build_qdrant_context() if use_qdrant else no_context(),
+        )
 
         # Synthesize final answer using contexts when possible
         final_response = None
+        synthesized = False
         if (sql_context and isinstance(sql_context, str)) or (qdrant_context and isinstance(qdrant_context, str)):
             try:
                 sql_section = f"SQL Data Context:\n{sql_context}" if sql_context else ""
                 qdrant_section = f"Review Context:\n{qdrant_context}" if qdrant_context else ""
                 final_prompt = f"""
-You are a helpful data and reviews analyst. Answer the user's question using ONLY the provided contexts. If a context is missing, say so briefly. Be concise and actionable.
+You are a helpful data and reviews analyst. Answer the user's question using ONLY the provided contexts. If a context is missing, say so briefly. If the SQL context says "SQL Query Aborted", explain in plain words why the query was stopped and suggest the hint. Be concise and actionable.
 
 User Question:
 {message}
@@ -1391,32 +2143,35 @@ Provide:
 - Key insights in bullet points
 - If relevant, a short recommendation
 """.strip()
-                final_response = llm.predict(final_prompt)
+                final_response = await llm.apredict(final_prompt)
+                synthesized = bool(final_response) and not any(
+                    is_failed_context(ctx) for ctx in (sql_context, qdrant_context)
+                )
             except Exception as e:
                 logger.warning(f"LLM synthesis failed, falling back to per-agent responses: {e}")
 
-        # Fallback: if synthesis failed, use per-agent analysis
+        # Fallback: if synthesis failed, use per-agent analysis (agents analyzed concurrently)
         if not final_response:
-            per_agent_responses = []
+            analyses = []
             if use_sql and sql_rag_agent:
-                per_agent_responses.append({
-                    "agent": "SQL",
-                    "response": sql_rag_agent.analyze(message)
-                })
-            elif use_sql:
-                per_agent_responses.append({
-                    "agent": "SQL",
-                    "response": sql_context or "SQL RAG agent not initialized."
-                })
+                analyses.append(("SQL", sql_rag_agent.aanalyze(message)))
             if use_qdrant and qdrant_rag_agent:
+                analyses.append(("Qdrant", qdrant_rag_agent.aanalyze(message, mode=search_mode)))
+            analyzed = dict(zip(
+                [name for name, _ in analyses],
+                await asyncio.gather(*[coro for _, coro in analyses]),
+            ))
+
+            per_agent_responses = []
+            if use_sql:
                 per_agent_responses.append({
-                    "agent": "Qdrant",
-                    "response": qdrant_rag_agent.analyze(message)
+                    "agent": "SQL",
+                    "response": analyzed.get("SQL") or sql_context or "SQL RAG agent not initialized."
                 })
-            elif use_qdrant:
+            if use_qdrant:
                 per_agent_responses.append({
                     "agent": "Qdrant",
-                    "response": qdrant_context or "Qdrant RAG agent not initialized."
+                    "response": analyzed.get("Qdrant") or qdrant_context or "Qdrant RAG agent not initialized."
                 })
 
             if not per_agent_responses:
@@ -1428,26 +2183,36 @@ Provide:
                 combined = [f"--- {r['agent']} Agent ---\n{r['response']}" for r in per_agent_responses]
                 final_response = "\n\n=== COMBINED ANALYSIS ===\n\n" + "\n\n".join(combined)
 
-        # Persist chat to SQLite (best-effort)
+        # Persist chat to SQLite (best-effort, off the event loop)
         try:
-            sqlite_db_path = os.getenv("SQLITE_DB_PATH", "olist.db")
-            conn = sqlite3.connect(sqlite_db_path)
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO chat_history (user_message, agent_response) VALUES (?, ?)",
-                (message if not session_id else f"[{session_id}] {message}", final_response),
+            await asyncio.to_thread(
+                persist_chat_history,
+                message if not session_id else f"[{session_id}] {message}",
+                final_response,
             )
-            conn.commit()
-            conn.close()
         except Exception as e:
             logger.warning(f"Failed to persist chat history: {e}")
 
+        # Only cache clean synthesized answers, never fallbacks or error text
+        if answer_cache is not None and synthesized:
+            try:
+                await asyncio.to_thread(
+                    answer_cache.put,
+                    message,
+                    cache_mode,
+                    {"agent_response": final_response, "agents_used": agents_used},
+                    cache_embedding,
+                )
+            except Exception as e:
+                logger.warning(f"Answer cache store failed: {e}")
+
         return {
             "user_message": message,
             "agent_response": final_response,
             "agents_used": agents_used,
             "agent_choice": agent_choice,
             "status": "success",
+            "cached": False,
         }
 
     except HTTPException:
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+bench_chat_concurrency.py
+
+Load generator for the /chat endpoint. Fires a fixed number of requests at
+increasing levels of in-flight concurrency and reports requests/sec and
+latency percentiles for each level. With the async /chat pipeline the
+throughput should grow with concurrency instead of staying flat.
+
+Usage:
+    API_URL=http://localhost:8080 python benchmarks/bench_chat_concurrency.py
+"""
+
+import os
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# CONFIG
+API_URL = os.getenv("API_URL", "http://localhost:8080").rstrip("/")
+AGENT = os.getenv("BENCH_AGENT", "qdrant")
+REQUESTS_PER_LEVEL = int(os.getenv("BENCH_REQUESTS", "32"))
+CONCURRENCY_LEVELS = [int(x) for x in os.getenv("BENCH_CONCURRENCY", "1,2,4,8,16").split(",")]
+TIMEOUT = float(os.getenv("BENCH_TIMEOUT", "120"))
+
+MESSAGES = [
+    "Berapa total produk yang dijual?",
+    "Show me customer review summary for perfume products",
+    "What is the average price of products by category?",
+    "ringkasan review parfum",
+]
+
+
+def send_one(i: int):
+    payload = {"message": MESSAGES[i % len(MESSAGES)], "agent": AGENT}
+    start = time.perf_counter()
+    ok = False
+    try:
+        r = requests.post(f"{API_URL}/chat", json=payload, timeout=TIMEOUT)
+        ok = r.status_code == 200
+    except requests.RequestException:
+        pass
+    return ok, time.perf_counter() - start
+
+
+def run_level(concurrency: int):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send_one, range(REQUESTS_PER_LEVEL)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(lat for _, lat in results)
+    ok_count = sum(1 for ok, _ in results if ok)
+    p99_idx = max(0, int(round(0.99 * len(latencies))) - 1)
+    return {
+        "concurrency": concurrency,
+        "ok": ok_count,
+        "rps": len(results) / elapsed if elapsed else 0.0,
+        "p50": statistics.median(latencies),
+        "p99": latencies[p99_idx],
+    }
+
+
+def main():
+    print(f"Benchmarking {API_URL}/chat (agent={AGENT}, {REQUESTS_PER_LEVEL} requests per level)")
+    print(f"{'in-flight':>9} {'ok':>5} {'req/s':>8} {'p50 (s)':>8} {'p99 (s)':>8}")
+    for level in CONCURRENCY_LEVELS:
+        r = run_level(level)
+        print(f"{r['concurrency']:>9} {r['ok']:>5} {r['rps']:>8.2f} {r['p50']:>8.2f} {r['p99']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+bench_embedding_dimensions.py
+
+Offline recall@k of reduced text-embedding-3 dimensions (EMBEDDING_DIMENSIONS)
+against exact search on the full-dimension vectors, plus the storage and
+brute-force search cost of each size, to choose a size for olist_products /
+olist_reviews.
+
+The API's dimensions= option returns the same vector as truncating the full
+embedding to its first d values and re-normalizing (Matryoshka training), so
+the reduced sizes are derived from one set of full vectors; no extra API
+calls are needed. Held-out vectors act as queries; ground truth is the exact
+cosine top-k at full size.
+
+Vector sources, first match wins:
+    BENCH_VECTORS=vectors.npy                       saved full-size vectors (rows)
+    QDRANT_URL + BENCH_SOURCE_COLLECTION=olist_products
+                                                    scrolled from a full-size collection
+    OPENAI_API_KEY + BENCH_EMBED=1                  embeds merged_per_product_docbase.csv
+    (otherwise)                                     synthetic vectors, front-loaded variance
+
+BENCH_SAVE_VECTORS=path.npy keeps scrolled / embedded vectors for re-runs.
+
+Usage:
+    QDRANT_URL=... BENCH_SOURCE_COLLECTION=olist_products python benchmarks/bench_embedding_dimensions.py
+    BENCH_VECTORS=/tmp/olist_products.npy BENCH_DIMENSIONS=128,256,512,1024 python benchmarks/bench_embedding_dimensions.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bench_qdrant_profiles import exact_topk, normalize, recall, scroll_vectors  # noqa: E402
+
+# CONFIG
+VECTORS_FILE = os.getenv("BENCH_VECTORS")
+SAVE_VECTORS = os.getenv("BENCH_SAVE_VECTORS")
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+SOURCE_COLLECTION = os.getenv("BENCH_SOURCE_COLLECTION")
+EMBED = os.getenv("BENCH_EMBED", "0") == "1"
+DOCBASE_CSV = os.getenv("BENCH_DOCBASE", "merged_per_product_docbase.csv")
+N_POINTS = int(os.getenv("BENCH_POINTS", "20000"))
+N_QUERIES = int(os.getenv("BENCH_QUERIES", "500"))
+K = int(os.getenv("BENCH_K", "10"))
+DIMENSIONS = [int(d) for d in os.getenv("BENCH_DIMENSIONS", "256,512,1024").split(",") if d]
+SYNTHETIC_DIM = 1536
+HNSW_M = 16
+
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int = 200) -> np.ndarray:
+    """Clustered unit vectors whose variance is concentrated in the leading dimensions."""
+    rng = np.random.default_rng(0)
+    spread = (1.0 / np.sqrt(1 + np.arange(dim) / 32)).astype(np.float32)
+    centers = rng.standard_normal((n_clusters, dim), dtype=np.float32) * spread
+    labels = rng.integers(0, n_clusters, n)
+    noise = rng.standard_normal((n, dim), dtype=np.float32) * spread * 0.6
+    return normalize(centers[labels] + noise).astype(np.float32)
+
+
+def embedded_docbase(n: int) -> np.ndarray:
+    import pandas as pd
+    from embedding_batcher import TokenBatchedEmbeddings
+    from embedding_providers import make_embeddings
+
+    texts = pd.read_csv(DOCBASE_CSV, usecols=["document"])["document"].dropna().astype(str).head(n).tolist()
+    # dimensions=None: the model's full size; reduced sizes are derived by truncation
+    emb = TokenBatchedEmbeddings(make_embeddings(provider="openai", openai_api_key=os.getenv("OPENAI_API_KEY")))
+    return normalize(np.asarray(emb.embed_documents(texts), dtype=np.float32))
+
+
+def load_vectors():
+    if VECTORS_FILE:
+        return normalize(np.load(VECTORS_FILE).astype(np.float32)), VECTORS_FILE
+    if QDRANT_URL and SOURCE_COLLECTION:
+        from qdrant_client import QdrantClient
+        client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, prefer_grpc=False, timeout=120)
+        return scroll_vectors(client, SOURCE_COLLECTION, N_POINTS + N_QUERIES), f"collection '{SOURCE_COLLECTION}'"
+    if EMBED and os.getenv("OPENAI_API_KEY"):
+        return embedded_docbase(N_POINTS + N_QUERIES), f"{DOCBASE_CSV} embedded at full size"
+    return synthetic_vectors(N_POINTS + N_QUERIES, SYNTHETIC_DIM), "synthetic (set BENCH_VECTORS or QDRANT_URL)"
+
+
+def truncate(vectors: np.ndarray, d: int) -> np.ndarray:
+    """What the API returns for dimensions=d."""
+    return normalize(np.ascontiguousarray(vectors[:, :d]))
+
+
+def search_ms(base: np.ndarray, queries: np.ndarray, k: int) -> float:
+    """Brute-force search time per query (relative cost; Qdrant's HNSW scales similarly per distance)."""
+    start = time.perf_counter()
+    exact_topk(base, queries, k)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def main():
+    vectors, source = load_vectors()
+    if SAVE_VECTORS:
+        np.save(SAVE_VECTORS, vectors)
+    full = vectors.shape[1]
+    base, queries = vectors[:-N_QUERIES], vectors[-N_QUERIES:]
+    truth = exact_topk(base, queries, K)
+    truth_at_1 = truth[:, :1]
+
+    print(f"{len(base):,} points / {len(queries)} queries, {full}-d vectors from {source}")
+    print(f"ground truth: exact cosine top-{K} at {full} dimensions\n")
+    print(f"{'dims':>6} {'recall@1':>9} {'recall@' + str(K):>10} {'bytes/vec':>10} {'RAM MB':>8} "
+          f"{'search ms/q':>12}")
+    for d in sorted({d for d in DIMENSIONS if d < full} | {full}):
+        b, q = truncate(base, d), truncate(queries, d)
+        found = exact_topk(b, q, K)
+        # float32 vectors + HNSW links (m=16), the float32 profile in qdrant_profiles.py
+        ram_mb = len(base) * (d * 4 + 2 * HNSW_M * 4) / 2 ** 20
+        print(f"{d:>6} {recall(found[:, :1], truth_at_1):>9.3f} {recall(found, truth):>10.3f} {d * 4:>10,} "
+              f"{ram_mb:>8.1f} {search_ms(b, q, K):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+bench_merge_reviews.py
+
+Per-product docbase build: the previous row-by-row implementation of
+merge_reviews_per_product.py (groupby lambdas + apply(axis=1), reproduced
+below as legacy_build) versus the vectorized build_docbase().
+
+Also checks output equivalence: both frames must be identical
+(pd.testing.assert_frame_equal), so the Qdrant docbase does not change.
+
+The out-of-core build_docbase_streaming() is run on the same CSVs; its
+output file must match build_docbase().to_csv() byte for byte. Peak RSS of
+the in-memory and streaming builds is measured in a fresh worker process
+each; BENCH_PRODUCTS pins the product count so order growth can be isolated.
+
+Usage:
+    OLIST_DIR=/path/to/olist/csvs python benchmarks/bench_merge_reviews.py
+    BENCH_LEGACY=0 BENCH_ITEMS=2000000 BENCH_PRODUCTS=30000 python benchmarks/bench_merge_reviews.py
+
+Without OLIST_DIR a synthetic Olist-shaped dataset is generated (including
+empty/whitespace-only reviews, missing sellers, products without items and
+products whose combined reviews exceed MAX_COMBINED_LENGTH).
+"""
+
+import os
+import random
+import sys
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from textwrap import shorten
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import merge_reviews_per_product as mr  # noqa: E402
+
+# CONFIG
+OLIST_DIR = os.getenv("OLIST_DIR")
+SYNTHETIC_ITEMS = int(os.getenv("BENCH_ITEMS", "110000"))
+SYNTHETIC_PRODUCTS = int(os.getenv("BENCH_PRODUCTS", "0")) or None
+RUN_LEGACY = os.getenv("BENCH_LEGACY", "1") == "1"
+CHUNK_ROWS = int(os.getenv("MERGE_CHUNK_ROWS", "20000"))
+
+WORDS = "produto chegou rapido bom otimo ruim entrega atrasada qualidade recomendo nao gostei perfeito".split()
+
+
+def legacy_build(products, reviews, items, sellers, cat_translation):
+    """The pre-vectorization pipeline, kept verbatim for comparison."""
+    items_reviews = items[['order_id', 'product_id', 'seller_id']].merge(reviews, on='order_id', how='inner')
+
+    def concat_limited(texts, max_items=mr.MAX_REVIEWS_TO_CONCAT, sep=" || "):
+        vals = [str(t).strip() for t in texts if pd.notna(t) and str(t).strip() != ""]
+        if not vals:
+            return ""
+        vals = vals[:max_items]
+        joined = sep.join(vals)
+        return shorten(joined, width=mr.MAX_COMBINED_LENGTH, placeholder=" ...")
+
+    grouped = items_reviews.groupby('product_id').agg(
+        num_reviews=('review_score', 'count'),
+        avg_review_score=('review_score', 'mean'),
+        combined_review_titles=('review_comment_title', lambda s: concat_limited(s.dropna().astype(str).tolist())),
+        combined_review_messages=('review_comment_message', lambda s: concat_limited(s.dropna().astype(str).tolist())),
+    ).reset_index()
+
+    items_sellers = items[['product_id', 'seller_id']].merge(
+        sellers[['seller_id', 'seller_city', 'seller_state']], on='seller_id', how='left')
+    seller_loc = items_sellers.groupby('product_id').agg(
+        seller_cities=('seller_city', lambda s: ", ".join(sorted({str(x) for x in s.dropna()}))),
+        seller_states=('seller_state', lambda s: ", ".join(sorted({str(x) for x in s.dropna()}))),
+        seller_count=('seller_id', lambda s: len(set(s.dropna()))),
+    ).reset_index()
+
+    products = products.merge(cat_translation, how='left', on='product_category_name')
+    prod_meta = products[['product_id', 'product_category_name', 'product_category_name_english', 'product_name_lenght']] \
+        .drop_duplicates(subset=['product_id'])
+    merged = prod_meta.merge(grouped, on='product_id', how='left')
+    merged = merged.merge(seller_loc, on='product_id', how='left')
+    merged['num_reviews'] = merged['num_reviews'].fillna(0).astype(int)
+    merged['avg_review_score'] = merged['avg_review_score'].fillna(0.0)
+
+    def build_product_doc(row):
+        parts = [
+            f"Product ID: {row.get('product_id','')}",
+            f"Product Name Length: {row.get('product_name_lenght', '')}",
+            f"Product Category: {row.get('product_category_name','')}",
+            f"Category (English): {row.get('product_category_name_english','')}",
+            f"Sellers (count): {row.get('seller_count',0)}",
+            f"Seller Cities: {row.get('seller_cities','')}",
+            f"Seller States: {row.get('seller_states','')}",
+            f"Number of Reviews: {row.get('num_reviews',0)}",
+            f"Average Review Score: {round(row.get('avg_review_score',0.0),2)}",
+            f"Combined Review Titles: {row.get('combined_review_titles','')}",
+            f"Combined Review Messages: {row.get('combined_review_messages','')}",
+        ]
+        return "\n".join([p for p in parts if p and str(p).strip() != ""])
+
+    merged['document'] = merged.apply(build_product_doc, axis=1)
+    merged = merged[merged['document'].str.strip() != ""]
+    return merged
+
+
+def synthetic_inputs(n_items: int, n_products: int = None) -> dict:
+    rng = random.Random(0)
+    n_products = n_products or max(10, n_items // 3)
+    n_orders = max(10, int(n_items / 1.13))
+    n_sellers = max(5, n_products // 10)
+    categories = [f"categoria_{i}" for i in range(70)]
+
+    def text():
+        r = rng.random()
+        if r < 0.45:
+            return np.nan
+        if r < 0.5:
+            return "   "
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 40)))
+        return f"  {words}\n" if r < 0.6 else words
+
+    products = pd.DataFrame({
+        "product_id": [f"p{i}" for i in range(n_products)],
+        "product_category_name": [rng.choice(categories) if rng.random() > 0.02 else np.nan for _ in range(n_products)],
+        "product_name_lenght": [float(rng.randint(5, 60)) if rng.random() > 0.02 else np.nan for _ in range(n_products)],
+    })
+    cat_translation = pd.DataFrame({
+        "product_category_name": categories[:-5],
+        "product_category_name_english": [c.replace("categoria", "category") for c in categories[:-5]],
+    })
+    sellers = pd.DataFrame({
+        "seller_id": [f"s{i}" for i in range(n_sellers)],
+        "seller_city": [f"cidade {i % 400}" for i in range(n_sellers)],
+        "seller_state": [rng.choice(["SP", "RJ", "MG", "PR", "SC"]) for _ in range(n_sellers)],
+    })
+    # a few hot products get enough reviews to hit MAX_REVIEWS_TO_CONCAT / MAX_COMBINED_LENGTH
+    hot = [f"p{i}" for i in range(20)]
+    items = pd.DataFrame({
+        "order_id": [f"o{i % n_orders}" for i in range(n_items)],
+        "product_id": [rng.choice(hot) if rng.random() < 0.05 else f"p{rng.randrange(int(n_products * 0.9))}"
+                       for _ in range(n_items)],
+        "seller_id": [f"s{rng.randrange(int(n_sellers * 1.05))}" for _ in range(n_items)],
+    })
+    reviews = pd.DataFrame({
+        "review_id": [f"r{i}" for i in range(n_orders)],
+        "order_id": [f"o{i}" for i in range(n_orders)],
+        "review_score": [rng.randint(1, 5) for _ in range(n_orders)],
+        "review_comment_title": [text() for _ in range(n_orders)],
+        "review_comment_message": [text() for _ in range(n_orders)],
+    })
+    return {"products": products, "reviews": reviews, "items": items, "sellers": sellers,
+            "cat_translation": cat_translation}
+
+
+def write_inputs(data: dict, out_dir: str):
+    """Synthetic frames -> the CSV files load_inputs()/build_docbase_streaming() read."""
+    files = {"products": mr.INPUT_PRODUCTS, "reviews": mr.INPUT_REVIEWS, "items": mr.INPUT_ITEMS,
+             "sellers": mr.INPUT_SELLERS, "cat_translation": mr.INPUT_CAT_TRANS}
+    for key, name in files.items():
+        data[key].to_csv(os.path.join(out_dir, name), index=False)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+def _measure(mode: str, base_dir: str, output_file: str) -> float:
+    if mode == "streaming":
+        mr.build_docbase_streaming(base_dir, output_file, chunk_rows=CHUNK_ROWS)
+    else:
+        mr.build_docbase(**mr.load_inputs(base_dir)).to_csv(output_file, index=False)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def peak_rss_mb(mode: str, base_dir: str, output_file: str) -> float:
+    """Peak RSS of one build in a fresh process (covers Arrow-backed strings too)."""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(_measure, mode, base_dir, output_file).result()
+
+
+def main():
+    tmp = tempfile.mkdtemp(prefix="bench_merge_")
+    if OLIST_DIR:
+        base_dir = OLIST_DIR
+    else:
+        base_dir = tmp
+        write_inputs(synthetic_inputs(SYNTHETIC_ITEMS, SYNTHETIC_PRODUCTS), base_dir)
+        print(f"(OLIST_DIR not set; using synthetic data with {SYNTHETIC_ITEMS:,} item rows)")
+    data = mr.load_inputs(base_dir)
+
+    legacy_s = None
+    if RUN_LEGACY:
+        legacy, legacy_s = timed(legacy_build, **data)
+    vectorized, vectorized_s = timed(mr.build_docbase, **data)
+    if RUN_LEGACY:
+        pd.testing.assert_frame_equal(legacy.reset_index(drop=True), vectorized.reset_index(drop=True))
+    del data
+
+    streamed_csv = os.path.join(tmp, "streamed.csv")
+    _, streaming_s = timed(mr.build_docbase_streaming, base_dir, streamed_csv, chunk_rows=CHUNK_ROWS)
+    with open(streamed_csv, encoding="utf-8") as f:
+        streaming_identical = f.read() == vectorized.to_csv(index=False)
+    assert streaming_identical, "streaming output differs from build_docbase()"
+
+    in_memory_mb = peak_rss_mb("in-memory", base_dir, os.path.join(tmp, "in_memory.csv"))
+    streaming_mb = peak_rss_mb("streaming", base_dir, streamed_csv)
+    truncated = vectorized["combined_review_messages"].fillna("").str.endswith(" ...").sum()
+
+    print(f"\n{len(vectorized):,} product documents ({truncated} truncated to {mr.MAX_COMBINED_LENGTH} chars)")
+    if legacy_s is not None:
+        print(f"{'legacy (lambdas + apply)':<28} {legacy_s:>8.2f} s")
+    speedup = f"  ({legacy_s / vectorized_s:.1f}x)" if legacy_s else ""
+    print(f"{'vectorized build_docbase':<28} {vectorized_s:>8.2f} s{speedup}  peak RSS {in_memory_mb:,.0f} MB")
+    print(f"{'streaming (chunks of ' + format(CHUNK_ROWS, ',') + ')':<28} {streaming_s:>8.2f} s"
+          f"  peak RSS {streaming_mb:,.0f} MB")
+    print(f"outputs identical: legacy={RUN_LEGACY or 'skipped'} streaming={streaming_identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+bench_qdrant_profiles.py
+
+Recall@k vs latency vs RAM for each collection profile in qdrant_profiles.py,
+to pick QDRANT_PROFILE_<COLLECTION> for olist_products / olist_reviews.
+
+Ground truth is exact cosine top-k computed in numpy. For every profile:
+- RAM: estimated resident memory (vectors kept in RAM, quantized vectors,
+  HNSW links; payloads excluded). On-disk data is served from the page cache,
+  so it costs latency instead when RAM is short.
+- Offline recall: the quantization stage simulated in numpy (int8 / binary
+  candidates, top k*oversampling rescored with the float32 originals). This
+  isolates quantization loss and runs without a server.
+- Server recall / latency (only with QDRANT_URL): a throwaway collection per
+  profile is created with the profile, filled, indexed, and queried with the
+  profile's search params (HNSW + quantization together, p50/p95 per query,
+  network included). Qdrant's local mode ignores HNSW and quantization, so
+  it is not used for this part.
+
+Usage:
+    python benchmarks/bench_qdrant_profiles.py
+    QDRANT_URL=http://localhost:6333 BENCH_SOURCE_COLLECTION=olist_products python benchmarks/bench_qdrant_profiles.py
+
+BENCH_SOURCE_COLLECTION scrolls real vectors from an existing collection
+(recommended; synthetic clustered vectors are used otherwise). The last
+BENCH_QUERIES vectors are held out as queries.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from qdrant_profiles import PROFILES  # noqa: E402
+
+# CONFIG
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+SOURCE_COLLECTION = os.getenv("BENCH_SOURCE_COLLECTION")
+N_POINTS = int(os.getenv("BENCH_POINTS", "20000"))
+DIM = int(os.getenv("BENCH_DIM", "1536"))
+N_QUERIES = int(os.getenv("BENCH_QUERIES", "200"))
+K = int(os.getenv("BENCH_K", "10"))
+PROFILE_NAMES = [p for p in os.getenv("BENCH_PROFILES", ",".join(PROFILES)).split(",") if p]
+INDEXING_THRESHOLD_KB = int(os.getenv("BENCH_INDEXING_THRESHOLD_KB", "1000"))  # index small test collections too
+KEEP = os.getenv("BENCH_KEEP", "0") == "1"
+UPSERT_CHUNK = 256
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int = 200) -> np.ndarray:
+    """Clustered unit vectors with a decaying per-dimension spread (embeddings are anisotropic)."""
+    rng = np.random.default_rng(0)
+    spread = (1.0 / np.sqrt(1 + np.arange(dim) / (dim / 8))).astype(np.float32)  # ~3x from first to last
+    centers = rng.standard_normal((n_clusters, dim), dtype=np.float32) * spread
+    labels = rng.integers(0, n_clusters, n)
+    noise = rng.standard_normal((n, dim), dtype=np.float32) * spread * 0.6
+    return normalize(centers[labels] + noise).astype(np.float32)
+
+
+def scroll_vectors(client, collection: str, limit: int) -> np.ndarray:
+    vectors, offset = [], None
+    while len(vectors) < limit:
+        points, offset = client.scroll(collection, limit=min(1000, limit - len(vectors)), offset=offset,
+                                       with_payload=False, with_vectors=True)
+        vectors.extend(p.vector for p in points)
+        if offset is None:
+            break
+    return normalize(np.asarray(vectors, dtype=np.float32))
+
+
+def topk(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indexes of the k best scores per row, best first."""
+    k = min(k, scores.shape[1] - 1)
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def exact_topk(base: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    return topk(queries @ base.T, k)
+
+
+def recall(found: list, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f[:k]) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def estimate_ram_mb(profile, n: int, dim: int) -> float:
+    original = 0 if profile.on_disk else n * dim * 4
+    quantized = {"int8": n * dim, "binary": n * dim / 8}.get(profile.quantization, 0)
+    # level 0 keeps 2*m links per point (u32), upper levels add ~1/(m-1) of that
+    graph = 0 if profile.hnsw_on_disk else n * 2 * profile.m * 4 * (1 + 1 / (profile.m - 1))
+    return (original + quantized + graph) / 2 ** 20
+
+
+def simulate_quantized(profile, base: np.ndarray, queries: np.ndarray, k: int) -> list:
+    """Top-k ids after the quantized scan (+ rescoring), without HNSW."""
+    if profile.quantization is None:
+        return list(exact_topk(base, queries, k))
+    if profile.quantization == "int8":
+        clip = (1 - profile.quantile) / 2    # e.g. quantile=0.99 clips the outer 1% of values
+        lo, hi = np.quantile(base, [clip, 1 - clip])
+        scale = (hi - lo) / 255
+
+        def quantize(x):
+            return (np.round((np.clip(x, lo, hi) - lo) / scale) * scale + lo).astype(np.float32)
+        approx = quantize(queries) @ quantize(base).T
+    else:
+        approx = (np.where(queries > 0, 1.0, -1.0).astype(np.float32)
+                  @ np.where(base > 0, 1.0, -1.0).astype(np.float32).T)
+    n_candidates = int(k * (profile.oversampling or 1.0)) if profile.rescore else k
+    candidates = topk(approx, n_candidates)
+    if not profile.rescore:
+        return list(candidates)
+    found = []
+    for q, cand in zip(queries, candidates):
+        exact = base[cand] @ q
+        found.append(cand[np.argsort(-exact)[:k]])
+    return found
+
+
+def wait_indexed(client, collection: str, timeout_s: float = 900):
+    from qdrant_client.http import models
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if client.get_collection(collection).status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(1)
+    raise TimeoutError(f"{collection} still optimizing after {timeout_s:.0f}s")
+
+
+def measure_server(client, profile, base: np.ndarray, queries: np.ndarray, k: int) -> dict:
+    from qdrant_client.http import models
+    collection = f"bench_profile_{profile.name.replace('-', '_')}"
+    if client.collection_exists(collection):
+        client.delete_collection(collection)
+    client.create_collection(collection, **profile.create_collection_kwargs(base.shape[1]),
+                             optimizers_config=models.OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD_KB))
+    try:
+        for start in range(0, len(base), UPSERT_CHUNK):
+            chunk = base[start:start + UPSERT_CHUNK]
+            client.upsert(collection, points=models.Batch(ids=list(range(start, start + len(chunk))),
+                                                          vectors=chunk.tolist()), wait=True)
+        wait_indexed(client, collection)
+        params = profile.search_params()
+        for q in queries[:10]:  # warm caches / connections
+            client.query_points(collection, query=q.tolist(), limit=k, search_params=params)
+        found, latencies = [], []
+        for q in queries:
+            start = time.perf_counter()
+            points = client.query_points(collection, query=q.tolist(), limit=k, search_params=params).points
+            latencies.append(time.perf_counter() - start)
+            found.append([p.id for p in points])
+        return {"found": found, "p50_ms": np.percentile(latencies, 50) * 1000,
+                "p95_ms": np.percentile(latencies, 95) * 1000}
+    finally:
+        if not KEEP:
+            client.delete_collection(collection)
+
+
+def main():
+    unknown = [p for p in PROFILE_NAMES if p not in PROFILES]
+    if unknown:
+        sys.exit(f"unknown profiles {unknown}; expected some of {list(PROFILES)}")
+
+    client = None
+    if QDRANT_URL:
+        from qdrant_client import QdrantClient
+        client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, prefer_grpc=False, timeout=120)
+
+    if SOURCE_COLLECTION:
+        if client is None:
+            sys.exit("BENCH_SOURCE_COLLECTION needs QDRANT_URL")
+        vectors = scroll_vectors(client, SOURCE_COLLECTION, N_POINTS + N_QUERIES)
+        print(f"{len(vectors):,} vectors ({vectors.shape[1]}-d) from collection '{SOURCE_COLLECTION}'")
+    else:
+        vectors = synthetic_vectors(N_POINTS + N_QUERIES, DIM)
+        print(f"(BENCH_SOURCE_COLLECTION not set; using {len(vectors):,} synthetic {DIM}-d vectors)")
+    base, queries = vectors[:-N_QUERIES], vectors[-N_QUERIES:]
+    truth = exact_topk(base, queries, K)
+
+    if client is None:
+        print("(QDRANT_URL not set; server recall/latency skipped, offline quantization recall only)")
+    print(f"\n{len(base):,} points, {len(queries)} queries, recall@{K} against exact float32 search\n")
+    print(f"{'profile':<10} {'RAM est MB':>10} {'offline recall':>15} {'server recall':>14} "
+          f"{'p50 ms':>8} {'p95 ms':>8}  description")
+    for name in PROFILE_NAMES:
+        profile = PROFILES[name]
+        offline = recall(simulate_quantized(profile, base, queries, K), truth)
+        server = "n/a", "n/a", "n/a"
+        if client is not None:
+            measured = measure_server(client, profile, base, queries, K)
+            server = (f"{recall(measured['found'], truth):.3f}", f"{measured['p50_ms']:.1f}",
+                      f"{measured['p95_ms']:.1f}")
+        print(f"{name:<10} {estimate_ram_mb(profile, len(base), base.shape[1]):>10.1f} {offline:>15.3f} "
+              f"{server[0]:>14} {server[1]:>8} {server[2]:>8}  {profile.description}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+bench_sql_engines.py
+
+SQLite (pooled read-only connection) versus the in-process DuckDB engine
+over the Parquet export, on the SQL our agents generate most often:
+per-category review averages, monthly order counts, revenue per seller
+state, top categories by revenue, plus a keyed point lookup (which
+SQLRagAgent keeps on SQLite when SQL_ENGINE=auto). Two more queries check
+that DuckDB keeps SQLite semantics where it would otherwise differ silently:
+integer division (7/2 = 3) and case-insensitive LIKE.
+
+Reports the median milliseconds per query for each engine, the speedup, and
+whether both engines returned the same rows.
+
+Usage:
+    python preprocess_sql.py            # builds olist.db and FP/parquet
+    SQLITE_DB_PATH=olist.db PARQUET_DIR=FP/parquet python benchmarks/bench_sql_engines.py
+
+Without a built DB + Parquet export a synthetic Olist-shaped dataset is used.
+"""
+
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from duckdb_engine import DuckDBEngine, is_analytical  # noqa: E402
+from sqlite_pool import SQLitePool  # noqa: E402
+
+# CONFIG
+DB_PATH = os.getenv("SQLITE_DB_PATH", "olist.db")
+PARQUET_DIR = os.getenv("PARQUET_DIR", os.path.join("FP", "parquet"))
+REPEAT = int(os.getenv("BENCH_REPEAT", "5"))
+SYNTHETIC_ORDERS = int(os.getenv("BENCH_ORDERS", "100000"))
+
+QUERIES = {
+    "avg review per category": """
+        SELECT p.product_category_name, ROUND(AVG(r.review_score), 3) AS avg_score, COUNT(*) AS n
+        FROM order_items oi
+        JOIN products p ON oi.product_id = p.product_id
+        JOIN order_reviews r ON oi.order_id = r.order_id
+        GROUP BY p.product_category_name
+        ORDER BY avg_score DESC, p.product_category_name""",
+    "orders per month": """
+        SELECT substr(order_purchase_timestamp, 1, 7) AS month, COUNT(*) AS orders
+        FROM orders
+        GROUP BY month
+        ORDER BY month""",
+    "revenue per seller state": """
+        SELECT s.seller_state, ROUND(SUM(oi.price), 2) AS revenue, COUNT(DISTINCT oi.order_id) AS orders
+        FROM order_items oi
+        JOIN sellers s ON oi.seller_id = s.seller_id
+        GROUP BY s.seller_state
+        ORDER BY revenue DESC""",
+    "top 10 categories by revenue": """
+        SELECT p.product_category_name, ROUND(SUM(oi.price + oi.freight_value), 2) AS revenue
+        FROM order_items oi
+        JOIN products p ON oi.product_id = p.product_id
+        GROUP BY p.product_category_name
+        ORDER BY revenue DESC
+        LIMIT 10""",
+    "integer division": """
+        SELECT review_score / 2 AS bucket, COUNT(*) AS n, SUM(review_score) / COUNT(*) AS int_avg
+        FROM order_reviews
+        GROUP BY bucket
+        ORDER BY bucket""",
+    "case-insensitive LIKE": """
+        SELECT p.product_category_name, COUNT(*) AS items
+        FROM order_items oi
+        JOIN products p ON oi.product_id = p.product_id
+        WHERE p.product_category_name LIKE '%A%' AND p.product_category_name NOT LIKE '%Z%'
+        GROUP BY p.product_category_name
+        ORDER BY items DESC, p.product_category_name""",
+    "point lookup by order_id": """
+        SELECT o.order_id, o.order_status, oi.price
+        FROM orders o JOIN order_items oi ON o.order_id = oi.order_id
+        WHERE o.order_id = 'o12345'""",
+}
+
+
+def has_data(db_path: str, parquet_dir: str) -> bool:
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        conn.execute("SELECT 1 FROM order_items LIMIT 1")
+        conn.close()
+    except sqlite3.Error:
+        return False
+    return os.path.isdir(os.path.join(parquet_dir, "order_items"))
+
+
+def build_synthetic(n_orders: int):
+    """Olist-shaped SQLite DB + Parquet export in a temp dir."""
+    import preprocess_sql
+
+    rng = random.Random(0)
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, "bench.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE orders (order_id TEXT PRIMARY KEY, customer_id TEXT, order_status TEXT, order_purchase_timestamp TEXT);
+        CREATE TABLE order_items (order_id TEXT, order_item_id INTEGER, product_id TEXT, seller_id TEXT,
+                                  price REAL, freight_value REAL, PRIMARY KEY (order_id, order_item_id));
+        CREATE TABLE products (product_id TEXT PRIMARY KEY, product_category_name TEXT);
+        CREATE TABLE sellers (seller_id TEXT PRIMARY KEY, seller_state TEXT);
+        CREATE TABLE order_reviews (review_id TEXT, order_id TEXT, review_score INTEGER, PRIMARY KEY (review_id, order_id));
+    """)
+    states = ["SP", "RJ", "MG", "RS", "PR", "SC", "BA", "DF", "GO", "ES"]
+    conn.executemany("INSERT INTO products VALUES (?, ?)", ((f"p{i}", f"cat_{i % 70}") for i in range(30000)))
+    conn.executemany("INSERT INTO sellers VALUES (?, ?)", ((f"s{i}", states[i % len(states)]) for i in range(3000)))
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?, ?)", (
+        (f"o{i}", f"c{i % 90000}", "delivered", f"201{6 + i % 3}-{1 + i % 12:02d}-15 10:00:00") for i in range(n_orders)
+    ))
+    conn.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?, ?)", (
+        (f"o{i % n_orders}", 1 + i // n_orders, f"p{rng.randrange(30000)}", f"s{rng.randrange(3000)}",
+         round(rng.uniform(5, 500), 2), round(rng.uniform(1, 50), 2))
+        for i in range(int(n_orders * 1.13))
+    ))
+    conn.executemany("INSERT INTO order_reviews VALUES (?, ?, ?)", (
+        (f"r{i}", f"o{i}", rng.randint(1, 5)) for i in range(n_orders)
+    ))
+    conn.executescript("""
+        CREATE INDEX idx_items_order_id ON order_items(order_id);
+        CREATE INDEX idx_items_product_id ON order_items(product_id);
+        CREATE INDEX idx_items_seller_id ON order_items(seller_id);
+        ANALYZE;
+    """)
+    conn.commit()
+    conn.close()
+    parquet_dir = os.path.join(tmp, "parquet")
+    preprocess_sql.export_parquet(db_path, ["orders", "order_items", "products", "sellers", "order_reviews"], parquet_dir)
+    print(f"(no built DB/Parquet at {DB_PATH}, {PARQUET_DIR}; using synthetic data in {tmp})")
+    return db_path, parquet_dir
+
+
+def median_ms(fn) -> float:
+    fn()  # warm-up (page cache, DuckDB view binding)
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def normalize(rows):
+    return sorted(tuple(round(v, 2) if isinstance(v, float) else v for v in r) for r in rows)
+
+
+def main():
+    db_path, parquet_dir = (DB_PATH, PARQUET_DIR) if has_data(DB_PATH, PARQUET_DIR) else build_synthetic(SYNTHETIC_ORDERS)
+    pool = SQLitePool(db_path)
+    engine = DuckDBEngine(parquet_dir)
+
+    def sqlite_rows(sql):
+        return pool.reader().execute(sql).fetchall()
+
+    def duckdb_rows(sql):
+        return engine.execute(sql, max_rows=1_000_000, time_budget_s=600)[1]
+
+    print(f"\n{'query':<30} {'auto->':>7} {'sqlite ms':>10} {'duckdb ms':>10} {'speedup':>8}  same rows")
+    for label, sql in QUERIES.items():
+        sqlite_ms = median_ms(lambda: sqlite_rows(sql))
+        duckdb_ms = median_ms(lambda: duckdb_rows(sql))
+        same = normalize(sqlite_rows(sql)) == normalize(duckdb_rows(sql))
+        route = "duckdb" if is_analytical(sql) else "sqlite"
+        print(f"{label:<30} {route:>7} {sqlite_ms:>10.2f} {duckdb_ms:>10.2f} {sqlite_ms / duckdb_ms:>7.2f}x  {same}")
+    pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
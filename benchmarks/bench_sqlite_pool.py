@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+bench_sqlite_pool.py
+
+Per-query overhead of opening a fresh sqlite3 connection per call (the old
+behaviour of /sqlite, /sqlite/raw and SQLRagAgent.query) versus reusing the
+pooled read-only connections from sqlite_pool.SQLitePool.
+
+Runs a cheap point lookup many times from several threads so connection
+setup dominates, and reports queries/sec and mean microseconds per query.
+
+Usage:
+    SQLITE_DB_PATH=olist.db python benchmarks/bench_sqlite_pool.py
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from sqlite_pool import SQLitePool  # noqa: E402
+
+# CONFIG
+DB_PATH = os.getenv("SQLITE_DB_PATH", "olist.db")
+QUERIES = int(os.getenv("BENCH_QUERIES", "20000"))
+THREADS = int(os.getenv("BENCH_THREADS", "8"))
+QUERY = "SELECT product_category_name FROM products WHERE rowid = ?"
+
+
+def ensure_db(path: str) -> str:
+    """Use the real DB if it has a products table; otherwise build a synthetic one."""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.execute("SELECT 1 FROM products LIMIT 1")
+        conn.close()
+        return path
+    except sqlite3.Error:
+        pass
+    tmp = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = sqlite3.connect(tmp)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("CREATE TABLE products (product_id TEXT, product_category_name TEXT)")
+    conn.executemany(
+        "INSERT INTO products VALUES (?, ?)",
+        ((f"p{i}", f"cat_{i % 70}") for i in range(50000)),
+    )
+    conn.commit()
+    conn.close()
+    print(f"(no products table in {path}; using synthetic DB {tmp})")
+    return tmp
+
+
+def run(label: str, fn):
+    per_thread = QUERIES // THREADS
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(lambda t: [fn(t * per_thread + i) for i in range(per_thread)], range(THREADS)))
+    elapsed = time.perf_counter() - start
+    total = per_thread * THREADS
+    print(f"{label:<28} {total / elapsed:>10,.0f} q/s {elapsed / total * 1e6:>10.1f} us/query")
+
+
+def main():
+    path = ensure_db(DB_PATH)
+    (n_rows,) = sqlite3.connect(path).execute("SELECT COUNT(*) FROM products").fetchone()
+
+    def connect_per_call(i):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute(QUERY, (i % n_rows + 1,)).fetchone()
+        finally:
+            conn.close()
+
+    pool = SQLitePool(path)
+
+    def pooled(i):
+        return pool.reader().execute(QUERY, (i % n_rows + 1,)).fetchone()
+
+    print(f"{QUERIES:,} point lookups on {THREADS} threads against {path}")
+    run("connect per call (before)", connect_per_call)
+    run("SQLitePool.reader (after)", pooled)
+    pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
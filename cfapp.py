@@ -5,10 +5,16 @@ from fastapi import FastAPI
 from pydantic import BaseModel
 from typing import List
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
+from embedding_cache import CachedEmbeddings
+from embedding_providers import is_local as is_local_embeddings, make_embeddings
+from qdrant_profiles import collection_vector_size, profile_for
+from rerank import RERANK_CANDIDATES, RERANK_ENABLED, RERANK_TOP_N, point_text, rerank
+from sqlite_pool import SQLitePool
 from langchain.agents import Tool, initialize_agent
 from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
+from qdrant_client.http import models
 import qdrant_client as qdrant_client_pkg
 import langchain as langchain_pkg
 
@@ -18,6 +24,11 @@ import langchain as langchain_pkg
 
 SQLITE_PATH = "olist.db"
 COLLECTION_NAME = "olist_products"
+# search-time hnsw_ef / rescoring matching how upload_to_qdrant.py built the collection
+COLLECTION_PROFILE = profile_for(COLLECTION_NAME)
+
+# Read-only, thread-local connections reused across SQL_Query tool calls
+sqlite_pool = SQLitePool(SQLITE_PATH)
 
 
 # ================= LLMs =================
@@ -36,12 +47,6 @@ formatter_llm = ChatOpenAI(
     openai_api_key=os.getenv("OPENAI_API_KEY"),
 )
 
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-small",
-    openai_api_key=os.getenv("OPENAI_API_KEY"),
-)
-
-
 # ================= ENV & QDRANT =================
 
 # Load .env if present (local/dev convenience)
@@ -79,13 +84,34 @@ if not hasattr(client, 'search'):
 else:
     print("OK: QdrantClient.search method available.")
 
+# Queries are embedded at the collection's vector size (EMBEDDING_DIMENSIONS
+# may have changed since upload_to_qdrant.py built it)
+try:
+    collection_dimensions = collection_vector_size(client, COLLECTION_NAME)
+except Exception as e:
+    print("Warning: could not read collection vector size:", repr(e))
+    collection_dimensions = None
+
+# EMBEDDING_PROVIDER=local embeds in-process (offline); OpenAI embeddings are
+# cached so repeated RAG_Search queries skip the embeddings API
+if is_local_embeddings():
+    embeddings = make_embeddings()
+else:
+    embeddings = CachedEmbeddings(
+        make_embeddings(
+            dimensions=collection_dimensions,
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+        ),
+        path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db"),
+    )
+
 vectorstore = QdrantVectorStore(
     client=client,
     collection_name=COLLECTION_NAME,
     embedding=embeddings,
 )
 
-retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
+retriever = vectorstore.as_retriever(search_kwargs={"k": 4, "search_params": COLLECTION_PROFILE.search_params()})
 
 
 # ================= RAG AGENT =================
@@ -104,7 +130,7 @@ CATEGORY_SYNONYMS = {
 }
 
 def build_retriever(category: str | None = None):
-    search_kwargs = {"k": 4}
+    search_kwargs = {"k": 4, "search_params": COLLECTION_PROFILE.search_params()}
 
     if category:
         search_kwargs["filter"] = {
@@ -134,20 +160,29 @@ def rag_search(query: str) -> list[str]:
             category = v
             break
 
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 30})
-    docs = retriever.get_relevant_documents(query)
-
-    # ✅ HARD FILTER di Python (INI KUNCINYA)
+    # category filter runs inside Qdrant (indexed payload field) instead of on the returned text
+    query_filter = None
     if category:
-        filtered_docs = [
-            d.page_content
-            for d in docs
-            if f"Product Category: {category}" in d.page_content
-        ]
-    else:
-        filtered_docs = [d.page_content for d in docs]
+        query_filter = models.Filter(should=[
+            models.FieldCondition(key="product_category", match=models.MatchValue(value=category)),
+            models.FieldCondition(key="product_category_en", match=models.MatchValue(value=category)),
+        ])
+
+    # over-fetch, then keep the best few after the local rerank (rerank.py)
+    query_vector = embeddings.embed_query(query)
+    points = client.query_points(
+        collection_name=COLLECTION_NAME,
+        query=query_vector,
+        query_filter=query_filter,
+        search_params=COLLECTION_PROFILE.search_params(),
+        limit=RERANK_CANDIDATES if RERANK_ENABLED else 30,
+        with_payload=True,
+        with_vectors=RERANK_ENABLED,
+    ).points
+    if RERANK_ENABLED:
+        points = rerank(query, query_vector, points, top_n=RERANK_TOP_N)
 
-    return filtered_docs
+    return [point_text(p) for p in points]
 
 
 
@@ -161,16 +196,15 @@ def sql_query(query: str) -> list:
     cleaned_query = query.strip()
     cleaned_query = re.sub(r"```sql|```", "", cleaned_query, flags=re.IGNORECASE).strip()
 
-    conn = sqlite3.connect(SQLITE_PATH)
-    cur = conn.cursor()
-
     try:
-        cur.execute(cleaned_query)
-        return cur.fetchall()
+        cur = sqlite_pool.reader().cursor()
+        try:
+            cur.execute(cleaned_query)
+            return cur.fetchall()
+        finally:
+            cur.close()
     except Exception as e:
         return [f"SQL Error: {str(e)}"]
-    finally:
-        conn.close()
 
 
 # ================= TOOLS =================
@@ -333,6 +367,10 @@ def health():
         "qdrant_api_key_set": bool(QDRANT_API_KEY),
         "openai_api_key_set": bool(os.getenv("OPENAI_API_KEY")),
         "collection_name": COLLECTION_NAME,
+        "collection_profile": COLLECTION_PROFILE.name,
+        "embedding_cache": embeddings.stats() if isinstance(embeddings, CachedEmbeddings) else None,
+        "embedding_model": getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None),
+        "collection_dimensions": collection_dimensions,
     }
     return {"status": "running", "details": details}
 
@@ -1,55 +1,123 @@
 #!/usr/bin/env python3
-"""Create keyword index on product_category field in Qdrant collection."""
+"""Payload index manager for the Qdrant collections.
+
+PAYLOAD_INDEXES declares, per collection, which payload fields are filtered
+on and with which index type. ensure_payload_indexes() compares that with the
+collection's payload schema and only creates what is missing (re-creating an
+index whose type changed), so it is safe to run on every upload / startup.
+
+    python create_qdrant_index.py                  # QDRANT_COLLECTION, else every declared collection
+    python create_qdrant_index.py olist_products   # just these
+
+upload_to_qdrant.py and app.py call ensure_payload_indexes() for the
+collections they create; query_filters.py builds its range filters on the
+fields declared here.
+"""
 import os
+import sys
+from typing import Dict, Optional
+
 from qdrant_client import QdrantClient
 from qdrant_client.models import PayloadSchemaType
 from dotenv import load_dotenv
 import toml
 
-load_dotenv()
-
-# Load secrets.toml if available
-secrets_path = os.path.join(os.path.dirname(__file__), "secrets.toml")
-if os.path.exists(secrets_path):
-    secrets = toml.load(secrets_path)
-    for k, v in secrets.items():
-        if v and not os.getenv(k):
-            os.environ[k] = v
-
-QDRANT_URL = os.getenv("QDRANT_URL")
-QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
-QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "olist_products")
-
-def create_category_index():
-    """Create a keyword index on the product_category field."""
-    try:
-        # Initialize Qdrant client
-        client = QdrantClient(
-            url=QDRANT_URL,
-            api_key=QDRANT_API_KEY,
-            timeout=60
-        )
-        
-        print(f"Creating keyword index on 'product_category' in collection '{QDRANT_COLLECTION}'...")
-        
-        # Create index for product_category field
-        client.create_payload_index(
-            collection_name=QDRANT_COLLECTION,
-            field_name="product_category",
-            field_schema=PayloadSchemaType.KEYWORD
-        )
-        
-        print("✅ Index created successfully!")
-        
-        # Verify index was created
-        collection_info = client.get_collection(QDRANT_COLLECTION)
-        print("\nCollection payload schema:")
-        for field, schema in collection_info.payload_schema.items():
-            print(f"  - {field}: {schema}")
-        
-    except Exception as e:
-        print(f"❌ Error creating index: {e}")
-        raise
+# collection -> {payload key: index type}. olist_products is written by
+# upload_to_qdrant.py (flat payload); the collections app.py builds through
+# LangChain keep document metadata under "metadata".
+PAYLOAD_INDEXES: Dict[str, Dict[str, PayloadSchemaType]] = {
+    "olist_products": {
+        "product_id": PayloadSchemaType.KEYWORD,
+        "product_category": PayloadSchemaType.KEYWORD,
+        "product_category_en": PayloadSchemaType.KEYWORD,
+        "avg_review_score": PayloadSchemaType.FLOAT,
+        "num_reviews": PayloadSchemaType.INTEGER,
+    },
+    "olist_reviews": {
+        "metadata.review_id": PayloadSchemaType.KEYWORD,
+        "metadata.order_id": PayloadSchemaType.KEYWORD,
+        "metadata.review_score": PayloadSchemaType.INTEGER,
+    },
+    "olist_products_semantic": {
+        "metadata.product_id": PayloadSchemaType.KEYWORD,
+        "metadata.product_category_name": PayloadSchemaType.KEYWORD,
+    },
+}
+
+
+def declared_indexes(collection_name: str) -> Dict[str, PayloadSchemaType]:
+    return PAYLOAD_INDEXES.get(collection_name, {})
+
+
+def payload_key(collection_name: str, field: str) -> Optional[str]:
+    """Declared payload key for a field name ('review_score' -> 'metadata.review_score'), or None."""
+    for key in declared_indexes(collection_name):
+        if key == field or key.endswith("." + field):
+            return key
+    return None
+
+
+def ensure_payload_indexes(client, collection_name: str, indexes: Optional[Dict[str, PayloadSchemaType]] = None,
+                           wait: bool = True) -> Dict[str, str]:
+    """Create the declared indexes a collection lacks; returns {field: 'created' | 'recreated' | 'ok'}."""
+    indexes = declared_indexes(collection_name) if indexes is None else indexes
+    existing = client.get_collection(collection_name).payload_schema or {}
+    actions = {}
+    for field, schema in indexes.items():
+        current = existing.get(field)
+        current_type = getattr(current, "data_type", None)
+        if current_type == schema:
+            actions[field] = "ok"
+            continue
+        if current is not None:
+            client.delete_payload_index(collection_name=collection_name, field_name=field, wait=wait)
+        client.create_payload_index(collection_name=collection_name, field_name=field, field_schema=schema, wait=wait)
+        actions[field] = "recreated" if current is not None else "created"
+    return actions
+
+
+def load_settings():
+    load_dotenv()
+    # Load secrets.toml if available
+    secrets_path = os.path.join(os.path.dirname(__file__), "secrets.toml")
+    if os.path.exists(secrets_path):
+        secrets = toml.load(secrets_path)
+        for k, v in secrets.items():
+            if v and not os.getenv(k):
+                os.environ[k] = v
+
+
+def main():
+    load_settings()
+    client = QdrantClient(
+        url=os.getenv("QDRANT_URL"),
+        api_key=os.getenv("QDRANT_API_KEY"),
+        timeout=60
+    )
+    default = [os.getenv("QDRANT_COLLECTION")] if os.getenv("QDRANT_COLLECTION") else list(PAYLOAD_INDEXES)
+    collections = sys.argv[1:] or default
+    existing = {c.name for c in client.get_collections().collections}
+    failed = False
+    for name in collections:
+        if name not in existing:
+            print(f"⚠️  Collection '{name}' does not exist; skipping")
+            continue
+        if not declared_indexes(name):
+            print(f"⚠️  No indexes declared for '{name}' in PAYLOAD_INDEXES; skipping")
+            continue
+        try:
+            actions = ensure_payload_indexes(client, name)
+        except Exception as e:
+            print(f"❌ Error indexing '{name}': {e}")
+            failed = True
+            continue
+        print(f"✅ {name}: " + ", ".join(f"{field} ({action})" for field, action in actions.items()))
+        print("  payload schema:")
+        for field, schema in client.get_collection(name).payload_schema.items():
+            print(f"  - {field}: {schema.data_type}")
+    if failed:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
-    create_category_index()
+    main()
@@ -0,0 +1,142 @@
+"""
+duckdb_engine.py
+
+Optional in-process DuckDB engine over the Parquet copy written by
+preprocess_sql.py (./FP/parquet/<table>/).
+
+Aggregate-style SELECTs (GROUP BY, COUNT/SUM/AVG/...) scan far fewer bytes
+on columnar files with DuckDB's vectorized executor than on row-oriented
+SQLite, while point lookups by key stay faster on SQLite's B-tree indexes.
+is_analytical() makes that call; SQLRagAgent routes accordingly and falls
+back to SQLite whenever DuckDB is unavailable or rejects the SQLite dialect.
+
+Where DuckDB accepts the SQL but would answer differently, the connection
+and the statement are aligned with SQLite instead: integer_division makes
+7/2 = 3 as in SQLite, and LIKE (case-insensitive in SQLite, case-sensitive
+in DuckDB) is rewritten to ILIKE.
+"""
+
+import os
+import re
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from sql_guard import QueryAbortedError, limit_wrapped
+
+AGGREGATE_RE = re.compile(r"\bgroup\s+by\b|\b(count|sum|avg|min|max)\s*\(", re.IGNORECASE)
+# "WHERE x_id = '...'" / "x_id IN (...)" -> indexed point lookup
+POINT_LOOKUP_RE = re.compile(r"\b\w+_id\s*(=|in\s*\()\s*['\"\d(]", re.IGNORECASE)
+
+# string literals / quoted identifiers / comments (left untouched) or a LIKE keyword
+LIKE_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/)|\bLIKE\b", re.IGNORECASE | re.DOTALL)
+
+# Hive partition columns are text (YYYY-MM), never auto-cast to dates
+HIVE_TYPES = {"purchase_month": "VARCHAR"}
+
+
+def duckdb_available() -> bool:
+    """True when the optional duckdb package is installed."""
+    try:
+        import duckdb  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def sqlite_semantics(sql: str) -> str:
+    """Rewrite LIKE to ILIKE so DuckDB matches case-insensitively like SQLite."""
+    return LIKE_RE.sub(lambda m: m.group(1) or "ILIKE", sql)
+
+
+def is_analytical(sql: str) -> bool:
+    """Aggregate/scan-heavy SELECT that is not a keyed point lookup."""
+    s = sql or ""
+    return bool(AGGREGATE_RE.search(s)) and not POINT_LOOKUP_RE.search(s)
+
+
+class DuckDBEngine:
+    """Views over Parquet table directories in an in-memory DuckDB database."""
+
+    def __init__(self, parquet_dir: str, threads: Optional[int] = None):
+        self.parquet_dir = Path(parquet_dir)
+        self.threads = threads
+        self._conn = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self.stats_counters = {"queries": 0, "errors": 0, "timeouts": 0}
+
+    def _table_dirs(self) -> dict:
+        if not self.parquet_dir.is_dir():
+            return {}
+        return {p.name: p for p in self.parquet_dir.iterdir() if p.is_dir() and not p.name.startswith(".")}
+
+    def _current_signature(self, dirs: dict):
+        # preprocess_sql swaps whole table directories, so their inode/mtime change on rebuild
+        sig = []
+        for name, path in sorted(dirs.items()):
+            st = os.stat(path)
+            sig.append((name, st.st_ino, st.st_mtime_ns))
+        return tuple(sig)
+
+    def available(self) -> bool:
+        return duckdb_available() and bool(self._table_dirs())
+
+    def _connection(self):
+        """Shared connection, rebuilt when the Parquet export changes."""
+        import duckdb
+
+        dirs = self._table_dirs()
+        signature = self._current_signature(dirs)
+        with self._lock:
+            if self._conn is not None and signature == self._signature:
+                return self._conn
+            conn = duckdb.connect(":memory:")
+            # GLOBAL: execute() runs on cursor() connections, which do not inherit SET (session) options
+            conn.execute("SET GLOBAL integer_division = true")    # int / int truncates, as in SQLite
+            if self.threads:
+                conn.execute(f"SET threads = {int(self.threads)}")
+            for name, path in dirs.items():
+                pattern = str(path / "**" / "*.parquet").replace("'", "''")
+                partitions = {child.name.split("=", 1)[0] for child in path.iterdir() if child.is_dir() and "=" in child.name}
+                hive_types = {k: v for k, v in HIVE_TYPES.items() if k in partitions}
+                options = "union_by_name = true"
+                if partitions:
+                    options += ", hive_partitioning = true"
+                    if hive_types:
+                        types = ", ".join(f"'{k}': '{v}'" for k, v in hive_types.items())
+                        options += f", hive_types = {{{types}}}"
+                conn.execute(f'CREATE VIEW "{name}" AS SELECT * FROM read_parquet(\'{pattern}\', {options})')
+            if self._conn is not None:
+                self._conn.close()
+            self._conn, self._signature = conn, signature
+            return conn
+
+    def execute(self, sql: str, max_rows: int, time_budget_s: float) -> Tuple[List[str], list, bool]:
+        """Run a SELECT with a row cap and time budget; returns (columns, rows, truncated)."""
+        cursor = self._connection().cursor()
+        timer = threading.Timer(time_budget_s, cursor.interrupt)
+        timer.start()
+        try:
+            cursor.execute(limit_wrapped(sqlite_semantics(sql), max_rows + 1))
+            columns = [d[0] for d in cursor.description or []]
+            rows = cursor.fetchall()
+        except Exception as e:
+            if not timer.is_alive() and "interrupt" in str(e).lower():
+                self.stats_counters["timeouts"] += 1
+                raise QueryAbortedError(
+                    "timeout",
+                    f"Query exceeded the {time_budget_s:g}s time budget and was stopped.",
+                    sql=sql,
+                    hint="Ask a narrower question (one category, a date range) or an aggregate instead of raw rows.",
+                ) from e
+            self.stats_counters["errors"] += 1
+            raise
+        finally:
+            timer.cancel()
+            cursor.close()
+        self.stats_counters["queries"] += 1
+        return columns, rows[:max_rows], len(rows) > max_rows
+
+    def stats(self) -> dict:
+        return {**self.stats_counters, "tables": sorted(self._table_dirs())}
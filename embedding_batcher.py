@@ -0,0 +1,287 @@
+"""
+embedding_batcher.py
+
+Token-aware request packing and adaptive rate limiting for embedding calls.
+
+Merged product documents range from a few hundred to several thousand
+characters, so a fixed number of texts per request either wastes the
+per-request budget or trips tokens-per-minute limits. pack_batches() fills
+each request up to a token budget (counted with tiktoken), and TokenBucket
+spends tokens/requests per minute, backing off on 429 / Retry-After and
+creeping back up to the configured rate after successful calls (AIMD).
+
+TokenBatchedEmbeddings wraps any LangChain Embeddings with both; it is used
+by upload_to_qdrant.py and by app.py (startup ingestion and /upload).
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))   # per request (API cap 300k)
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "512"))        # per request (API cap 2048)
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("EMBED_TOKENS_PER_MINUTE", "1000000"))
+EMBED_REQUESTS_PER_MINUTE = int(os.getenv("EMBED_REQUESTS_PER_MINUTE", "3000"))
+EMBED_RATE_LIMIT_RETRIES = int(os.getenv("EMBED_RATE_LIMIT_RETRIES", "8"))
+
+RETRY_IN_RE = re.compile(r"try again in\s+([\d.]+)\s*(ms|s)\b", re.IGNORECASE)
+
+
+class TokenCounter:
+    """tiktoken counts for an embedding model; a conservative estimate if tiktoken is unavailable."""
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def encoding(self):
+        """Loaded on first use (tiktoken may download its BPE file)."""
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                try:
+                    import tiktoken
+                    try:
+                        self._encoding = (tiktoken.encoding_for_model(self.model) if self.model
+                                          else tiktoken.get_encoding("cl100k_base"))
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:  # not installed, or the BPE file cannot be downloaded
+                    logger.warning(f"⚠️  tiktoken unavailable ({e}); estimating tokens from text length")
+            return self._encoding
+
+    def count(self, text: str) -> int:
+        enc = self.encoding()
+        if enc is not None:
+            return len(enc.encode(text, disallowed_special=()))
+        # ~4 chars/token for English; Portuguese reviews run denser, so stay on the safe side
+        return len(text) // 3 + 1
+
+    def count_all(self, texts: List[str]) -> List[int]:
+        enc = self.encoding()
+        if enc is not None:
+            return [len(t) for t in enc.encode_batch(list(texts), disallowed_special=())]
+        return [self.count(t) for t in texts]
+
+
+def pack_batches(token_counts: List[int], max_tokens: int = EMBED_BATCH_MAX_TOKENS,
+                 max_items: int = EMBED_BATCH_MAX_ITEMS) -> List[List[int]]:
+    """Greedy, order-preserving packing of text indexes into requests under both caps.
+
+    A single text larger than max_tokens gets a request of its own.
+    """
+    batches, current, used = [], [], 0
+    for i, n in enumerate(token_counts):
+        if current and (used + n > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+def is_rate_limit(error: Exception) -> bool:
+    if type(error).__name__ == "RateLimitError":
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "429" in str(error) or "rate limit" in str(error).lower()
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Server-suggested wait from Retry-After / retry-after-ms headers or the error message."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    m = RETRY_IN_RE.search(str(error))
+    if m:
+        value = float(m.group(1))
+        return value / 1000 if m.group(2).lower() == "ms" else value
+    return None
+
+
+class TokenBucket:
+    """Tokens- and requests-per-minute limiter that adapts to 429s.
+
+    On a rate-limit error the allowed rate is cut (x0.5, floor 5%) and all
+    callers pause for Retry-After; each successful call wins back 1% of the
+    configured rate until the ceiling is reached again.
+    """
+
+    def __init__(self, tokens_per_minute: int = EMBED_TOKENS_PER_MINUTE,
+                 requests_per_minute: int = EMBED_REQUESTS_PER_MINUTE):
+        self.max_tpm = float(tokens_per_minute)
+        self.max_rpm = float(requests_per_minute)
+        self.scale = 1.0
+        self._tokens = self.max_tpm
+        self._requests = self.max_rpm
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.stats_counters = {"requests": 0, "tokens": 0, "rate_limited": 0, "waited_s": 0.0}
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.max_tpm * self.scale, self._tokens + elapsed * self.max_tpm * self.scale / 60)
+        self._requests = min(self.max_rpm * self.scale, self._requests + elapsed * self.max_rpm * self.scale / 60)
+
+    def _reserve(self, tokens: int) -> float:
+        """Take the budget if available and return 0, else return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            # a request bigger than the whole bucket only needs a full bucket
+            need = min(float(tokens), self.max_tpm * self.scale)
+            if self._tokens >= need and self._requests >= 1:
+                self._tokens -= need
+                self._requests -= 1
+                self.stats_counters["requests"] += 1
+                self.stats_counters["tokens"] += tokens
+                return 0.0
+            token_wait = (need - self._tokens) * 60 / (self.max_tpm * self.scale)
+            request_wait = (1 - self._requests) * 60 / (self.max_rpm * self.scale)
+            return max(token_wait, request_wait, 0.01)
+
+    def acquire(self, tokens: int):
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            with self._lock:
+                self.stats_counters["waited_s"] += wait
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int):
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            with self._lock:
+                self.stats_counters["waited_s"] += wait
+            await asyncio.sleep(wait)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.stats_counters["rate_limited"] += 1
+            now = time.monotonic()
+            # concurrent 429s from the same burst count as one congestion signal
+            if now >= self._paused_until:
+                self.scale = max(0.05, self.scale * 0.5)
+            pause = retry_after if retry_after is not None else 60 / max(self.max_rpm * self.scale, 1) + 1
+            self._paused_until = max(self._paused_until, now + pause)
+            self._tokens = min(self._tokens, 0.0)
+        logger.warning(f"⚠️  Embedding rate limited; pausing {pause:.1f}s, rate now {self.scale:.0%} of limit")
+
+    def reward(self):
+        with self._lock:
+            self.scale = min(1.0, self.scale + 0.01)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.stats_counters, "waited_s": round(self.stats_counters["waited_s"], 2),
+                    "rate_scale": round(self.scale, 3), "tokens_per_minute": int(self.max_tpm * self.scale)}
+
+
+class TokenBatchedEmbeddings(Embeddings):
+    """Embeddings wrapper: token-budget request packing + adaptive rate limiting.
+
+    Rate-limit errors are retried here (after the bucket's pause); any other
+    error is raised to the caller unchanged.
+    """
+
+    def __init__(self, inner: Embeddings, limiter: Optional[TokenBucket] = None,
+                 max_batch_tokens: int = EMBED_BATCH_MAX_TOKENS, max_batch_items: int = EMBED_BATCH_MAX_ITEMS,
+                 max_rate_limit_retries: int = EMBED_RATE_LIMIT_RETRIES):
+        self.inner = inner
+        self.limiter = limiter or TokenBucket()
+        self.counter = TokenCounter(getattr(inner, "model", None))
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_rate_limit_retries = max_rate_limit_retries
+        # the cache keys on the wrapped model's name/dimensions
+        self.model = getattr(inner, "model", None)
+        self.dimensions = getattr(inner, "dimensions", None)
+
+    def plan(self, texts: List[str]):
+        """(batches of indexes, token count per text) for a list of texts."""
+        counts = self.counter.count_all(texts)
+        return pack_batches(counts, self.max_batch_tokens, self.max_batch_items), counts
+
+    def _call(self, fn, texts: List[str], tokens: int):
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                result = fn(texts)
+            except Exception as e:
+                if not is_rate_limit(e) or attempt >= self.max_rate_limit_retries:
+                    raise
+                attempt += 1
+                self.limiter.penalize(retry_after_seconds(e))
+                continue
+            self.limiter.reward()
+            return result
+
+    async def _acall(self, fn, texts: List[str], tokens: int):
+        attempt = 0
+        while True:
+            await self.limiter.aacquire(tokens)
+            try:
+                result = await fn(texts)
+            except Exception as e:
+                if not is_rate_limit(e) or attempt >= self.max_rate_limit_retries:
+                    raise
+                attempt += 1
+                self.limiter.penalize(retry_after_seconds(e))
+                continue
+            self.limiter.reward()
+            return result
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches, counts = self.plan(texts)
+        vectors = [None] * len(texts)
+        for batch in batches:
+            out = self._call(self.inner.embed_documents, [texts[i] for i in batch], sum(counts[i] for i in batch))
+            for i, vec in zip(batch, out):
+                vectors[i] = vec
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(lambda t: self.inner.embed_query(t[0]), [text], self.counter.count(text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches, counts = self.plan(texts)
+        vectors = [None] * len(texts)
+        for batch in batches:
+            out = await self._acall(self.inner.aembed_documents, [texts[i] for i in batch],
+                                    sum(counts[i] for i in batch))
+            for i, vec in zip(batch, out):
+                vectors[i] = vec
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def one(t):
+            return await self.inner.aembed_query(t[0])
+        return await self._acall(one, [text], self.counter.count(text))
+
+    def stats(self) -> dict:
+        return self.limiter.stats()
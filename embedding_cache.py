@@ -0,0 +1,209 @@
+"""
+embedding_cache.py
+
+Caching wrapper for LangChain embedding models.
+
+Vectors are looked up in an in-process LRU first, then in an on-disk SQLite
+store keyed by (model name, sha256 of the text). Only texts missing from both
+layers are sent to the wrapped model, in a single embed_documents call.
+Vectors are stored as float32 blobs; the disk table keeps at most max_disk_rows
+of them, dropping the oldest writes first.
+
+Meant for query texts, which repeat. Bulk ingestion (from_documents /
+add_texts) should use the wrapped model directly (see uncached()): every
+ingested document is embedded once, and caching it would only evict the
+query entries and grow the file.
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def uncached(embeddings) -> Embeddings:
+    """The model behind a CachedEmbeddings (for bulk ingestion); other embeddings as is."""
+    return embeddings.inner if isinstance(embeddings, CachedEmbeddings) else embeddings
+
+
+def model_cache_name(embeddings) -> str:
+    """Name used to partition the cache, e.g. 'text-embedding-3-small'."""
+    name = getattr(embeddings, "model", None) or type(embeddings).__name__
+    dims = getattr(embeddings, "dimensions", None)
+    return f"{name}:{dims}" if dims else str(name)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with a memory LRU + persistent SQLite cache."""
+
+    def __init__(self, inner: Embeddings, path: Optional[str] = "embedding_cache.db", max_memory_items: int = 10000,
+                 max_disk_rows: int = 50000):
+        self.inner = inner
+        self.model_name = model_cache_name(inner)
+        self.max_memory_items = max_memory_items
+        self.max_disk_rows = max_disk_rows
+        self._disk_rows = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute("PRAGMA synchronous=NORMAL;")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT,
+                    text_hash TEXT,
+                    vector BLOB,
+                    PRIMARY KEY (model, text_hash)
+                )
+            """)
+            self._conn.commit()
+            self._disk_rows = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._prune():
+                # shrink a file grown before the cap existed; later deletes leave pages for reuse
+                self._conn.execute("VACUUM")
+        self.path = path
+
+    # ---------------- cache layers ----------------
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _remember(self, h: str, vec: List[float]):
+        self._memory[h] = vec
+        self._memory.move_to_end(h)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, hashes: List[str]) -> dict:
+        """Resolve as many hashes as possible from memory, then disk."""
+        found = {}
+        with self._lock:
+            pending = []
+            for h in hashes:
+                if h in self._memory:
+                    self._memory.move_to_end(h)
+                    found[h] = self._memory[h]
+                    self.stats_counters["memory_hits"] += 1
+                else:
+                    pending.append(h)
+
+            if pending and self._conn is not None:
+                unique = list(dict.fromkeys(pending))
+                # Stay well below SQLite's bound-parameter limit
+                for i in range(0, len(unique), 500):
+                    chunk = unique[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    rows = self._conn.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                        [self.model_name, *chunk],
+                    ).fetchall()
+                    for h, blob in rows:
+                        vec = np.frombuffer(blob, dtype=np.float32).tolist()
+                        found[h] = vec
+                        self._remember(h, vec)
+                for h in pending:
+                    if h in found:
+                        self.stats_counters["disk_hits"] += 1
+        return found
+
+    def _store(self, items: dict):
+        with self._lock:
+            for h, vec in items.items():
+                self._remember(h, vec)
+            if self._conn is not None and items:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    [(self.model_name, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()],
+                )
+                self._conn.commit()
+                self._disk_rows += len(items)    # upper bound (replaced rows); _prune recounts
+                self._prune()
+
+    def _prune(self) -> int:
+        """Delete the oldest rows (lowest rowid: INSERT OR REPLACE gives a fresh one) beyond max_disk_rows."""
+        excess = self._disk_rows - self.max_disk_rows
+        if self._conn is None or not self.max_disk_rows or excess <= 0:
+            return 0
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)", (excess,))
+        self._conn.commit()
+        self._disk_rows = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return excess
+
+    def _missing(self, texts: List[str], hashes: List[str], found: dict):
+        """Unique (hash, text) pairs that still need the remote model."""
+        missing = OrderedDict()
+        for t, h in zip(texts, hashes):
+            if h not in found and h not in missing:
+                missing[h] = t
+        with self._lock:
+            self.stats_counters["misses"] += len(missing)
+        return missing
+
+    # ---------------- Embeddings interface ----------------
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [self._hash(t) for t in texts]
+        found = self._lookup(hashes)
+        missing = self._missing(texts, hashes, found)
+        if missing:
+            vectors = self.inner.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._store(fresh)
+            found.update(fresh)
+        return [found[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        h = self._hash(text)
+        found = self._lookup([h])
+        if h in found:
+            return found[h]
+        self._missing([text], [h], found)
+        vec = self.inner.embed_query(text)
+        self._store({h: vec})
+        return vec
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [self._hash(t) for t in texts]
+        found = await asyncio.to_thread(self._lookup, hashes)
+        missing = self._missing(texts, hashes, found)
+        if missing:
+            vectors = await self.inner.aembed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            await asyncio.to_thread(self._store, fresh)
+            found.update(fresh)
+        return [found[h] for h in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        h = self._hash(text)
+        found = await asyncio.to_thread(self._lookup, [h])
+        if h in found:
+            return found[h]
+        self._missing([text], [h], found)
+        vec = await self.inner.aembed_query(text)
+        await asyncio.to_thread(self._store, {h: vec})
+        return vec
+
+    # ---------------- stats ----------------
+
+    def stats(self) -> dict:
+        c = dict(self.stats_counters)
+        hits = c["memory_hits"] + c["disk_hits"]
+        lookups = hits + c["misses"]
+        c["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        c["memory_items"] = len(self._memory)
+        c["disk_rows"] = self._disk_rows
+        c["max_disk_rows"] = self.max_disk_rows
+        c["model"] = self.model_name
+        c["path"] = self.path
+        return c
@@ -0,0 +1,320 @@
+"""
+embedding_providers.py
+
+Embedding backend selected by EMBEDDING_PROVIDER:
+
+    openai  (default) langchain_openai.OpenAIEmbeddings (EMBEDDING_MODEL), remote
+    local   LocalHashEmbeddings: CPU-only, offline, ~tens of microseconds/query
+
+The local backend hashes accent-folded word unigrams, word bigrams and
+character trigrams into LOCAL_EMBEDDING_FEATURES buckets (crc32, so stable
+across processes), weights them with sublinear TF-IDF and projects them to
+LOCAL_EMBEDDING_DIM dimensions. The projection is a truncated SVD (LSA)
+fitted on the review / product corpus:
+
+    python embedding_providers.py fit
+
+writes LOCAL_EMBEDDING_PATH (.npz). Without a fitted model a fixed-seed
+random projection is used, so the pipeline still runs (with weaker recall)
+on a box that has never seen the corpus.
+
+text-embedding-3 models are trained so that a prefix of the vector is itself
+a usable embedding (Matryoshka); EMBEDDING_DIMENSIONS (e.g. 256/512/1024)
+asks the API for that many dimensions, which shrinks Qdrant RAM and search
+cost. A collection must be queried at the size it was built with, so app.py
+and cfapp.py pass the collection's vector size as dimensions= when they
+connect (see benchmarks/bench_embedding_dimensions.py for the recall cost).
+
+app.py, cfapp.py and upload_to_qdrant.py all get their embeddings from
+make_embeddings().
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import unicodedata
+import zlib
+from typing import Iterable, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").strip().lower()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# reduced OpenAI output size (Matryoshka truncation); unset = the model's full size
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+LOCAL_EMBEDDING_PATH = os.getenv("LOCAL_EMBEDDING_PATH", "local_embedding.npz")
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "256"))
+LOCAL_EMBEDDING_FEATURES = int(os.getenv("LOCAL_EMBEDDING_FEATURES", str(2 ** 15)))
+# "path:column" entries, comma separated
+LOCAL_EMBEDDING_CORPUS = os.getenv(
+    "LOCAL_EMBEDDING_CORPUS",
+    "merged_per_product_docbase.csv:document,"
+    "isi olist db/order_reviews.csv:review_comment_title,"
+    "isi olist db/order_reviews.csv:review_comment_message",
+)
+
+# full output size per OpenAI model; only the text-embedding-3 family accepts dimensions=
+OPENAI_MODEL_DIMENSIONS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072,
+                           "text-embedding-ada-002": 1536}
+TOKEN_RE = re.compile(r"\w+")
+RANDOM_PROJECTION_SEED = 20240601
+SPARSE_CHUNK_FLOATS = 32_000_000  # float32 scratch per chunk (128 MB) in the sparse products used by fit()
+WORD_CACHE_SIZE = 200_000
+
+
+def fold_text(text: str) -> str:
+    """Lowercase and strip accents ("não" -> "nao") so spelling variants share features."""
+    decomposed = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+class HashedFeaturizer:
+    """Text -> (feature ids, counts) over n_features hash buckets."""
+
+    def __init__(self, n_features: int = LOCAL_EMBEDDING_FEATURES):
+        self.n_features = n_features
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def _hash(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.n_features
+
+    def word_features(self, word: str) -> List[int]:
+        feats = self._words.get(word)
+        if feats is None:
+            padded = f"<{word}>"
+            feats = [self._hash("w:" + word)] + [self._hash("c:" + padded[i:i + 3]) for i in range(len(padded) - 2)]
+            with self._lock:
+                if len(self._words) >= WORD_CACHE_SIZE:
+                    self._words.clear()
+                self._words[word] = feats
+        return feats
+
+    def features(self, text: str):
+        words = TOKEN_RE.findall(fold_text(text))
+        feats = []
+        for w in words:
+            feats.extend(self.word_features(w))
+        feats.extend(self._hash(f"b:{a} {b}") for a, b in zip(words, words[1:]))
+        if not feats:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        ids, counts = np.unique(np.asarray(feats, dtype=np.int32), return_counts=True)
+        return ids, counts.astype(np.float32)
+
+
+def _sparse_matmul(ptr: np.ndarray, idx: np.ndarray, data: np.ndarray, dense: np.ndarray) -> np.ndarray:
+    """out[r] = sum(data[j] * dense[idx[j]] for j in ptr[r]:ptr[r+1]), chunked to bound memory."""
+    n_out = len(ptr) - 1
+    out = np.zeros((n_out, dense.shape[1]), dtype=np.float32)
+    chunk_nnz = max(1, SPARSE_CHUNK_FLOATS // dense.shape[1])
+    start = 0
+    while start < n_out:
+        stop = max(start + 1, int(np.searchsorted(ptr, ptr[start] + chunk_nnz, side="right")) - 1)
+        stop = min(stop, n_out)
+        a, b = ptr[start], ptr[stop]
+        nonempty = np.flatnonzero(ptr[start + 1:stop + 1] > ptr[start:stop])
+        if len(nonempty):
+            weighted = data[a:b, None] * dense[idx[a:b]]
+            # empty rows have zero length, so each segment runs to the next non-empty row
+            out[start + nonempty] = np.add.reduceat(weighted, ptr[start + nonempty] - a, axis=0)
+        start = stop
+    return out
+
+
+class LocalHashEmbeddings(Embeddings):
+    """Hashed n-gram TF-IDF -> SVD (or random) projection; L2-normalized for cosine search."""
+
+    def __init__(self, idf: np.ndarray, projection: np.ndarray, fitted: bool = False):
+        self.idf = idf.astype(np.float32)
+        self.projection = np.ascontiguousarray(projection, dtype=np.float32)   # (n_features, dim)
+        self.featurizer = HashedFeaturizer(len(idf))
+        self.fitted = fitted
+        self.dimensions = self.projection.shape[1]
+        digest = hashlib.sha256(self.idf.tobytes() + self.projection[:64].tobytes()).hexdigest()[:12]
+        # model/dimensions partition CachedEmbeddings and the upload manifest
+        self.model = f"local-hash-{'lsa' if fitted else 'rp'}-{digest}"
+
+    # ---------------- construction ----------------
+
+    @classmethod
+    def random(cls, dim: int = LOCAL_EMBEDDING_DIM, n_features: int = LOCAL_EMBEDDING_FEATURES):
+        """Unfitted model: idf 1, fixed-seed Gaussian projection (Johnson-Lindenstrauss)."""
+        rng = np.random.default_rng(RANDOM_PROJECTION_SEED)
+        projection = rng.standard_normal((n_features, dim), dtype=np.float32) / np.sqrt(dim)
+        return cls(np.ones(n_features, dtype=np.float32), projection, fitted=False)
+
+    @classmethod
+    def load(cls, path: str = LOCAL_EMBEDDING_PATH):
+        with np.load(path) as data:
+            return cls(data["idf"], data["projection"], fitted=True)
+
+    @classmethod
+    def load_or_random(cls, path: str = LOCAL_EMBEDDING_PATH, dim: int = LOCAL_EMBEDDING_DIM):
+        if path and os.path.exists(path):
+            return cls.load(path)
+        return cls.random(dim)
+
+    def save(self, path: str = LOCAL_EMBEDDING_PATH):
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(tmp, idf=self.idf, projection=self.projection,
+                            meta=np.array(json.dumps({"model": self.model, "dimensions": self.dimensions})))
+        os.replace(tmp, path)
+
+    @classmethod
+    def fit(cls, texts: Iterable[str], dim: int = LOCAL_EMBEDDING_DIM, n_features: int = LOCAL_EMBEDDING_FEATURES,
+            n_iter: int = 4, oversample: int = 10):
+        """TF-IDF over hashed features, then a randomized truncated SVD (Halko et al.)."""
+        featurizer = HashedFeaturizer(n_features)
+        indptr, indices, counts = [0], [], []
+        for text in texts:
+            ids, cnt = featurizer.features(text)
+            indices.append(ids)
+            counts.append(cnt)
+            indptr.append(indptr[-1] + len(ids))
+        n_docs = len(indptr) - 1
+        if n_docs < dim:
+            raise ValueError(f"need at least {dim} documents to fit a {dim}-d projection, got {n_docs}")
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.concatenate(indices)
+        tf = np.concatenate(counts)
+
+        df = np.bincount(indices, minlength=n_features)
+        idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        data = (1 + np.log(tf)) * idf[indices]
+        del tf
+        row_of = np.repeat(np.arange(n_docs, dtype=np.int32), np.diff(indptr))
+        norms = np.sqrt(np.bincount(row_of, weights=data ** 2, minlength=n_docs))
+        norms[norms == 0] = 1.0
+        data = (data / norms[row_of]).astype(np.float32)
+
+        # column-major copy for A.T @ X
+        order = np.argsort(indices, kind="stable")
+        rows = row_of[order]
+        colptr = np.concatenate([[0], np.cumsum(np.bincount(indices, minlength=n_features))])
+        data_t = data[order]
+        del order, row_of
+
+        def a_dot(m):
+            return _sparse_matmul(indptr, indices, data, m)
+
+        def at_dot(m):
+            return _sparse_matmul(colptr, rows, data_t, m)
+
+        k = min(dim + oversample, n_features)
+        rng = np.random.default_rng(RANDOM_PROJECTION_SEED)
+        q, _ = np.linalg.qr(a_dot(rng.standard_normal((n_features, k), dtype=np.float32)))
+        for _ in range(n_iter):
+            z, _ = np.linalg.qr(at_dot(q))
+            q, _ = np.linalg.qr(a_dot(z))
+        b_t = at_dot(q)                                  # (n_features, k) = (Q^T A)^T
+        _, _, vt = np.linalg.svd(b_t.T.astype(np.float64), full_matrices=False)
+        return cls(idf, vt[:dim].T, fitted=True)
+
+    # ---------------- Embeddings interface ----------------
+
+    def embed_one(self, text: str) -> np.ndarray:
+        ids, counts = self.featurizer.features(text)
+        if not len(ids):
+            return np.zeros(self.dimensions, dtype=np.float32)
+        w = (1 + np.log(counts)) * self.idf[ids]
+        vec = w @ self.projection[ids]
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_one(t).tolist() for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_one(text).tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+# ---------------- provider selection ----------------
+
+_local_model = None
+_local_lock = threading.Lock()
+
+
+def local_embeddings(path: str = LOCAL_EMBEDDING_PATH) -> LocalHashEmbeddings:
+    """Process-wide LocalHashEmbeddings (the projection matrix is loaded once)."""
+    global _local_model
+    with _local_lock:
+        if _local_model is None:
+            _local_model = LocalHashEmbeddings.load_or_random(path)
+        return _local_model
+
+
+def is_local(provider: Optional[str] = None) -> bool:
+    return (provider or EMBEDDING_PROVIDER) == "local"
+
+
+def make_embeddings(provider: Optional[str] = None, model: Optional[str] = None,
+                    dimensions: Optional[int] = None, **openai_kwargs) -> Embeddings:
+    """Raw embeddings for the configured provider (callers add caching / rate limiting).
+
+    dimensions overrides EMBEDDING_DIMENSIONS for OpenAI; the local model's
+    size is fixed when it is fitted, so it is ignored there.
+    """
+    provider = provider or EMBEDDING_PROVIDER
+    if provider == "local":
+        return local_embeddings()
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        model = model or EMBEDDING_MODEL
+        dimensions = dimensions or EMBEDDING_DIMENSIONS
+        # the full size is the API default; leaving it unset keeps cache keys / manifests unchanged
+        if dimensions and dimensions != OPENAI_MODEL_DIMENSIONS.get(model):
+            if not model.startswith("text-embedding-3"):
+                raise ValueError(f"{model} does not support reduced dimensions (EMBEDDING_DIMENSIONS={dimensions})")
+            openai_kwargs["dimensions"] = dimensions
+        return OpenAIEmbeddings(model=model, **openai_kwargs)
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER {provider!r} (expected 'openai' or 'local')")
+
+
+def embedding_dimension(embeddings, default: Optional[int] = None) -> Optional[int]:
+    """Vector size these embeddings produce (looks through cache / batching wrappers)."""
+    while not getattr(embeddings, "dimensions", None) and hasattr(embeddings, "inner"):
+        embeddings = embeddings.inner
+    return (getattr(embeddings, "dimensions", None)
+            or OPENAI_MODEL_DIMENSIONS.get(getattr(embeddings, "model", None))
+            or default)
+
+
+def corpus_texts(spec: str = LOCAL_EMBEDDING_CORPUS):
+    """Non-empty texts from the "path:column" CSV entries that exist."""
+    import pandas as pd
+
+    for entry in filter(None, (s.strip() for s in spec.split(","))):
+        path, _, column = entry.rpartition(":")
+        if not os.path.exists(path):
+            print(f"skip {path} (not found)")
+            continue
+        for chunk in pd.read_csv(path, usecols=[column], chunksize=100_000):
+            values = chunk[column].dropna().astype(str)
+            yield from (v for v in values if v.strip())
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != "fit":
+        print("usage: python embedding_providers.py fit   (LOCAL_EMBEDDING_CORPUS / _DIM / _PATH via env)")
+        sys.exit(1)
+    texts = list(corpus_texts())
+    print(f"Fitting {LOCAL_EMBEDDING_DIM}-d local embeddings on {len(texts):,} texts "
+          f"({LOCAL_EMBEDDING_FEATURES:,} hashed features)...")
+    model = LocalHashEmbeddings.fit(texts)
+    model.save(LOCAL_EMBEDDING_PATH)
+    print(f"Saved {model.model} to {LOCAL_EMBEDDING_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,29 @@
 # merge_reviews_per_product.py
-import pandas as pd
+"""
+Build one text document per product (metadata + seller locations + reviews)
+for the Qdrant docbase: merged_per_product_docbase.csv.
+
+Importable: build_docbase(products, reviews, items, sellers, cat_translation)
+returns the merged frame. The pipeline is vectorized: reviews are limited
+with a stable sort + groupby().head(N), aggregated with string joins, and the
+document column is assembled column-wise instead of row by row.
+
+Streaming mode (MERGE_STREAMING=1, or build_docbase_streaming()) is for order
+histories that do not fit in memory: reviews are spilled to a temporary SQLite
+file keyed by order_id, order_items are read in MERGE_CHUNK_ROWS chunks and
+joined against it, and only bounded per-product accumulators are kept (review
+count/score sum, the first MAX_REVIEWS_TO_CONCAT titles/messages, seller ids).
+Documents are written to the CSV in slices, so peak memory follows the number
+of products, not the number of orders. The output is identical to main().
+"""
 import os
+import sqlite3
+import tempfile
 from textwrap import shorten
 
+import numpy as np
+import pandas as pd
+
 # -------------------------
 # CONFIG
 # -------------------------
@@ -18,37 +39,51 @@ OUTPUT_FILE = "merged_per_product_docbase.csv"
 # limits
 MAX_REVIEWS_TO_CONCAT = 50          # ambil maksimal X review per product untuk digabung
 MAX_COMBINED_LENGTH = 4000          # potong hasil gabungan dokument agar tidak terlalu panjang
+REVIEW_SEP = " || "
 
-# -------------------------
-# LOAD CSV
-# -------------------------
-print("Loading CSV files...")
-products = pd.read_csv(INPUT_PRODUCTS)
-reviews = pd.read_csv(INPUT_REVIEWS)
-orders = pd.read_csv(INPUT_ORDERS)
-items = pd.read_csv(INPUT_ITEMS)
-sellers = pd.read_csv(INPUT_SELLERS)
-cat_translation = pd.read_csv(INPUT_CAT_TRANS)
+# streaming (out-of-core) mode
+STREAMING = os.getenv("MERGE_STREAMING", "0") == "1"
+STREAM_CHUNK_ROWS = int(os.getenv("MERGE_CHUNK_ROWS", "100000"))
+STREAM_WRITE_ROWS = int(os.getenv("MERGE_WRITE_ROWS", "2000"))    # products per document slice
+TEXT_COLUMNS = {
+    "combined_review_titles": "review_comment_title",
+    "combined_review_messages": "review_comment_message",
+}
+
+# (label, column) pairs of the document, in order
+DOCUMENT_FIELDS = [
+    ("Product ID", "product_id"),
+    ("Product Name Length", "product_name_lenght"),
+    ("Product Category", "product_category_name"),
+    ("Category (English)", "product_category_name_english"),
+    ("Sellers (count)", "seller_count"),
+    ("Seller Cities", "seller_cities"),
+    ("Seller States", "seller_states"),
+    ("Number of Reviews", "num_reviews"),
+    ("Average Review Score", "avg_review_score"),
+    ("Combined Review Titles", "combined_review_titles"),
+    ("Combined Review Messages", "combined_review_messages"),
+]
 
 # -------------------------
-# MAP REVIEWS -> PRODUCT
-# (reviews keyed by order_id; items map order_id -> product_id)
+# LOAD CSV
 # -------------------------
-print("Mapping reviews to product_id via order_items...")
-# join items (order_id, product_id) with reviews (order_id)
-items_reviews = items[['order_id', 'product_id', 'seller_id']].merge(
-    reviews, on='order_id', how='inner'
-)
-
-# jika tidak ada review terkait product, items_reviews mungkin kosong
-print(f"Total item-review rows: {len(items_reviews)}")
+def load_inputs(base_dir: str = ".") -> dict:
+    """Read the CSVs the docbase is built from (orders are not needed)."""
+    print("Loading CSV files...")
+    path = lambda name: os.path.join(base_dir, name)  # noqa: E731
+    return {
+        "products": pd.read_csv(path(INPUT_PRODUCTS)),
+        "reviews": pd.read_csv(path(INPUT_REVIEWS)),
+        "items": pd.read_csv(path(INPUT_ITEMS)),
+        "sellers": pd.read_csv(path(INPUT_SELLERS)),
+        "cat_translation": pd.read_csv(path(INPUT_CAT_TRANS)),
+    }
 
 # -------------------------
 # AGGREGATE REVIEWS PER PRODUCT
 # -------------------------
-print("Aggregating reviews per product_id...")
-
-def concat_limited(texts, max_items=MAX_REVIEWS_TO_CONCAT, sep=" || "):
+def concat_limited(texts, max_items=MAX_REVIEWS_TO_CONCAT, sep=REVIEW_SEP):
     # ambil first N non-null texts
     vals = [str(t).strip() for t in texts if pd.notna(t) and str(t).strip() != ""]
     if not vals:
@@ -58,99 +93,336 @@ def concat_limited(texts, max_items=MAX_REVIEWS_TO_CONCAT, sep=" || "):
     # truncate length for safety
     return shorten(joined, width=MAX_COMBINED_LENGTH, placeholder=" ...")
 
-agg_funcs = {
-    'review_score': ['count', 'mean'],
-    'review_comment_title': lambda s: concat_limited(s.dropna().astype(str).tolist()),
-    'review_comment_message': lambda s: concat_limited(s.dropna().astype(str).tolist()),
-}
 
-grouped = items_reviews.groupby('product_id').agg(
-    num_reviews = ('review_score', 'count'),
-    avg_review_score = ('review_score', 'mean'),
-    combined_review_titles = ('review_comment_title', lambda s: concat_limited(s.dropna().astype(str).tolist())),
-    combined_review_messages = ('review_comment_message', lambda s: concat_limited(s.dropna().astype(str).tolist())),
-)
+def shorten_series(joined: pd.Series, width: int = MAX_COMBINED_LENGTH) -> pd.Series:
+    """textwrap.shorten over a Series: whitespace is collapsed column-wise and
+    only the (few) values still longer than width go through textwrap."""
+    collapsed = joined.str.strip().str.replace(r"\s+", " ", regex=True)
+    too_long = collapsed.str.len() > width
+    if too_long.any():
+        collapsed[too_long] = [shorten(t, width=width, placeholder=" ...") for t in collapsed[too_long]]
+    return collapsed
+
+
+def join_sorted_groups(df: pd.DataFrame, column: str, sep: str, key: str = "product_id") -> pd.Series:
+    """sep-join column over each run of equal keys; df must already be sorted by key.
 
-grouped = grouped.reset_index()
+    Slicing one Python list per group is much cheaper than groupby().agg(sep.join),
+    which materializes a Series per group.
+    """
+    keys = df[key].to_numpy()
+    values = df[column].tolist()
+    if not len(keys):
+        return pd.Series([], index=pd.Index([], name=key), dtype=str)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+    joined = [sep.join(values[a:b]) for a, b in zip(starts, ends)]
+    return pd.Series(joined, index=pd.Index(keys[starts], name=key), dtype=str)
 
-print(f"Products with >=1 review: {len(grouped)}")
+
+def join_limited(df: pd.DataFrame, column: str, max_items: int = MAX_REVIEWS_TO_CONCAT) -> pd.Series:
+    """First max_items non-empty texts per product joined with REVIEW_SEP (vectorized concat_limited)."""
+    texts = df[["product_id", column]].dropna(subset=[column])
+    texts = texts.assign(**{column: texts[column].astype(str).str.strip()})
+    texts = texts[texts[column] != ""]
+    # stable sort keeps the original review order inside each product
+    texts = texts.sort_values("product_id", kind="stable").groupby("product_id", sort=False).head(max_items)
+    return shorten_series(join_sorted_groups(texts, column, REVIEW_SEP))
+
+
+def aggregate_reviews(items_reviews: pd.DataFrame, max_items: int = MAX_REVIEWS_TO_CONCAT) -> pd.DataFrame:
+    grouped = items_reviews.groupby("product_id").agg(
+        num_reviews=("review_score", "count"),
+        avg_review_score=("review_score", "mean"),
+    )
+    for out_col, src_col in TEXT_COLUMNS.items():
+        grouped[out_col] = join_limited(items_reviews, src_col, max_items).reindex(grouped.index, fill_value="")
+    return grouped.reset_index()
 
 # -------------------------
 # ADD seller locations per product (unique cities)
 # -------------------------
-print("Collecting seller city/state per product...")
-# merge items -> sellers to get seller_city per item
-items_sellers = items[['product_id', 'seller_id']].merge(sellers[['seller_id','seller_city','seller_state']], on='seller_id', how='left')
-# aggregate unique cities per product
-seller_loc = items_sellers.groupby('product_id').agg(
-    seller_cities = ('seller_city', lambda s: ", ".join(sorted({str(x) for x in s.dropna()}) ) ),
-    seller_states = ('seller_state', lambda s: ", ".join(sorted({str(x) for x in s.dropna()}) ) ),
-    seller_count = ('seller_id', lambda s: len(set(s.dropna())) )
-).reset_index()
+def sorted_unique_join(df: pd.DataFrame, column: str, index: pd.Index) -> pd.Series:
+    """', '-joined sorted distinct values of column per product ('' when none)."""
+    vals = df[["product_id", column]].dropna(subset=[column])
+    vals = vals.assign(**{column: vals[column].astype(str)}).drop_duplicates()
+    vals = vals.sort_values(["product_id", column])
+    return join_sorted_groups(vals, column, ", ").reindex(index, fill_value="")
+
+
+def aggregate_sellers(items: pd.DataFrame, sellers: pd.DataFrame) -> pd.DataFrame:
+    # merge items -> sellers to get seller_city per item
+    items_sellers = items[["product_id", "seller_id"]].merge(
+        sellers[["seller_id", "seller_city", "seller_state"]], on="seller_id", how="left"
+    )
+    seller_count = items_sellers.groupby("product_id")["seller_id"].nunique()
+    seller_loc = pd.DataFrame({
+        "seller_cities": sorted_unique_join(items_sellers, "seller_city", seller_count.index),
+        "seller_states": sorted_unique_join(items_sellers, "seller_state", seller_count.index),
+        "seller_count": seller_count,
+    })
+    return seller_loc.reset_index()
 
 # -------------------------
-# MERGE product metadata (category translation etc.)
+# BUILD DOCUMENT PER PRODUCT
 # -------------------------
-print("Merging product metadata...")
-products = products.merge(cat_translation, how='left', on='product_category_name')
+def build_documents(merged: pd.DataFrame) -> pd.Series:
+    """'Label: value' lines joined with newlines, assembled column-wise."""
+    doc = None
+    for label, column in DOCUMENT_FIELDS:
+        values = merged[column] if column in merged else pd.Series("", index=merged.index)
+        if column == "avg_review_score":
+            values = values.round(2)
+        # f-string semantics: missing values render as "nan" (pandas 3 keeps NaN through astype(str))
+        line = f"{label}: " + values.astype(str).fillna("nan")
+        doc = line if doc is None else doc + "\n" + line
+    return doc
 
-# Keep only needed product columns to join
-prod_meta = products[['product_id','product_category_name','product_category_name_english','product_name_lenght']] \
-            .drop_duplicates(subset=['product_id'])
 
-# Merge all
-print("Merging aggregated reviews, seller info, and product metadata...")
-merged = prod_meta.merge(grouped, on='product_id', how='left')
-merged = merged.merge(seller_loc, on='product_id', how='left')
+def build_docbase(products, reviews, items, sellers, cat_translation, max_items: int = MAX_REVIEWS_TO_CONCAT):
+    """Per-product docbase frame (one row per product, 'document' column included)."""
+    # -------------------------
+    # MAP REVIEWS -> PRODUCT
+    # (reviews keyed by order_id; items map order_id -> product_id)
+    # -------------------------
+    print("Mapping reviews to product_id via order_items...")
+    items_reviews = items[["order_id", "product_id", "seller_id"]].merge(reviews, on="order_id", how="inner")
+    print(f"Total item-review rows: {len(items_reviews)}")
 
-# Fill NaN for products without review
-merged['num_reviews'] = merged['num_reviews'].fillna(0).astype(int)
-merged['avg_review_score'] = merged['avg_review_score'].fillna(0.0)
+    print("Aggregating reviews per product_id...")
+    grouped = aggregate_reviews(items_reviews, max_items)
+    print(f"Products with >=1 review: {len(grouped)}")
 
-# -------------------------
-# BUILD DOCUMENT PER PRODUCT
-# -------------------------
-print("Building document text per product...")
-def build_product_doc(row):
-    parts = [
-        f"Product ID: {row.get('product_id','')}",
-        f"Product Name Length: {row.get('product_name_lenght', '')}",
-        f"Product Category: {row.get('product_category_name','')}",
-        f"Category (English): {row.get('product_category_name_english','')}",
-        f"Sellers (count): {row.get('seller_count',0)}",
-        f"Seller Cities: {row.get('seller_cities','')}",
-        f"Seller States: {row.get('seller_states','')}",
-        f"Number of Reviews: {row.get('num_reviews',0)}",
-        f"Average Review Score: {round(row.get('avg_review_score',0.0),2)}",
-        f"Combined Review Titles: {row.get('combined_review_titles','')}",
-        f"Combined Review Messages: {row.get('combined_review_messages','')}",
-    ]
-    # filter empty and join
-    return "\n".join([p for p in parts if p and str(p).strip() != ""])
-
-merged['document'] = merged.apply(build_product_doc, axis=1)
-
-# optional: drop empty doc (shouldn't happen)
-merged = merged[merged['document'].str.strip() != ""]
+    print("Collecting seller city/state per product...")
+    seller_loc = aggregate_sellers(items, sellers)
+
+    # -------------------------
+    # MERGE product metadata (category translation etc.)
+    # -------------------------
+    print("Merging product metadata...")
+    products = products.merge(cat_translation, how="left", on="product_category_name")
+    prod_meta = products[["product_id", "product_category_name", "product_category_name_english", "product_name_lenght"]] \
+        .drop_duplicates(subset=["product_id"])
+
+    print("Merging aggregated reviews, seller info, and product metadata...")
+    merged = prod_meta.merge(grouped, on="product_id", how="left")
+    merged = merged.merge(seller_loc, on="product_id", how="left")
+
+    # Fill NaN for products without review
+    merged["num_reviews"] = merged["num_reviews"].fillna(0).astype(int)
+    merged["avg_review_score"] = merged["avg_review_score"].fillna(0.0)
+
+    print("Building document text per product...")
+    merged["document"] = build_documents(merged)
+    merged = merged[merged["document"].str.strip() != ""]
+    merged.attrs["item_review_rows"] = len(items_reviews)
+    return merged
 
-# -------------------------
-# SAVE RESULT
-# -------------------------
-print(f"Saving merged per-product CSV to {OUTPUT_FILE} ...")
-merged.to_csv(OUTPUT_FILE, index=False)
 
 # -------------------------
-# STATS
+# STREAMING (OUT-OF-CORE) BUILD
 # -------------------------
-total_products = merged['product_id'].nunique()
-total_docs = len(merged)
-total_item_rows = len(items)
-total_item_review_rows = len(items_reviews)
-
-print("DONE.")
-print(f"Total item rows (order_items): {total_item_rows}")
-print(f"Total item-review rows (items joined with reviews): {total_item_review_rows}")
-print(f"Total products in products.csv: {products['product_id'].nunique()}")
-print(f"Total products with >=1 review (docs created): {total_products}")
-print(f"Output rows (documents): {total_docs}")
-print(f"Output saved: {os.path.abspath(OUTPUT_FILE)}")
+class ProductAccumulator:
+    """Bounded running state for one product seen in order_items."""
+    __slots__ = ("review_rows", "score_count", "score_sum", "texts", "text_len", "sellers")
+
+    def __init__(self):
+        self.review_rows = 0      # item-review rows joined (products with 0 get NaN texts)
+        self.score_count = 0      # non-null review scores, for the running mean
+        self.score_sum = 0.0
+        self.texts = {col: [] for col in TEXT_COLUMNS.values()}   # first N non-empty, whitespace-collapsed
+        self.text_len = dict.fromkeys(TEXT_COLUMNS.values(), -len(REVIEW_SEP))
+        self.sellers = set()
+
+    def add_text(self, col: str, text: str, max_items: int):
+        # once the joined text is past MAX_COMBINED_LENGTH, shorten() output no longer changes
+        if len(self.texts[col]) < max_items and self.text_len[col] <= MAX_COMBINED_LENGTH:
+            self.texts[col].append(text)
+            self.text_len[col] += len(REVIEW_SEP) + len(text)
+
+
+def spill_reviews(reviews_path: str, conn: sqlite3.Connection, chunk_rows: int) -> int:
+    """Copy the reviews CSV into an on-disk table indexed by order_id, chunk by chunk."""
+    conn.execute("CREATE TABLE reviews (order_id TEXT, review_score REAL, "
+                 "review_comment_title TEXT, review_comment_message TEXT)")
+    cols = ["order_id", "review_score", *TEXT_COLUMNS.values()]
+    total = 0
+    for chunk in pd.read_csv(reviews_path, usecols=cols, chunksize=chunk_rows,
+                             dtype={c: str for c in cols if c != "review_score"}):
+        chunk = chunk[cols].astype(object).where(chunk[cols].notna(), None)
+        conn.executemany("INSERT INTO reviews VALUES (?, ?, ?, ?)", chunk.itertuples(index=False, name=None))
+        total += len(chunk)
+    conn.execute("CREATE INDEX idx_reviews_order_id ON reviews(order_id)")
+    conn.commit()
+    return total
+
+
+def join_chunk_reviews(items: pd.DataFrame, conn: sqlite3.Connection) -> pd.DataFrame:
+    """Inner join of one items chunk with the spilled reviews, in items.merge(reviews) row order."""
+    conn.execute("DELETE FROM chunk_orders")
+    conn.executemany("INSERT INTO chunk_orders VALUES (?, ?)", enumerate(items["order_id"].tolist()))
+    joined = pd.read_sql_query(
+        "SELECT c.seq, r.review_score, r.review_comment_title, r.review_comment_message "
+        "FROM chunk_orders c JOIN reviews r ON r.order_id = c.order_id "
+        "ORDER BY c.seq, r.rowid",
+        conn,
+    )
+    joined.insert(0, "product_id", items["product_id"].to_numpy()[joined["seq"].to_numpy()])
+    return joined
+
+
+def accumulate_chunk(acc: dict, items: pd.DataFrame, joined: pd.DataFrame, max_items: int):
+    """Fold one items chunk (and its joined reviews) into the per-product accumulators."""
+    for pid in items["product_id"].dropna().unique():
+        if pid not in acc:
+            acc[pid] = ProductAccumulator()
+
+    pairs = items[["product_id", "seller_id"]].dropna().drop_duplicates()
+    for pid, seller_id in zip(pairs["product_id"], pairs["seller_id"]):
+        acc[pid].sellers.add(seller_id)
+
+    if joined.empty:
+        return
+    scores = joined.groupby("product_id", sort=False)["review_score"].agg(["size", "count", "sum"])
+    for pid, rows, count, total in zip(scores.index, scores["size"], scores["count"], scores["sum"]):
+        a = acc[pid]
+        a.review_rows += int(rows)
+        a.score_count += int(count)
+        a.score_sum += float(total)
+
+    for col in TEXT_COLUMNS.values():
+        texts = joined[["product_id", col]].dropna(subset=[col])
+        texts = texts.assign(**{col: texts[col].astype(str).str.strip()})
+        texts = texts[texts[col] != ""].groupby("product_id", sort=False).head(max_items)
+        # same collapse as shorten_series(), so only the kept characters are held
+        collapsed = texts[col].str.replace(r"\s+", " ", regex=True)
+        for pid, text in zip(texts["product_id"], collapsed):
+            acc[pid].add_text(col, text, max_items)
+
+
+def seller_locations(sellers: pd.DataFrame) -> dict:
+    """seller_id -> [(city, state), ...] (a left merge keeps every matching seller row)."""
+    locations = {}
+    for seller_id, city, state in zip(sellers["seller_id"], sellers["seller_city"], sellers["seller_state"]):
+        locations.setdefault(seller_id, []).append((city, state))
+    return locations
+
+
+def accumulated_frame(meta: pd.DataFrame, acc: dict, locations: dict, seller_count_dtype) -> pd.DataFrame:
+    """The build_docbase() columns for one slice of products; their accumulators are released."""
+    rows = [acc.pop(pid, None) for pid in meta["product_id"]]
+    frame = meta.reset_index(drop=True)
+    reviewed = [a is not None and a.review_rows > 0 for a in rows]
+
+    frame["num_reviews"] = [a.score_count if r else 0 for a, r in zip(rows, reviewed)]
+    frame["avg_review_score"] = [a.score_sum / a.score_count if r and a.score_count else 0.0
+                                 for a, r in zip(rows, reviewed)]
+    for out_col, src_col in TEXT_COLUMNS.items():
+        joined = pd.Series([REVIEW_SEP.join(a.texts[src_col]) if r else None for a, r in zip(rows, reviewed)],
+                           dtype=str)
+        frame[out_col] = joined.where(joined.isna(), shorten_series(joined.fillna("")))
+
+    cities, states, counts = [], [], []
+    for a in rows:
+        if a is None:
+            # product never sold: no seller row at all
+            cities.append(None)
+            states.append(None)
+            counts.append(np.nan)
+            continue
+        locs = [loc for seller_id in a.sellers for loc in locations.get(seller_id, ())]
+        cities.append(", ".join(sorted({str(c) for c, _ in locs if pd.notna(c)})))
+        states.append(", ".join(sorted({str(s) for _, s in locs if pd.notna(s)})))
+        counts.append(len(a.sellers))
+    frame["seller_cities"] = pd.Series(cities, dtype=str)
+    frame["seller_states"] = pd.Series(states, dtype=str)
+    frame["seller_count"] = pd.Series(counts, dtype=seller_count_dtype)
+    return frame
+
+
+def build_docbase_streaming(base_dir: str = ".", output_file: str = OUTPUT_FILE,
+                            chunk_rows: int = STREAM_CHUNK_ROWS,
+                            max_items: int = MAX_REVIEWS_TO_CONCAT,
+                            write_rows: int = STREAM_WRITE_ROWS) -> dict:
+    """Out-of-core build_docbase(): same CSV, memory bounded by the product count."""
+    path = lambda name: os.path.join(base_dir, name)  # noqa: E731
+    products = pd.read_csv(path(INPUT_PRODUCTS))
+    sellers = pd.read_csv(path(INPUT_SELLERS))
+    cat_translation = pd.read_csv(path(INPUT_CAT_TRANS))
+    products = products.merge(cat_translation, how="left", on="product_category_name")
+    prod_meta = products[["product_id", "product_category_name", "product_category_name_english", "product_name_lenght"]] \
+        .drop_duplicates(subset=["product_id"])
+    del products
+
+    acc = {}
+    stats = {"item_rows": 0, "item_review_rows": 0, "products": int(prod_meta["product_id"].nunique())}
+    with tempfile.TemporaryDirectory(prefix="merge_reviews_") as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "reviews.db"))
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        try:
+            print("Spilling reviews to a temporary SQLite table...")
+            stats["review_rows"] = spill_reviews(path(INPUT_REVIEWS), conn, chunk_rows)
+            conn.execute("CREATE TEMP TABLE chunk_orders (seq INTEGER PRIMARY KEY, order_id TEXT)")
+
+            print(f"Streaming order_items in chunks of {chunk_rows:,} rows...")
+            for items in pd.read_csv(path(INPUT_ITEMS), usecols=["order_id", "product_id", "seller_id"],
+                                     chunksize=chunk_rows, dtype=str):
+                joined = join_chunk_reviews(items, conn)
+                accumulate_chunk(acc, items, joined, max_items)
+                stats["item_rows"] += len(items)
+                stats["item_review_rows"] += len(joined)
+        finally:
+            conn.close()
+    print(f"Total item-review rows: {stats['item_review_rows']}")
+    print(f"Products with >=1 review: {sum(a.review_rows > 0 for a in acc.values())}")
+
+    # build_docbase's left merge leaves seller_count NaN (float) for products without items
+    seller_count_dtype = "int64" if prod_meta["product_id"].isin(acc.keys()).all() else "float64"
+    locations = seller_locations(sellers)
+
+    print(f"Writing documents to {output_file} ...")
+    stats["documents"] = 0
+    for start in range(0, len(prod_meta), write_rows):
+        frame = accumulated_frame(prod_meta.iloc[start:start + write_rows], acc, locations, seller_count_dtype)
+        frame["document"] = build_documents(frame)
+        frame = frame[frame["document"].str.strip() != ""]
+        frame.to_csv(output_file, mode="w" if start == 0 else "a", header=start == 0, index=False)
+        stats["documents"] += len(frame)
+    return stats
+
+
+def main():
+    if STREAMING:
+        stats = build_docbase_streaming(".", OUTPUT_FILE)
+        print("DONE.")
+        print(f"Total item rows (order_items): {stats['item_rows']}")
+        print(f"Total item-review rows (items joined with reviews): {stats['item_review_rows']}")
+        print(f"Total products in products.csv: {stats['products']}")
+        print(f"Output rows (documents): {stats['documents']}")
+        print(f"Output saved: {os.path.abspath(OUTPUT_FILE)}")
+        return
+
+    data = load_inputs()
+    merged = build_docbase(**data)
+
+    # -------------------------
+    # SAVE RESULT
+    # -------------------------
+    print(f"Saving merged per-product CSV to {OUTPUT_FILE} ...")
+    merged.to_csv(OUTPUT_FILE, index=False)
+
+    # -------------------------
+    # STATS
+    # -------------------------
+    print("DONE.")
+    print(f"Total item rows (order_items): {len(data['items'])}")
+    print(f"Total item-review rows (items joined with reviews): {merged.attrs['item_review_rows']}")
+    print(f"Total products in products.csv: {data['products']['product_id'].nunique()}")
+    print(f"Total products with >=1 review (docs created): {merged['product_id'].nunique()}")
+    print(f"Output rows (documents): {len(merged)}")
+    print(f"Output saved: {os.path.abspath(OUTPUT_FILE)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,44 @@ preprocess_sql.py
 Preprocess Olist CSVs into a single SQLite database + export cleaned CSVs.
 - CSV output folder: ./FP/
 - SQLite output: olist.db
+- Incremental: per-table CSV checksums are kept in _etl_metadata; reruns
+  reload only tables whose CSV changed (OHS_FULL_REBUILD=1 forces a full
+  build). The DB is built at olist.db.building and renamed into place;
+  the service's chat_history is re-copied from the live DB under its write
+  lock right before the rename, so no chat turn is lost.
+- Parquet output: ./FP/parquet/<table>/ (order_item_full partitioned by
+  purchase_month), read by the DuckDB engine in duckdb_engine.py.
+- Streaming ingest (default): CSVs are read in typed chunks and parsed in a
+  process pool into staging files, then bulk-copied into tables with declared
+  column types and primary keys (OHS_STREAMING=0 uses pandas to_sql).
 """
 
+import hashlib
 import os
+import shutil
 import sqlite3
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 from pathlib import Path
 
 # CONFIG
-from pathlib import Path
 # Default: gunakan environment variable OHS_BASE_PATH; kalau tidak ada, pakai current working dir.
 BASE_PATH = os.getenv("OHS_BASE_PATH", str(Path.cwd()))
 OUT_DB = os.getenv("OHS_OUT_DB", "olist.db")
+# OHS_FULL_REBUILD=1 ignores _etl_metadata and reloads every CSV
+FULL_REBUILD = os.getenv("OHS_FULL_REBUILD", "0").strip().lower() in ("1", "true", "yes", "on")
+# Streaming ingest: chunked typed CSV reads, parsed in a process pool (OHS_STREAMING=0 uses pandas to_sql)
+STREAMING_INGEST = os.getenv("OHS_STREAMING", "1").strip().lower() in ("1", "true", "yes", "on")
+CHUNK_ROWS = int(os.getenv("OHS_CHUNK_ROWS", "100000"))
+# Seconds to wait for the running service's chat_history write lock before the final rename
+CHAT_LOCK_TIMEOUT_S = float(os.getenv("OHS_CHAT_LOCK_TIMEOUT_S", "30"))
+INGEST_WORKERS = int(os.getenv("OHS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Columnar copy of every table for the DuckDB engine (needs pyarrow; OHS_PARQUET=0 disables)
+PARQUET_ENABLED = os.getenv("OHS_PARQUET", "1").strip().lower() in ("1", "true", "yes", "on")
+PARQUET_DIR = os.getenv("OHS_PARQUET_DIR", "./FP/parquet")
 
 
 CSV_FILES = {
@@ -31,6 +57,110 @@ CSV_FILES = {
     "cat_translation": "product_category_name_translation.csv",
 }
 
+# Declared SQLite schema per table: (column, SQL type, pandas read dtype) + primary key.
+# Low-cardinality text is read as category and small integers as nullable
+# downcast ints; money stays float64 so values round-trip exactly.
+TABLE_SCHEMAS = {
+    "customers": {
+        "columns": [
+            ("customer_id", "TEXT", "string"),
+            ("customer_unique_id", "TEXT", "string"),
+            ("customer_zip_code_prefix", "INTEGER", "Int32"),
+            ("customer_city", "TEXT", "category"),
+            ("customer_state", "TEXT", "category"),
+        ],
+        "primary_key": ["customer_id"],
+    },
+    "geolocation": {
+        "columns": [
+            ("geolocation_zip_code_prefix", "INTEGER", "Int32"),
+            ("geolocation_lat", "REAL", "float64"),
+            ("geolocation_lng", "REAL", "float64"),
+            ("geolocation_city", "TEXT", "category"),
+            ("geolocation_state", "TEXT", "category"),
+        ],
+        "primary_key": [],
+    },
+    "order_items": {
+        "columns": [
+            ("order_id", "TEXT", "string"),
+            ("order_item_id", "INTEGER", "Int16"),
+            ("product_id", "TEXT", "string"),
+            ("seller_id", "TEXT", "string"),
+            ("shipping_limit_date", "TEXT", "string"),
+            ("price", "REAL", "float64"),
+            ("freight_value", "REAL", "float64"),
+        ],
+        "primary_key": ["order_id", "order_item_id"],
+    },
+    "order_payments": {
+        "columns": [
+            ("order_id", "TEXT", "string"),
+            ("payment_sequential", "INTEGER", "Int16"),
+            ("payment_type", "TEXT", "category"),
+            ("payment_installments", "INTEGER", "Int16"),
+            ("payment_value", "REAL", "float64"),
+        ],
+        "primary_key": ["order_id", "payment_sequential"],
+    },
+    "order_reviews": {
+        "columns": [
+            ("review_id", "TEXT", "string"),
+            ("order_id", "TEXT", "string"),
+            ("review_score", "INTEGER", "Int8"),
+            ("review_comment_title", "TEXT", "string"),
+            ("review_comment_message", "TEXT", "string"),
+            ("review_creation_date", "TEXT", "string"),
+            ("review_answer_timestamp", "TEXT", "string"),
+        ],
+        # review_id alone repeats across orders in the public dataset
+        "primary_key": ["review_id", "order_id"],
+    },
+    "orders": {
+        "columns": [
+            ("order_id", "TEXT", "string"),
+            ("customer_id", "TEXT", "string"),
+            ("order_status", "TEXT", "category"),
+            ("order_purchase_timestamp", "TEXT", "string"),
+            ("order_approved_at", "TEXT", "string"),
+            ("order_delivered_carrier_date", "TEXT", "string"),
+            ("order_delivered_customer_date", "TEXT", "string"),
+            ("order_estimated_delivery_date", "TEXT", "string"),
+        ],
+        "primary_key": ["order_id"],
+    },
+    "products": {
+        "columns": [
+            ("product_id", "TEXT", "string"),
+            ("product_category_name", "TEXT", "category"),
+            ("product_name_lenght", "INTEGER", "Int16"),
+            ("product_description_lenght", "INTEGER", "Int16"),
+            ("product_photos_qty", "INTEGER", "Int8"),
+            ("product_weight_g", "INTEGER", "Int32"),
+            ("product_length_cm", "INTEGER", "Int16"),
+            ("product_height_cm", "INTEGER", "Int16"),
+            ("product_width_cm", "INTEGER", "Int16"),
+        ],
+        "primary_key": ["product_id"],
+    },
+    "sellers": {
+        "columns": [
+            ("seller_id", "TEXT", "string"),
+            ("seller_zip_code_prefix", "INTEGER", "Int32"),
+            ("seller_city", "TEXT", "category"),
+            ("seller_state", "TEXT", "category"),
+        ],
+        "primary_key": ["seller_id"],
+    },
+    "cat_translation": {
+        "columns": [
+            ("product_category_name", "TEXT", "string"),
+            ("product_category_name_english", "TEXT", "string"),
+        ],
+        "primary_key": ["product_category_name"],
+    },
+}
+
 # ============================================================
 # LOAD
 # ============================================================
@@ -52,31 +182,32 @@ def sanitize_column_names(df: pd.DataFrame) -> pd.DataFrame:
     df.columns = [c.strip().lower() for c in df.columns]
     return df
 
-def prepare_dataframes(dfs: dict) -> dict:
-    out = {}
-    for k, df in dfs.items():
-        df = sanitize_column_names(df)
-
-        # parse datetime
-        if k == "orders":
-            date_cols = [c for c in df.columns if "date" in c or "timestamp" in c or "approved" in c]
-            for col in date_cols:
-                df[col] = pd.to_datetime(df[col], errors="coerce").dt.strftime("%Y-%m-%d %H:%M:%S")
-
-        # numeric conversions
-        if k in ("order_payments", "order_items"):
-            for col in df.columns:
-                if any(token in col for token in ("price", "value", "freight", "installments")):
-                    df[col] = pd.to_numeric(df[col], errors="coerce")
-
-        # ensure ID columns are strings
-        id_cols = [c for c in df.columns if c.endswith("_id") or c.endswith("_ID")]
-        for col in id_cols:
+def clean_frame(k: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Per-table cleaning, applied to whole frames or to streamed chunks."""
+    df = sanitize_column_names(df)
+
+    # parse datetime
+    if k == "orders":
+        date_cols = [c for c in df.columns if "date" in c or "timestamp" in c or "approved" in c]
+        for col in date_cols:
+            df[col] = pd.to_datetime(df[col], errors="coerce").dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    # numeric conversions
+    if k in ("order_payments", "order_items"):
+        for col in df.columns:
+            if any(token in col for token in ("price", "value", "freight", "installments")):
+                df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    # ensure ID columns are strings (typed reads already have them as string)
+    id_cols = [c for c in df.columns if c.endswith("_id") or c.endswith("_ID")]
+    for col in id_cols:
+        if not pd.api.types.is_string_dtype(df[col]):
             df[col] = df[col].astype(str)
 
-        out[k] = df
+    return df
 
-    return out
+def prepare_dataframes(dfs: dict) -> dict:
+    return {k: clean_frame(k, df) for k, df in dfs.items()}
 
 # ============================================================
 # EXPORT CLEAN CSVs
@@ -93,58 +224,105 @@ def export_dataframes_to_csv(dfs: dict, out_dir: str):
         df.to_csv(file_path, index=False)
 
 # ============================================================
-# WRITE SQLITE
+# EXPORT PARQUET
 # ============================================================
 
-def write_sqlite(dfs: dict, db_path: str):
-    if os.path.exists(db_path):
-        print(f"Removing existing DB at {db_path}")
-        os.remove(db_path)
-
-    conn = sqlite3.connect(db_path)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.commit()
+# Hive-partitioned tables (column -> one directory per value); others are one file per chunk
+PARQUET_PARTITIONS = {
+    "order_item_full": "purchase_month",
+}
 
-    # Write tables
-    for name, df in dfs.items():
-        print(f"Writing table `{name}` ({len(df):,} rows)...")
-        df.to_sql(name, conn, index=False, if_exists="replace")
 
-    cur = conn.cursor()
+def _arrow_schema(conn: sqlite3.Connection, table: str, first_chunk: pd.DataFrame):
+    """Arrow schema from the declared SQLite column types; untyped CTAS columns
+    (aggregates) take the type inferred from the first chunk."""
+    import pyarrow as pa
+
+    inferred = pa.Schema.from_pandas(first_chunk, preserve_index=False)
+    fields = []
+    for _, col, decl, *_ in conn.execute(f'PRAGMA table_info("{table}")'):
+        decl = (decl or "").upper()
+        if "INT" in decl:
+            typ = pa.int64()
+        elif any(t in decl for t in ("REAL", "FLOA", "DOUB", "NUM")):
+            typ = pa.float64()
+        elif decl:
+            typ = pa.string()
+        else:
+            typ = inferred.field(col).type
+            if pa.types.is_null(typ):
+                typ = pa.string()
+        fields.append(pa.field(col, typ))
+    return pa.schema(fields)
+
+
+def missing_parquet_tables(out_dir: str = PARQUET_DIR) -> list:
+    """Tables (base + summary) without a Parquet directory yet."""
+    return [t for t in list(CSV_FILES) + list(SUMMARY_TABLES) if not (Path(out_dir) / t).exists()]
+
+
+def export_parquet(db_path: str, tables, out_dir: str = PARQUET_DIR, chunk_rows: int = CHUNK_ROWS):
+    """Write tables from the built SQLite DB to <out_dir>/<table>/ as Parquet.
+
+    Rows are streamed in chunk_rows batches. Tables in PARQUET_PARTITIONS are
+    hive-partitioned (e.g. order_item_full/purchase_month=2018-01/). Each
+    table is written to a sibling temp directory and swapped in afterwards.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError:
+        print("pyarrow not installed; skipping Parquet export")
+        return
 
-    # Indices
-    index_statements = [
-        "CREATE INDEX idx_orders_order_id ON orders(order_id);",
-        "CREATE INDEX idx_items_order_id ON order_items(order_id);",
-        "CREATE INDEX idx_items_product_id ON order_items(product_id);",
-        "CREATE INDEX idx_items_seller_id ON order_items(seller_id);",
-        "CREATE INDEX idx_payments_order_id ON order_payments(order_id);",
-        "CREATE INDEX idx_customers_customer_id ON customers(customer_id);",
-        "CREATE INDEX idx_sellers_seller_id ON sellers(seller_id);",
-        "CREATE INDEX idx_products_product_id ON products(product_id);",
-        "CREATE INDEX idx_customers_zip ON customers(customer_zip_code_prefix);",
-        "CREATE INDEX idx_sellers_zip ON sellers(seller_zip_code_prefix);",
-        "CREATE INDEX idx_geo_zip ON geolocation(geolocation_zip_code_prefix);",
-    ]
+    out_path = Path(out_dir)
+    out_path.mkdir(parents=True, exist_ok=True)
+    print(f"\nExporting Parquet to folder: {out_path.resolve()}\n")
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        for table in tables:
+            schema = None
+            partition = PARQUET_PARTITIONS.get(table)
+            building = out_path / f".{table}.building"
+            shutil.rmtree(building, ignore_errors=True)
+            rows = 0
+            for i, chunk in enumerate(pd.read_sql_query(f'SELECT * FROM "{table}"', conn, chunksize=chunk_rows)):
+                if schema is None:
+                    schema = _arrow_schema(conn, table, chunk)
+                ds.write_dataset(
+                    pa.Table.from_pandas(chunk, schema=schema, preserve_index=False),
+                    building,
+                    format="parquet",
+                    partitioning=[partition] if partition else None,
+                    partitioning_flavor="hive" if partition else None,
+                    basename_template=f"part-{i:05d}-{{i}}.parquet",
+                    existing_data_behavior="overwrite_or_ignore",
+                )
+                rows += len(chunk)
+            target = out_path / table
+            shutil.rmtree(target, ignore_errors=True)
+            if building.exists():
+                os.replace(building, target)
+            print(f" -> {target} ({rows:,} rows{', by ' + partition if partition else ''})")
+    finally:
+        conn.close()
 
-    print("Creating indices...")
-    for stmt in index_statements:
-        try:
-            cur.execute(stmt)
-        except Exception as e:
-            print("  index error:", e)
 
-    # Views
-    print("Creating views...")
+# ============================================================
+# SUMMARY TABLES
+# ============================================================
 
-    try:
-        cur.execute("""
-        CREATE VIEW order_item_full AS
+# Materialized tables for the aggregates the agents ask for most. They are
+# rebuilt with the DB, so they never go stale relative to the base tables.
+SUMMARY_TABLES = {
+    # Denormalized item-level fact table (was a view; now materialized + indexed)
+    "order_item_full": """
         SELECT
             oi.order_id,
+            oi.order_item_id,
             oi.product_id,
             p.product_category_name,
+            t.product_category_name_english,
             p.product_name_lenght,
             oi.seller_id,
             s.seller_city,
@@ -156,51 +334,566 @@ def write_sqlite(dfs: dict, db_path: str):
             c.customer_state,
             o.order_status,
             o.order_purchase_timestamp,
+            substr(o.order_purchase_timestamp, 1, 7) AS purchase_month,
             r.review_score,
             r.review_comment_message
         FROM order_items oi
         LEFT JOIN products p ON oi.product_id = p.product_id
+        LEFT JOIN cat_translation t ON p.product_category_name = t.product_category_name
         LEFT JOIN sellers s ON oi.seller_id = s.seller_id
         LEFT JOIN orders o ON oi.order_id = o.order_id
         LEFT JOIN customers c ON o.customer_id = c.customer_id
-        LEFT JOIN order_reviews r ON o.order_id = r.order_id;
-        """)
-
-        cur.execute("""
-        CREATE VIEW payments_aggregated AS
+        LEFT JOIN order_reviews r ON o.order_id = r.order_id
+    """,
+    # One row per product category
+    "category_stats": """
+        WITH items AS (
+            SELECT
+                p.product_category_name,
+                COUNT(DISTINCT oi.order_id) AS num_orders,
+                COUNT(*) AS num_items,
+                COUNT(DISTINCT oi.product_id) AS num_products,
+                COUNT(DISTINCT oi.seller_id) AS num_sellers,
+                ROUND(SUM(oi.price), 2) AS total_revenue,
+                ROUND(AVG(oi.price), 2) AS avg_price,
+                ROUND(AVG(oi.freight_value), 2) AS avg_freight
+            FROM order_items oi
+            LEFT JOIN products p ON oi.product_id = p.product_id
+            GROUP BY p.product_category_name
+        ),
+        reviews AS (
+            SELECT
+                p.product_category_name,
+                COUNT(r.review_score) AS num_reviews,
+                ROUND(AVG(r.review_score), 3) AS avg_review_score
+            FROM (SELECT DISTINCT order_id, product_id FROM order_items) op
+            JOIN order_reviews r ON op.order_id = r.order_id
+            LEFT JOIN products p ON op.product_id = p.product_id
+            GROUP BY p.product_category_name
+        )
+        SELECT
+            i.product_category_name,
+            t.product_category_name_english,
+            i.num_orders,
+            i.num_items,
+            i.num_products,
+            i.num_sellers,
+            i.total_revenue,
+            i.avg_price,
+            i.avg_freight,
+            COALESCE(rv.num_reviews, 0) AS num_reviews,
+            rv.avg_review_score
+        FROM items i
+        LEFT JOIN reviews rv ON i.product_category_name IS rv.product_category_name
+        LEFT JOIN cat_translation t ON i.product_category_name = t.product_category_name
+    """,
+    # One row per purchase month (YYYY-MM)
+    "monthly_sales": """
+        WITH items AS (
+            SELECT order_id, COUNT(*) AS num_items, SUM(price) AS revenue, SUM(freight_value) AS freight
+            FROM order_items
+            GROUP BY order_id
+        ),
+        reviews AS (
+            SELECT order_id, AVG(review_score) AS review_score
+            FROM order_reviews
+            GROUP BY order_id
+        )
+        SELECT
+            substr(o.order_purchase_timestamp, 1, 7) AS month,
+            COUNT(*) AS num_orders,
+            COUNT(DISTINCT o.customer_id) AS num_customers,
+            SUM(o.order_status = 'delivered') AS num_delivered,
+            SUM(o.order_status = 'canceled') AS num_canceled,
+            COALESCE(SUM(i.num_items), 0) AS num_items,
+            ROUND(COALESCE(SUM(i.revenue), 0), 2) AS total_revenue,
+            ROUND(COALESCE(SUM(i.freight), 0), 2) AS total_freight,
+            ROUND(SUM(i.revenue) / COUNT(i.order_id), 2) AS avg_order_value,
+            ROUND(AVG(rv.review_score), 3) AS avg_review_score
+        FROM orders o
+        LEFT JOIN items i ON o.order_id = i.order_id
+        LEFT JOIN reviews rv ON o.order_id = rv.order_id
+        WHERE o.order_purchase_timestamp IS NOT NULL
+        GROUP BY month
+    """,
+    # One row per seller (group by seller_state for per-state figures)
+    "seller_stats": """
+        WITH items AS (
+            SELECT
+                seller_id,
+                COUNT(DISTINCT order_id) AS num_orders,
+                COUNT(*) AS num_items,
+                COUNT(DISTINCT product_id) AS num_products,
+                ROUND(SUM(price), 2) AS total_revenue,
+                ROUND(AVG(price), 2) AS avg_price,
+                ROUND(AVG(freight_value), 2) AS avg_freight
+            FROM order_items
+            GROUP BY seller_id
+        ),
+        reviews AS (
+            SELECT so.seller_id, COUNT(r.review_score) AS num_reviews, ROUND(AVG(r.review_score), 3) AS avg_review_score
+            FROM (SELECT DISTINCT order_id, seller_id FROM order_items) so
+            JOIN order_reviews r ON so.order_id = r.order_id
+            GROUP BY so.seller_id
+        )
         SELECT
-            order_id,
-            SUM(payment_value) AS total_paid,
-            MAX(payment_installments) AS max_installments,
-            COUNT(*) AS num_payments
-        FROM order_payments
-        GROUP BY order_id;
-        """)
-    except Exception as e:
-        print("View creation error:", e)
+            i.seller_id,
+            s.seller_city,
+            s.seller_state,
+            i.num_orders,
+            i.num_items,
+            i.num_products,
+            i.total_revenue,
+            i.avg_price,
+            i.avg_freight,
+            COALESCE(rv.num_reviews, 0) AS num_reviews,
+            rv.avg_review_score
+        FROM items i
+        LEFT JOIN sellers s ON i.seller_id = s.seller_id
+        LEFT JOIN reviews rv ON i.seller_id = rv.seller_id
+    """,
+}
+
+SUMMARY_INDEXES = {
+    "order_item_full": [
+        "CREATE INDEX idx_oif_order_id ON order_item_full(order_id);",
+        "CREATE INDEX idx_oif_product_id ON order_item_full(product_id);",
+        "CREATE INDEX idx_oif_seller_id ON order_item_full(seller_id);",
+        "CREATE INDEX idx_oif_category ON order_item_full(product_category_name);",
+        "CREATE INDEX idx_oif_month ON order_item_full(purchase_month);",
+        "CREATE INDEX idx_oif_customer_state ON order_item_full(customer_state);",
+    ],
+    "category_stats": [
+        "CREATE UNIQUE INDEX idx_category_stats_category ON category_stats(product_category_name);",
+        "CREATE INDEX idx_category_stats_category_en ON category_stats(product_category_name_english);",
+    ],
+    "monthly_sales": [
+        "CREATE UNIQUE INDEX idx_monthly_sales_month ON monthly_sales(month);",
+    ],
+    "seller_stats": [
+        "CREATE UNIQUE INDEX idx_seller_stats_seller_id ON seller_stats(seller_id);",
+        "CREATE INDEX idx_seller_stats_state ON seller_stats(seller_state);",
+    ],
+}
+
+# Base tables each summary table is built from (incremental runs rebuild a
+# summary table only when one of these was reloaded)
+SUMMARY_DEPENDENCIES = {
+    "order_item_full": {"order_items", "products", "cat_translation", "sellers", "orders", "customers", "order_reviews"},
+    "category_stats": {"order_items", "products", "order_reviews", "cat_translation"},
+    "monthly_sales": {"orders", "order_items", "order_reviews"},
+    "seller_stats": {"order_items", "sellers", "order_reviews"},
+}
+
+# Indices per base table, recreated whenever that table is reloaded
+TABLE_INDEXES = {
+    "orders": ["CREATE INDEX idx_orders_order_id ON orders(order_id);"],
+    "order_items": [
+        "CREATE INDEX idx_items_order_id ON order_items(order_id);",
+        "CREATE INDEX idx_items_product_id ON order_items(product_id);",
+        "CREATE INDEX idx_items_seller_id ON order_items(seller_id);",
+    ],
+    "order_payments": ["CREATE INDEX idx_payments_order_id ON order_payments(order_id);"],
+    "customers": [
+        "CREATE INDEX idx_customers_customer_id ON customers(customer_id);",
+        "CREATE INDEX idx_customers_zip ON customers(customer_zip_code_prefix);",
+    ],
+    "sellers": [
+        "CREATE INDEX idx_sellers_seller_id ON sellers(seller_id);",
+        "CREATE INDEX idx_sellers_zip ON sellers(seller_zip_code_prefix);",
+    ],
+    "products": ["CREATE INDEX idx_products_product_id ON products(product_id);"],
+    "geolocation": ["CREATE INDEX idx_geo_zip ON geolocation(geolocation_zip_code_prefix);"],
+}
+
+VIEW_STATEMENTS = [
+    """
+    CREATE VIEW IF NOT EXISTS payments_aggregated AS
+    SELECT
+        order_id,
+        SUM(payment_value) AS total_paid,
+        MAX(payment_installments) AS max_installments,
+        COUNT(*) AS num_payments
+    FROM order_payments
+    GROUP BY order_id;
+    """,
+]
+
+
+def create_indexes(cur: sqlite3.Cursor, statements: list):
+    for stmt in statements:
+        try:
+            cur.execute(stmt.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ").replace(
+                "CREATE UNIQUE INDEX ", "CREATE UNIQUE INDEX IF NOT EXISTS "))
+        except Exception as e:
+            print("  index error:", e)
+
+
+def build_summary_tables(conn: sqlite3.Connection, names=None):
+    """Materialize SUMMARY_TABLES (CREATE TABLE ... AS SELECT) and index them.
+
+    names limits the rebuild to a subset (default: all). Returns the names built.
+    """
+    print("Building summary tables...")
+    cur = conn.cursor()
+    built = []
+    for name, select_sql in SUMMARY_TABLES.items():
+        if names is not None and name not in names:
+            continue
+        try:
+            existing = cur.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+            if existing:
+                cur.execute(f"DROP {existing[0].upper()} {name};")
+            cur.execute(f"CREATE TABLE {name} AS {select_sql};")
+            n = cur.execute(f"SELECT COUNT(*) FROM {name};").fetchone()[0]
+            print(f" -> {name} ({n:,} rows)")
+        except Exception as e:
+            print(f"  summary table error ({name}):", e)
+            continue
+        create_indexes(cur, SUMMARY_INDEXES.get(name, []))
+        built.append(name)
+    conn.commit()
+    return built
+
+# ============================================================
+# ETL METADATA (incremental rebuilds)
+# ============================================================
+
+METADATA_TABLE = "_etl_metadata"
+# one row, new on every build: lets readers (answer_cache.py) tell builds apart
+BUILD_TABLE = "_build_info"
+# written by the running service (app.py); carried over from the live DB on every build
+CHAT_TABLE = "chat_history"
+
+
+def file_checksum(path, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
 
+
+def source_checksums() -> dict:
+    """{table: {"source_file", "checksum"}} for every CSV in CSV_FILES."""
+    out = {}
+    for name, filename in CSV_FILES.items():
+        path = Path(BASE_PATH) / filename
+        if not path.exists():
+            raise FileNotFoundError(f"Missing CSV: {path}")
+        out[name] = {"source_file": str(path), "checksum": file_checksum(path)}
+    return out
+
+
+def read_etl_metadata(db_path: str) -> dict:
+    """{table: checksum} recorded by the last build; empty if unavailable."""
+    if not os.path.exists(db_path):
+        return {}
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(f"SELECT table_name, checksum FROM {METADATA_TABLE}").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+    return dict(rows)
+
+
+def write_etl_metadata(conn: sqlite3.Connection, row_counts: dict, checksums: dict):
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (
+        table_name TEXT PRIMARY KEY,
+        source_file TEXT,
+        checksum TEXT NOT NULL,
+        row_count INTEGER,
+        loaded_at TEXT
+    );
+    """)
+    loaded_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {METADATA_TABLE} VALUES (?, ?, ?, ?, ?)",
+        [
+            (name, checksums[name]["source_file"], checksums[name]["checksum"], rows, loaded_at)
+            for name, rows in row_counts.items() if name in checksums
+        ],
+    )
+    conn.commit()
+
+
+def write_build_id(conn: sqlite3.Connection):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {BUILD_TABLE} (build_id TEXT NOT NULL, built_at TEXT)")
+    conn.execute(f"DELETE FROM {BUILD_TABLE}")
+    conn.execute(f"INSERT INTO {BUILD_TABLE} VALUES (?, ?)", (uuid.uuid4().hex, time.strftime("%Y-%m-%d %H:%M:%S")))
     conn.commit()
-    conn.close()
-    print(f"\nSQLite DB written to: {db_path}")
 
 # ============================================================
-# RUN
+# WRITE SQLITE
 # ============================================================
 
-def run():
-    # Load CSVs
-    dfs = {key: load_csv(key) for key in CSV_FILES.keys()}
+def open_build(db_path: str, incremental: bool = False):
+    """Connection to a fresh temp build file next to db_path (a copy of it when incremental)."""
+    tmp_path = f"{db_path}.building"
+    for path in (tmp_path, f"{tmp_path}-journal", f"{tmp_path}-wal", f"{tmp_path}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    conn = sqlite3.connect(tmp_path)
+    if incremental and os.path.exists(db_path):
+        print(f"Copying current DB {db_path} -> {tmp_path}")
+        src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            src.backup(conn)
+        finally:
+            src.close()
+    conn.execute("PRAGMA journal_mode=OFF;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    conn.commit()
+    return conn, tmp_path
+
 
-    # Clean + type normalization
-    print("\nPreparing dataframes (sanitizing, type conversions)...")
-    dfs = prepare_dataframes(dfs)
+def carry_chat_history(conn: sqlite3.Connection, db_path: str):
+    """Copy the live DB's chat_history into the build under the live DB's write lock.
+
+    Returns the live connection still holding the lock (None if there is no
+    live DB): the caller renames the build into place before closing it, so
+    no chat turn can land in the old file in between. sqlite_pool.writer
+    takes the lock before writing and re-checks which file it holds.
+    """
+    if not os.path.exists(db_path):
+        return None
+    live = sqlite3.connect(db_path, timeout=CHAT_LOCK_TIMEOUT_S, isolation_level=None)
+    try:
+        live.execute("BEGIN IMMEDIATE")
+        row = live.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                           (CHAT_TABLE,)).fetchone()
+    except sqlite3.DatabaseError as e:
+        live.close()
+        print(f"Warning: cannot read {CHAT_TABLE} from {db_path} ({e}); not carried over")
+        return None
+    if row:
+        conn.execute(f"DROP TABLE IF EXISTS {CHAT_TABLE}")
+        conn.execute(row[0])
+        cur = live.execute(f"SELECT * FROM {CHAT_TABLE}")
+        marks = ", ".join("?" * len(cur.description))
+        copied = 0
+        while True:
+            rows = cur.fetchmany(CHUNK_ROWS)
+            if not rows:
+                break
+            conn.executemany(f"INSERT INTO {CHAT_TABLE} VALUES ({marks})", rows)
+            copied += len(rows)
+        conn.commit()
+        print(f"Carried over {copied:,} {CHAT_TABLE} rows from {db_path}")
+    return live
+
+
+def finish_build(conn: sqlite3.Connection, tmp_path: str, db_path: str, row_counts: dict,
+                 checksums: dict = None, incremental: bool = False):
+    """Indices, views, summary tables, metadata and ANALYZE; then rename into place.
+
+    Returns every table that was (re)written.
+    """
+    cur = conn.cursor()
 
-    # Export cleaned CSVs to folder ./FP/
-    export_dataframes_to_csv(dfs, "./FP")
+    # Indices (only for reloaded tables; replacing a table dropped the old ones)
+    print("Creating indices...")
+    for name in row_counts:
+        create_indexes(cur, TABLE_INDEXES.get(name, []))
 
-    # Write SQLite
+    # Views
+    print("Creating views...")
+    for stmt in VIEW_STATEMENTS:
+        try:
+            cur.execute(stmt)
+        except Exception as e:
+            print("View creation error:", e)
+
+    if incremental:
+        stale = {name for name, deps in SUMMARY_DEPENDENCIES.items() if deps & set(row_counts)}
+        summaries = build_summary_tables(conn, stale)
+    else:
+        summaries = build_summary_tables(conn)
+
+    if checksums:
+        write_etl_metadata(conn, row_counts, checksums)
+    write_build_id(conn)
+
+    # Planner statistics (also gives the schema digest cheap row counts)
+    print("Running ANALYZE...")
+    cur.execute("ANALYZE;")
+    conn.commit()
+
+    # Chat turns written by the running service since open_build; the lock is
+    # held until the new file is in place
+    live = carry_chat_history(conn, db_path)
+    try:
+        # Rollback-journal mode in the final file: a WAL left behind by readers of
+        # the old file must never be replayed onto the new one
+        conn.execute("PRAGMA journal_mode=DELETE;")
+        conn.close()
+
+        os.replace(tmp_path, db_path)
+    finally:
+        if live is not None:
+            live.rollback()
+            live.close()
+    print(f"\nSQLite DB written to: {db_path}")
+    return list(row_counts) + summaries
+
+
+def write_sqlite(dfs: dict, db_path: str, checksums: dict = None, incremental: bool = False):
+    """Build the DB at a temp path and atomically rename it over db_path.
+
+    Full mode (default) starts from an empty file. Incremental mode copies
+    the current DB and replaces only the tables in dfs, recreating their
+    indexes and the summary tables that depend on them. Either way
+    chat_history is re-copied from the live DB just before the rename
+    (carry_chat_history). The service keeps reading the old file until then.
+    """
+    conn, tmp_path = open_build(db_path, incremental)
+
+    # Write tables
+    for name, df in dfs.items():
+        print(f"Writing table `{name}` ({len(df):,} rows)...")
+        df.to_sql(name, conn, index=False, if_exists="replace")
+
+    return finish_build(conn, tmp_path, db_path, {name: len(df) for name, df in dfs.items()}, checksums, incremental)
+
+# ============================================================
+# STREAMING INGEST
+# ============================================================
+
+def create_table_sql(name: str, schema: str = "main") -> str:
+    spec = TABLE_SCHEMAS[name]
+    cols = [f"{col} {sql_type}" for col, sql_type, _ in spec["columns"]]
+    if spec["primary_key"]:
+        cols.append(f"PRIMARY KEY ({', '.join(spec['primary_key'])})")
+    return f"CREATE TABLE {schema}.{name} (\n    " + ",\n    ".join(cols) + "\n);"
+
+
+def stage_table(name: str, staging_dir: str, export_dir: str = None) -> tuple:
+    """Stream one CSV into its own staging SQLite file (runs in a worker process).
+
+    Reads CHUNK_ROWS rows at a time with the declared dtypes, cleans each chunk
+    and bulk-inserts it with executemany in one transaction per chunk, so
+    memory is bounded by the chunk size. Rows repeating a primary key are
+    skipped. Returns (name, staging_path, rows_read, rows_inserted).
+    """
+    spec = TABLE_SCHEMAS[name]
+    columns = [col for col, _, _ in spec["columns"]]
+    dtypes = {col: dtype for col, _, dtype in spec["columns"]}
+    src = Path(BASE_PATH) / CSV_FILES[name]
+    stage_path = os.path.join(staging_dir, f"{name}.db")
+
+    conn = sqlite3.connect(stage_path)
+    conn.execute("PRAGMA journal_mode=OFF;")
+    conn.execute("PRAGMA synchronous=OFF;")
+    conn.execute(create_table_sql(name))
+    verb = "INSERT OR IGNORE" if spec["primary_key"] else "INSERT"
+    insert_sql = f"{verb} INTO {name} VALUES ({', '.join('?' * len(columns))})"
+
+    export_path = Path(export_dir) / f"{name}.csv" if export_dir else None
+    rows_read = 0
+    reader = pd.read_csv(src, chunksize=CHUNK_ROWS, dtype=dtypes, encoding="utf-8-sig")
+    for i, chunk in enumerate(reader):
+        chunk = clean_frame(name, chunk)
+        missing = set(columns) - set(chunk.columns)
+        if missing:
+            raise ValueError(f"{src}: missing columns {sorted(missing)}")
+        chunk = chunk[columns]
+        records = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+        with conn:
+            conn.executemany(insert_sql, records)
+        if export_path is not None:
+            chunk.to_csv(export_path, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+        rows_read += len(chunk)
+    rows_inserted = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+    conn.close()
+    return name, stage_path, rows_read, rows_inserted
+
+
+def write_sqlite_streaming(tables: list, db_path: str, checksums: dict = None, incremental: bool = False,
+                           export_dir: str = None):
+    """Streaming counterpart of write_sqlite: tables are parsed in parallel into
+    staging files, then copied into the build DB with INSERT ... SELECT."""
+    conn, tmp_path = open_build(db_path, incremental)
+    staging_dir = tempfile.mkdtemp(prefix="olist_staging_", dir=os.path.dirname(os.path.abspath(db_path)))
+    if export_dir:
+        Path(export_dir).mkdir(parents=True, exist_ok=True)
+    row_counts = {}
+    try:
+        print(f"Parsing {len(tables)} table(s) with {INGEST_WORKERS} worker(s), {CHUNK_ROWS:,} rows per chunk...")
+        with ProcessPoolExecutor(max_workers=max(1, INGEST_WORKERS)) as pool:
+            futures = [pool.submit(stage_table, name, staging_dir, export_dir) for name in tables]
+            for future in as_completed(futures):
+                name, stage_path, rows_read, rows_inserted = future.result()
+                skipped = rows_read - rows_inserted
+                note = f", {skipped:,} duplicate key rows skipped" if skipped else ""
+                print(f"Writing table `{name}` ({rows_inserted:,} rows{note})...")
+                conn.execute("ATTACH DATABASE ? AS stage", (stage_path,))
+                try:
+                    with conn:
+                        conn.execute(f"DROP TABLE IF EXISTS main.{name}")
+                        conn.execute(create_table_sql(name))
+                        conn.execute(f"INSERT INTO main.{name} SELECT * FROM stage.{name}")
+                finally:
+                    conn.execute("DETACH DATABASE stage")
+                os.remove(stage_path)
+                row_counts[name] = rows_inserted
+    except Exception:
+        conn.close()
+        raise
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return finish_build(conn, tmp_path, db_path, row_counts, checksums, incremental)
+
+# ============================================================
+# RUN
+# ============================================================
+
+def run():
     out_db_path = Path.cwd() / OUT_DB
-    write_sqlite(dfs, str(out_db_path))
+
+    # Decide which tables need reloading from the CSV checksums
+    checksums = source_checksums()
+    previous = {} if FULL_REBUILD else read_etl_metadata(str(out_db_path))
+    incremental = bool(previous)
+    changed = [name for name in CSV_FILES if previous.get(name) != checksums[name]["checksum"]]
+    if not changed:
+        missing = missing_parquet_tables() if PARQUET_ENABLED else []
+        if missing:
+            export_parquet(str(out_db_path), missing)
+        print(f"All tables up to date in {out_db_path}; nothing to do.")
+        return
+    if incremental:
+        print(f"Incremental rebuild, changed tables: {', '.join(changed)}")
+    else:
+        print("Full rebuild")
+
+    if STREAMING_INGEST:
+        # Chunked typed parse in a process pool; cleaned CSVs are exported per chunk
+        written = write_sqlite_streaming(changed, str(out_db_path), checksums=checksums, incremental=incremental,
+                                         export_dir="./FP")
+    else:
+        # Load CSVs
+        dfs = {key: load_csv(key) for key in changed}
+
+        # Clean + type normalization
+        print("\nPreparing dataframes (sanitizing, type conversions)...")
+        dfs = prepare_dataframes(dfs)
+
+        # Export cleaned CSVs to folder ./FP/
+        export_dataframes_to_csv(dfs, "./FP")
+
+        # Write SQLite
+        written = write_sqlite(dfs, str(out_db_path), checksums=checksums, incremental=incremental)
+
+    # Columnar copy for the DuckDB engine (only the tables that changed)
+    if PARQUET_ENABLED:
+        export_parquet(str(out_db_path), sorted(set(written) | set(missing_parquet_tables())))
 
     print("\nDone. Clean CSVs located in folder: ./FP")
     print(f"SQLite DB: {out_db_path}")
@@ -0,0 +1,147 @@
+"""
+qdrant_profiles.py
+
+Named storage / search profiles for the Qdrant collections.
+
+A profile bundles what has to agree between collection creation and search:
+- HNSW graph parameters (m, ef_construct) and whether the graph lives on disk,
+- whether the original float32 vectors are kept in RAM or memory-mapped from disk,
+- quantization (scalar int8 or binary, quantized vectors pinned in RAM),
+- search-time hnsw_ef and quantization rescoring / oversampling.
+
+Profiles are picked per collection: QDRANT_PROFILE_<COLLECTION> (collection
+name upper-cased, non-word characters as "_", e.g. QDRANT_PROFILE_OLIST_REVIEWS),
+falling back to QDRANT_PROFILE, then "float32" (the previous plain setup).
+upload_to_qdrant.py and app.py apply the profile when they create a
+collection and pass its search params on every query; see
+benchmarks/bench_qdrant_profiles.py for recall@k / latency / RAM per profile.
+"""
+
+import os
+import re
+from typing import Optional
+
+from qdrant_client.http import models
+
+QDRANT_PROFILE = os.getenv("QDRANT_PROFILE", "float32")
+
+
+class CollectionProfile:
+    """Creation-time config plus the matching search params for one profile."""
+
+    def __init__(self, name: str, description: str, m: int = 16, ef_construct: int = 100,
+                 hnsw_ef: Optional[int] = None, on_disk: bool = False, hnsw_on_disk: bool = False,
+                 quantization: Optional[str] = None, quantile: float = 0.99,
+                 oversampling: Optional[float] = None, rescore: bool = True):
+        if quantization not in (None, "int8", "binary"):
+            raise ValueError(f"unknown quantization {quantization!r}")
+        self.name = name
+        self.description = description
+        self.m = m
+        self.ef_construct = ef_construct
+        self.hnsw_ef = hnsw_ef
+        self.on_disk = on_disk
+        self.hnsw_on_disk = hnsw_on_disk
+        self.quantization = quantization
+        self.quantile = quantile          # int8 range covers this share of values; the rest is clipped
+        self.oversampling = oversampling
+        self.rescore = rescore
+
+    # ---- creation ----
+    def vector_params(self) -> dict:
+        """Extra VectorParams fields (langchain_qdrant's vector_params= option)."""
+        return {"on_disk": True} if self.on_disk else {}
+
+    def vectors_config(self, size: int, distance: models.Distance = models.Distance.COSINE) -> models.VectorParams:
+        return models.VectorParams(size=size, distance=distance, **self.vector_params())
+
+    def hnsw_config(self) -> models.HnswConfigDiff:
+        return models.HnswConfigDiff(m=self.m, ef_construct=self.ef_construct, on_disk=self.hnsw_on_disk)
+
+    def quantization_config(self):
+        if self.quantization == "int8":
+            return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=self.quantile, always_ram=True))
+        if self.quantization == "binary":
+            return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def collection_create_options(self) -> dict:
+        """create_collection() kwargs besides vectors_config (langchain_qdrant's collection_create_options=)."""
+        options = {"hnsw_config": self.hnsw_config()}
+        if self.quantization:
+            options["quantization_config"] = self.quantization_config()
+        return options
+
+    def create_collection_kwargs(self, size: int) -> dict:
+        return {"vectors_config": self.vectors_config(size), **self.collection_create_options()}
+
+    def update_collection_kwargs(self) -> dict:
+        """update_collection() kwargs that move an existing (unnamed-vector) collection to this profile."""
+        return {
+            "vectors_config": {"": models.VectorParamsDiff(on_disk=self.on_disk)},
+            "hnsw_config": self.hnsw_config(),
+            "quantization_config": self.quantization_config() or models.Disabled.DISABLED,
+        }
+
+    # ---- search ----
+    def search_params(self) -> Optional[models.SearchParams]:
+        """Params for query_points()/similarity_search(); None keeps server defaults."""
+        quantization = None
+        if self.quantization:
+            quantization = models.QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        if self.hnsw_ef is None and quantization is None:
+            return None
+        return models.SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantization)
+
+    def rest_search_params(self) -> Optional[dict]:
+        """search_params() as the "params" object of the REST points/search body."""
+        params = self.search_params()
+        return params.model_dump(exclude_none=True) if params else None
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name, "description": self.description, "m": self.m, "ef_construct": self.ef_construct,
+            "hnsw_ef": self.hnsw_ef, "on_disk": self.on_disk, "hnsw_on_disk": self.hnsw_on_disk,
+            "quantization": self.quantization, "quantile": self.quantile, "oversampling": self.oversampling,
+            "rescore": self.rescore,
+        }
+
+
+PROFILES = {p.name: p for p in (
+    CollectionProfile(
+        "float32", "float32 vectors and HNSW graph in RAM, Qdrant defaults (previous setup)"),
+    CollectionProfile(
+        "int8", "int8 scalar quantization in RAM, float32 originals on disk for rescoring",
+        ef_construct=200, hnsw_ef=128, on_disk=True, quantization="int8", quantile=0.999, oversampling=2.0),
+    CollectionProfile(
+        "int8-disk", "as int8, but the HNSW graph is memory-mapped from disk too (lowest RAM)",
+        ef_construct=200, hnsw_ef=128, on_disk=True, hnsw_on_disk=True, quantization="int8", quantile=0.999,
+        oversampling=2.0),
+    CollectionProfile(
+        "binary", "1-bit binary quantization in RAM, float32 originals on disk; for >=1024-d vectors",
+        m=32, ef_construct=256, hnsw_ef=256, on_disk=True, quantization="binary", oversampling=3.0),
+)}
+
+
+def profile_env_var(collection_name: str) -> str:
+    return "QDRANT_PROFILE_" + re.sub(r"\W", "_", collection_name).upper()
+
+
+def profile_for(collection_name: str) -> CollectionProfile:
+    """The profile configured for a collection; ValueError for an unknown name."""
+    name = os.getenv(profile_env_var(collection_name), QDRANT_PROFILE).strip().lower()
+    if name not in PROFILES:
+        raise ValueError(f"Unknown Qdrant profile {name!r} for collection {collection_name!r}; "
+                         f"expected one of {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+def collection_vector_size(client, collection_name: str) -> Optional[int]:
+    """Dense vector size of an existing collection (unnamed or first named vector); None if it is missing."""
+    if not client.collection_exists(collection_name):
+        return None
+    vectors = client.get_collection(collection_name).config.params.vectors
+    if isinstance(vectors, dict):
+        vectors = vectors.get("") or next(iter(vectors.values()), None)
+    return getattr(vectors, "size", None)
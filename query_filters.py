@@ -0,0 +1,144 @@
+"""
+query_filters.py
+
+Rating / popularity constraints in a natural-language question, turned into
+Qdrant range conditions on indexed payload fields (see PAYLOAD_INDEXES in
+create_qdrant_index.py), so Qdrant filters during the vector search instead
+of the results being trimmed afterwards.
+
+Understood (Indonesian, English, Portuguese), for example:
+    "produk dengan rating di atas 4"      rating > 4
+    "minimal bintang 4" / "4 stars or more" rating >= 4
+    "rating antara 3 dan 4"               3 <= rating <= 4
+    "at least 10 reviews"                 reviews >= 10
+    "lebih dari 50 ulasan"                reviews > 50
+    "fewer than 5 reviews"                reviews < 5
+
+"rating" maps to avg_review_score (product collections) or review_score
+(per-review collections); "reviews" maps to num_reviews.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from qdrant_client.http import models
+
+from create_qdrant_index import payload_key
+
+MAX_RATING = 5.0
+
+# comparator phrases before the number
+_GT = (r"di\s*atas|lebih\s+(?:dari|besar\s+dari|tinggi\s+dari)|above|more\s+than|over|greater\s+than|higher\s+than"
+       r"|acima\s+de|mais\s+de|maior\s+(?:que|do\s+que)|>")
+_GTE = (r"minimal|minimum|min\.?|paling\s+(?:sedikit|rendah)|setidaknya|sekurang-kurangnya|at\s+least|no\s+less\s+than"
+        r"|pelo\s+menos|no\s+m[ií]nimo|>=|≥")
+_LT = (r"di\s*bawah|kurang\s+dari|below|under|less\s+than|fewer\s+than|lower\s+than"
+       r"|abaixo\s+de|menos\s+de|menor\s+(?:que|do\s+que)|<")
+_LTE = r"maksimal|maksimum|maks\.?|paling\s+(?:banyak|tinggi)|at\s+most|no\s+more\s+than|up\s+to|no\s+m[aá]ximo|<=|≤"
+# after the number
+_POST_GTE = r"ke\s*atas|or\s+(?:more|higher|above|better)|and\s+(?:up|above)|ou\s+mais|\+"
+_POST_LTE = r"ke\s*bawah|or\s+(?:less|fewer|lower|below)|and\s+below|ou\s+menos"
+
+_NUM = r"(\d+(?:[.,]\d+)?)"
+_RATING_WORDS = r"rating|ratings|skor|score|nilai|nota|avalia[cç][aã]o|review\s+score"
+_STAR_WORDS = r"bintang|stars?|estrelas?"
+_COUNT_WORDS = r"reviews?|ulasan|review|avalia[cç][oõ]es|coment[aá]rios|penilaian"
+_FILLER = r"(?:\s+(?:yang|nya|produk|product|de|is|of|rata-rata|average|avg|rata2|harus|must\s+be|be))*"
+
+_COMPARATORS = ((_GTE, "gte"), (_GT, "gt"), (_LTE, "lte"), (_LT, "lt"))
+_POSTFIXES = ((_POST_GTE, "gte"), (_POST_LTE, "lte"))
+
+
+def _compile(pattern: str) -> re.Pattern:
+    return re.compile(pattern, re.IGNORECASE)
+
+
+# (regex, Range operator or "between", constraint); earlier rules win on overlapping text
+_RULES: List[Tuple[re.Pattern, str, str]] = []
+# "rating antara 3 dan 4", "stars between 3 and 4"
+_RULES.append((_compile(rf"\b(?:{_RATING_WORDS}|{_STAR_WORDS})\b{_FILLER}\s*(?:antara|between|entre)\s+{_NUM}"
+                        rf"\s*(?:dan|and|e|-|sampai|to)\s*{_NUM}"), "between", "rating"))
+for _cmp, _op in _COMPARATORS:
+    # "rating di atas 4", "skor rata-rata minimal 4.5"
+    _RULES.append((_compile(rf"\b(?:{_RATING_WORDS}|{_STAR_WORDS})\b{_FILLER}\s*(?:{_cmp})\s*{_NUM}"
+                            rf"(?!\s*(?:{_COUNT_WORDS})\b)"), _op, "rating"))
+    # "minimal bintang 4", "at least a rating of 4"
+    _RULES.append((_compile(rf"(?:^|(?<=\W))(?:{_cmp})\s*(?:a\s+)?(?:{_RATING_WORDS}|{_STAR_WORDS})\b"
+                            rf"{_FILLER}\s*{_NUM}"), _op, "rating"))
+    # "at least 4 stars", "di atas 4 bintang"
+    _RULES.append((_compile(rf"(?:^|(?<=\W))(?:{_cmp})\s*{_NUM}\s*(?:{_STAR_WORDS})\b"), _op, "rating"))
+    # "at least 10 reviews", "lebih dari 50 ulasan"
+    _RULES.append((_compile(rf"(?:^|(?<=\W))(?:{_cmp})\s*{_NUM}\s*(?:{_COUNT_WORDS})\b"), _op, "reviews"))
+    # "minimal ulasan 10"
+    _RULES.append((_compile(rf"(?:^|(?<=\W))(?:{_cmp})\s*(?:{_COUNT_WORDS})\b{_FILLER}\s*{_NUM}"), _op, "reviews"))
+    # "jumlah ulasan lebih dari 10", "number of reviews at least 10"
+    _RULES.append((_compile(rf"\b(?:{_COUNT_WORDS})\b{_FILLER}\s*(?:{_cmp})\s*{_NUM}(?!\s*(?:{_STAR_WORDS})\b)"),
+                   _op, "reviews"))
+for _post, _op in _POSTFIXES:
+    # "bintang 4 ke atas", "rating 4+", "4 stars or more"
+    _RULES.append((_compile(rf"\b(?:(?:{_RATING_WORDS}|{_STAR_WORDS})\s*{_NUM}|{_NUM}\s*(?:{_STAR_WORDS}))"
+                            rf"\s*(?:{_post})"), _op, "rating"))
+    # "10 reviews or more", "10+ ulasan"
+    _RULES.append((_compile(rf"\b{_NUM}\s*(?:(?:{_COUNT_WORDS})\s*(?:{_post})|(?:{_post})\s*(?:{_COUNT_WORDS})\b)"),
+                   _op, "reviews"))
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", "."))
+
+
+def parse_range_constraints(query: str) -> Dict[str, models.Range]:
+    """{'rating' | 'reviews': Range} found in the question; later / overlapping phrases do not override earlier ones."""
+    found: Dict[str, dict] = {}
+    taken: List[Tuple[int, int]] = []
+    for pattern, op, kind in _RULES:
+        for m in pattern.finditer(query):
+            if any(m.start() < end and start < m.end() for start, end in taken):
+                continue
+            values = [_number(g) for g in m.groups() if g is not None]
+            if not values:
+                continue
+            if kind == "rating" and any(v > MAX_RATING for v in values):
+                continue
+            if kind == "reviews" and any(v != int(v) for v in values):
+                continue
+            bounds = found.setdefault(kind, {})
+            if op == "between":
+                low, high = sorted(values[:2])
+                bounds.setdefault("gte", low)
+                bounds.setdefault("lte", high)
+            else:
+                bounds.setdefault(op, values[0])
+            taken.append(m.span())
+    return {kind: models.Range(**bounds) for kind, bounds in found.items()}
+
+
+# constraint -> candidate payload fields, first declared one wins
+CONSTRAINT_FIELDS = {
+    "rating": ("avg_review_score", "review_score"),
+    "reviews": ("num_reviews",),
+}
+
+
+def range_conditions(collection_name: str, constraints: Dict[str, models.Range]) -> List[models.FieldCondition]:
+    """FieldConditions on the collection's indexed fields; constraints it has no field for are dropped."""
+    conditions = []
+    for kind, rng in constraints.items():
+        key = next((payload_key(collection_name, f) for f in CONSTRAINT_FIELDS.get(kind, ())
+                    if payload_key(collection_name, f)), None)
+        if key is not None:
+            conditions.append(models.FieldCondition(key=key, range=rng))
+    return conditions
+
+
+def describe_constraints(constraints: Dict[str, models.Range]) -> Dict[str, dict]:
+    return {kind: rng.model_dump(exclude_none=True) for kind, rng in constraints.items()}
+
+
+def merge_filter(base: Optional[models.Filter], conditions: List[models.FieldCondition]) -> Optional[models.Filter]:
+    """base AND conditions."""
+    if not conditions:
+        return base
+    if base is None:
+        return models.Filter(must=list(conditions))
+    return models.Filter(must=[*(base.must or []), *conditions], should=base.should, must_not=base.must_not)
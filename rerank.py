@@ -0,0 +1,163 @@
+"""
+rerank.py
+
+CPU-only second stage for RAG retrieval. Qdrant over-fetches
+RERANK_CANDIDATES points together with their dense vectors; they are
+rescored locally and only the best RERANK_TOP_N reach the synthesis prompt,
+so the LLM reads fewer, better documents.
+
+relevance = RERANK_W_SIMILARITY * cosine(query, point vector)
+          + RERANK_W_LEXICAL    * share of the query's terms found in the text
+                                  (BM25 tokenizer, IDF-weighted when a model is given)
+          + RERANK_W_QUALITY    * review score, shrunk towards 3/5 for products with few reviews
+          + RERANK_W_RECENCY    * 0.5 ** (age / RERANK_RECENCY_HALF_LIFE_DAYS) relative to
+                                  the newest candidate (only when the payload carries a date)
+
+The final list is picked with Maximal Marginal Relevance over the returned
+vectors: each pick maximizes RERANK_MMR_LAMBDA * relevance (min-max scaled to
+0..1 over the candidates) - (1 - RERANK_MMR_LAMBDA) * its highest cosine to
+what is already picked, so near-duplicate products / reviews do not fill the
+prompt.
+
+Used by QdrantRagAgent.search in app.py and rag_search in cfapp.py.
+"""
+
+import os
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from sparse_bm25 import term_id, tokenize
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "1") == "1"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))   # over-fetched from Qdrant
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))              # kept for the prompt
+RERANK_W_SIMILARITY = float(os.getenv("RERANK_W_SIMILARITY", "1.0"))
+RERANK_W_LEXICAL = float(os.getenv("RERANK_W_LEXICAL", "0.3"))
+RERANK_W_QUALITY = float(os.getenv("RERANK_W_QUALITY", "0.1"))
+RERANK_W_RECENCY = float(os.getenv("RERANK_W_RECENCY", "0.05"))
+RERANK_MMR_LAMBDA = float(os.getenv("RERANK_MMR_LAMBDA", "0.5"))
+RERANK_RECENCY_HALF_LIFE_DAYS = float(os.getenv("RERANK_RECENCY_HALF_LIFE_DAYS", "180"))
+RERANK_PRIOR_REVIEWS = float(os.getenv("RERANK_PRIOR_REVIEWS", "5"))  # pseudo-reviews at the prior score
+PRIOR_SCORE = 3.0
+
+SCORE_FIELDS = ("avg_review_score", "review_score")
+COUNT_FIELDS = ("num_reviews",)
+DATE_FIELDS = ("last_review_date", "review_creation_date", "review_answer_timestamp")
+
+
+def _field(payload: dict, names: Sequence[str]):
+    """First of names found in the payload or its LangChain "metadata" dict."""
+    for source in (payload, payload.get("metadata") or {}):
+        for name in names:
+            if source.get(name) is not None:
+                return source[name]
+    return None
+
+
+def point_text(point, text_key: str = "text") -> str:
+    payload = point.payload or {}
+    return str(payload.get(text_key) or payload.get("page_content") or "")
+
+
+def dense_vector(point) -> Optional[List[float]]:
+    """The point's dense vector from with_vectors=True (unnamed vector of a dense + sparse collection)."""
+    vector = point.vector
+    if isinstance(vector, dict):
+        vector = vector.get("")
+    return vector if isinstance(vector, list) and vector else None
+
+
+def lexical_overlap(query: str, text: str, idf=None) -> float:
+    """Share of the query's distinct terms that occur in text (IDF-weighted when idf(term_id) is given)."""
+    terms = set(tokenize(query))
+    if not terms:
+        return 0.0
+    present = terms & set(tokenize(text))
+    weight = (lambda t: idf(term_id(t))) if idf else (lambda t: 1.0)
+    total = sum(weight(t) for t in terms)
+    return sum(weight(t) for t in present) / total if total else 0.0
+
+
+def quality(payload: dict) -> float:
+    """Review score in 0..1, shrunk towards PRIOR_SCORE by RERANK_PRIOR_REVIEWS pseudo-reviews; 0.5 if unknown."""
+    try:
+        score = float(_field(payload, SCORE_FIELDS))
+    except (TypeError, ValueError):
+        return 0.5
+    count = _field(payload, COUNT_FIELDS)
+    try:
+        n = float(count) if count is not None else 1.0
+    except (TypeError, ValueError):
+        n = 1.0
+    shrunk = (score * n + PRIOR_SCORE * RERANK_PRIOR_REVIEWS) / (n + RERANK_PRIOR_REVIEWS)
+    return min(max((shrunk - 1.0) / 4.0, 0.0), 1.0)
+
+
+def _timestamp(value) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def recency(points) -> np.ndarray:
+    """Per point 0..1 by age relative to the newest dated candidate; 0.5 for undated ones."""
+    stamps = [_timestamp(_field(p.payload or {}, DATE_FIELDS)) for p in points]
+    known = [s for s in stamps if s is not None]
+    if not known:
+        return np.full(len(points), 0.5)
+    newest = max(known)
+    half_life = RERANK_RECENCY_HALF_LIFE_DAYS * 86400
+    return np.array([0.5 if s is None else 0.5 ** ((newest - s) / half_life) for s in stamps])
+
+
+def _unit(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def relevance(query: str, query_vector, points, text_key: str = "text", idf=None) -> np.ndarray:
+    """Weighted relevance per point (see module docstring)."""
+    vectors = [dense_vector(p) for p in points]
+    similarity = np.array([p.score or 0.0 for p in points], dtype=np.float32)
+    if query_vector is not None and all(v is not None and len(v) == len(query_vector) for v in vectors):
+        similarity = _unit(np.asarray(vectors, dtype=np.float32)) @ _unit(np.asarray(query_vector, dtype=np.float32))
+    lexical = np.array([lexical_overlap(query, point_text(p, text_key), idf) for p in points])
+    qualities = np.array([quality(p.payload or {}) for p in points])
+    return (RERANK_W_SIMILARITY * similarity + RERANK_W_LEXICAL * lexical
+            + RERANK_W_QUALITY * qualities + RERANK_W_RECENCY * recency(points))
+
+
+def mmr(scores: np.ndarray, vectors: Optional[np.ndarray], top_n: int, lam: float = RERANK_MMR_LAMBDA) -> List[int]:
+    """Indexes picked by Maximal Marginal Relevance (plain score order without vectors)."""
+    order = list(np.argsort(-scores))
+    if vectors is None or len(order) <= 1:
+        return order[:top_n]
+    spread = scores.max() - scores.min()
+    scores = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    unit = _unit(vectors)
+    picked = [order[0]]
+    max_sim = unit @ unit[order[0]]
+    remaining = set(order[1:])
+    while remaining and len(picked) < top_n:
+        best = max(remaining, key=lambda i: lam * scores[i] - (1 - lam) * max_sim[i])
+        picked.append(best)
+        remaining.discard(best)
+        max_sim = np.maximum(max_sim, unit @ unit[best])
+    return picked
+
+
+def rerank(query: str, query_vector, points, top_n: int = RERANK_TOP_N, text_key: str = "text", idf=None) -> list:
+    """The best top_n of the over-fetched Qdrant points (fetched with with_vectors=True), best first."""
+    points = list(points)
+    if len(points) <= 1:
+        return points[:top_n]
+    scores = relevance(query, query_vector, points, text_key, idf)
+    vectors = [dense_vector(p) for p in points]
+    matrix = np.asarray(vectors, dtype=np.float32) if all(v is not None for v in vectors) else None
+    return [points[i] for i in mmr(scores, matrix, top_n)]
@@ -0,0 +1,220 @@
+"""
+schema_digest.py
+
+Compact, question-pruned schema description for SQL generation prompts.
+
+The digest (tables, columns, row counts, one sample row per table) is built
+once from sqlite_master/PRAGMA table_info and rebuilt only when the database
+file is replaced or its schema changes. At query time render(question) keeps
+only the tables and columns that the question refers to, via keyword and
+synonym mapping, so the prompt stays small.
+Materialized summary tables (see preprocess_sql.SUMMARY_TABLES) are listed
+first and flagged as preferred when the question touches them.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from sql_cache import schema_fingerprint
+
+# Tables never shown to the SQL generator
+EXCLUDED_TABLES = ("chat_history",)
+
+# Indonesian / English words that point at a table
+TABLE_KEYWORDS = {
+    "orders": ["pesanan", "order", "transaksi", "status", "bulan", "month", "tanggal", "date", "tahun", "year", "pengiriman", "delivery"],
+    "order_reviews": ["ulasan", "review", "rating", "skor", "score", "penilaian", "nilai", "komentar", "comment"],
+    "order_items": ["harga", "price", "ongkir", "freight", "item", "penjualan", "sales", "revenue", "pendapatan", "terjual", "dijual", "sold"],
+    "products": ["produk", "product", "barang", "kategori", "category", "berat", "weight", "foto", "photo"],
+    "customers": ["pelanggan", "customer", "pembeli", "buyer", "kota", "city", "provinsi", "state"],
+    "sellers": ["penjual", "seller", "toko", "merchant"],
+    "order_payments": ["pembayaran", "payment", "bayar", "cicilan", "installment", "voucher", "boleto", "kartu", "credit"],
+    "geolocation": ["lokasi", "geolocation", "latitude", "longitude", "koordinat", "zip", "kode pos"],
+    "cat_translation": ["inggris", "english", "translation", "terjemahan"],
+    "category_stats": ["kategori", "category", "rata-rata", "average", "avg", "terlaris", "best", "top"],
+    "monthly_sales": ["bulan", "month", "bulanan", "monthly", "tahun", "year", "tren", "trend"],
+    "seller_stats": ["penjual", "seller", "toko", "merchant", "provinsi", "state"],
+    "order_item_full": ["penjualan", "sales", "revenue", "pendapatan", "terjual", "sold"],
+}
+
+# Materialized aggregates built by preprocess_sql.py; advertised so the SQL
+# generator answers from them instead of re-joining the base tables
+SUMMARY_TABLES = {
+    "category_stats": "one row per product category: orders, items, revenue, avg price/freight, avg review score",
+    "monthly_sales": "one row per purchase month (YYYY-MM): orders, customers, revenue, avg order value, avg review score",
+    "seller_stats": "one row per seller with city/state: orders, items, revenue, avg review score",
+    "order_item_full": "order_items pre-joined with products, sellers, orders, customers and reviews",
+}
+
+# Columns always kept for a selected table (join keys are kept automatically)
+CORE_COLUMNS = {
+    "orders": ["order_status", "order_purchase_timestamp", "order_delivered_customer_date"],
+    "order_reviews": ["review_score", "review_comment_title", "review_comment_message"],
+    "order_items": ["price", "freight_value"],
+    "products": ["product_category_name"],
+    "customers": ["customer_city", "customer_state"],
+    "sellers": ["seller_city", "seller_state"],
+    "order_payments": ["payment_type", "payment_value", "payment_installments"],
+    "cat_translation": ["product_category_name", "product_category_name_english"],
+    "order_item_full": [
+        "product_category_name", "product_category_name_english", "seller_state", "price", "freight_value",
+        "customer_state", "order_status", "order_purchase_timestamp", "purchase_month", "review_score",
+    ],
+}
+
+# Used when the question matches nothing specific
+DEFAULT_TABLES = ["orders", "order_items", "products", "order_reviews", "customers"]
+
+# Wide tables get their columns pruned; narrow ones are shown in full
+MAX_UNPRUNED_COLUMNS = 8
+
+
+class SchemaDigest:
+    """Cached schema summary of a SQLite database."""
+
+    def __init__(self, db_path: str, category_synonyms: Optional[Dict[str, str]] = None):
+        self.db_path = db_path
+        self.category_synonyms = category_synonyms or {}
+        self.tables = {}
+        self.fingerprint = None
+        self._file_id = None
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    # ---------------- building ----------------
+
+    def _file_identity(self):
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rebuild the digest if the DB file changed; returns True if rebuilt."""
+        file_id = self._file_identity()
+        if not force and file_id == self._file_id:
+            return False
+        fingerprint = schema_fingerprint(self.db_path)
+        with self._lock:
+            self._file_id = file_id
+            if not force and fingerprint == self.fingerprint:
+                # File touched (e.g. chat_history insert) but the schema is the same
+                return False
+            self.tables = self._build()
+            self.fingerprint = fingerprint
+        return True
+
+    def _row_counts(self, conn) -> Dict[str, int]:
+        """Row counts from sqlite_stat1 when ANALYZE has run; otherwise COUNT(*)."""
+        counts = {}
+        try:
+            for tbl, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+                counts[tbl] = max(counts.get(tbl, 0), int(str(stat).split()[0]))
+        except sqlite3.Error:
+            pass
+        return counts
+
+    def _build(self) -> Dict[str, dict]:
+        tables = {}
+        if self._file_identity() is None:
+            return tables
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            counts = self._row_counts(conn)
+            objects = conn.execute(
+                "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') "
+                "AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            ).fetchall()
+            for name, kind in objects:
+                if name in EXCLUDED_TABLES or name.startswith("_"):
+                    continue
+                columns = [(r[1], r[2] or "") for r in conn.execute(f'PRAGMA table_info("{name}")')]
+                rows = counts.get(name)
+                if rows is None and kind == "table":
+                    rows = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+                sample = conn.execute(f'SELECT * FROM "{name}" LIMIT 1').fetchone()
+                tables[name] = {
+                    "kind": kind,
+                    "columns": columns,
+                    "rows": rows,
+                    "sample": dict(zip([c for c, _ in columns], sample)) if sample else {},
+                }
+        finally:
+            conn.close()
+        return tables
+
+    # ---------------- selection ----------------
+
+    def _category_hints(self, lower: str) -> List[str]:
+        hints = []
+        for synonym, dataset_cat in self.category_synonyms.items():
+            if re.search(rf"\b{re.escape(synonym)}\b", lower):
+                hints.append(f"'{synonym}' means products.product_category_name = '{dataset_cat}'")
+        return hints
+
+    def select_tables(self, question: str) -> List[str]:
+        lower = (question or "").lower()
+        words = set(re.findall(r"[a-z_]+", lower))
+        selected = []
+        for table in self.tables:
+            keywords = TABLE_KEYWORDS.get(table, [])
+            column_names = {c for c, _ in self.tables[table]["columns"]}
+            if table in words or any(k in lower for k in keywords) or words & column_names:
+                selected.append(table)
+        if self._category_hints(lower) and "products" in self.tables and "products" not in selected:
+            selected.append("products")
+
+        # Bridge tables needed to join what was selected
+        fact_side = {"products", "sellers", "order_reviews", "orders", "customers"} & set(selected)
+        if len(fact_side) > 1 and "order_items" in self.tables and "order_items" not in selected:
+            if fact_side & {"products", "sellers"}:
+                selected.append("order_items")
+        if "customers" in selected and len(selected) > 1 and "orders" in self.tables and "orders" not in selected:
+            selected.append("orders")
+
+        if not selected:
+            selected = [t for t in DEFAULT_TABLES if t in self.tables]
+        # Summary tables first so the prompt leads with them
+        return sorted(selected, key=lambda t: t not in SUMMARY_TABLES)
+
+    def _select_columns(self, table: str, lower: str):
+        columns = self.tables[table]["columns"]
+        if len(columns) <= MAX_UNPRUNED_COLUMNS or (table in SUMMARY_TABLES and table not in CORE_COLUMNS):
+            return columns
+        core = set(CORE_COLUMNS.get(table, []))
+        kept = []
+        for name, ctype in columns:
+            tokens = [t for t in name.split("_") if len(t) > 2]
+            if name.endswith("_id") or name in core or name in lower or any(t in lower for t in tokens):
+                kept.append((name, ctype))
+        return kept or columns
+
+    # ---------------- rendering ----------------
+
+    def render(self, question: str = "") -> str:
+        """Schema text for the prompt, restricted to tables relevant to the question."""
+        self.refresh()
+        lower = (question or "").lower()
+        with self._lock:
+            lines = []
+            selected = self.select_tables(question)
+            for table in selected:
+                info = self.tables[table]
+                columns = self._select_columns(table, lower)
+                rows = f"{info['rows']:,} rows" if info["rows"] is not None else info["kind"]
+                col_text = ", ".join(f"{c} {t}".strip() for c, t in columns)
+                lines.append(f"{info['kind'].upper()} {table} ({rows}): {col_text}")
+                sample = {c: info["sample"].get(c) for c, _ in columns if c in info["sample"]}
+                if sample:
+                    lines.append("  sample: " + ", ".join(f"{c}={v!r}" for c, v in sample.items()))
+            hints = self._category_hints(lower)
+        summaries = [f"{t} = {SUMMARY_TABLES[t]}" for t in selected if t in SUMMARY_TABLES]
+        if summaries:
+            lines.append("Prefer these pre-aggregated tables over joining base tables: " + "; ".join(summaries))
+        if hints:
+            lines.append("Hints: " + "; ".join(hints))
+        return "\n".join(lines)
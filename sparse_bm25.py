@@ -0,0 +1,197 @@
+"""
+sparse_bm25.py
+
+BM25 sparse vectors for hybrid (dense + lexical) search in Qdrant.
+
+Reviews are short Portuguese texts where exact product and brand words
+("iphone", "tramontina", "perfume") matter more than a dense embedding
+captures. Every point uploaded by upload_to_qdrant.py also gets a sparse
+"bm25" vector; app.py queries both with query_points() (one dense and one
+sparse prefetch) and merges them with Reciprocal Rank Fusion on the server.
+
+Tokens are the accent-folded words of embedding_providers.fold_text minus
+Portuguese / Indonesian / English stopwords; a term's index is its crc32, so
+no vocabulary has to be shipped to keep ids stable. Document weights are the
+BM25 term-frequency part, (k1 + 1) * tf / (tf + k1 * (1 - b + b * dl / avgdl)),
+and query weights are the terms' IDF, so the sparse dot product Qdrant
+computes is the BM25 score. Document frequencies and avgdl are fitted
+locally on the review corpus:
+
+    python sparse_bm25.py fit
+
+writes BM25_MODEL_PATH (JSON). upload_to_qdrant.py fits it on the docbase it
+uploads when the file is missing; app.py needs the same file (without it,
+and without the corpus, search falls back to dense). Stored document weights
+depend on avgdl, so after refitting re-upload with QDRANT_UPLOAD_MODE=full.
+"""
+
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from qdrant_client.http import models
+
+from embedding_providers import TOKEN_RE, corpus_texts, fold_text
+
+BM25_MODEL_PATH = os.getenv("BM25_MODEL_PATH", "bm25_model.json")
+# "path:column" entries, comma separated (see embedding_providers.corpus_texts)
+BM25_CORPUS = os.getenv("BM25_CORPUS", "merged_per_product_docbase.csv:document")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+SPARSE_VECTOR_NAME = os.getenv("QDRANT_SPARSE_VECTOR", "bm25")
+
+# accent-folded, as tokens are compared after fold_text()
+STOPWORDS = frozenset("""
+a ao aos as com como da das de dela dele do dos e ela ele em entre era essa esse esta este eu foi ha isso
+ja la lhe mais mas me meu minha muito na nas nem no nos o os ou para pela pelo por pra qual quando que se
+sem ser seu sua tambem te tem tinha um uma voce
+ada adalah agar akan aku apa atau bagi bahwa beberapa belum bisa dalam dan dari dengan di dia hal ini itu
+jika juga kami kamu karena ke kita lagi masih mereka nya oleh pada para saja saya sebagai sudah tapi telah
+tentang untuk yang
+an and are at be but by for from has have in is it its of on or that the this to was were which with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(fold_text(text)) if len(t) > 1 and t not in STOPWORDS]
+
+
+def term_id(token: str) -> int:
+    """Sparse vector index of a token (crc32: stable across processes and machines)."""
+    return zlib.crc32(token.encode("utf-8"))
+
+
+class BM25Encoder:
+    """Text -> Qdrant SparseVector with BM25 document / query weights."""
+
+    def __init__(self, doc_freq: Optional[Dict[int, int]] = None, n_docs: int = 0, avgdl: float = 0.0,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.doc_freq = doc_freq or {}
+        self.n_docs = n_docs
+        self.avgdl = avgdl or 1.0
+        self.k1 = k1
+        self.b = b
+        digest = hashlib.sha256(json.dumps([n_docs, round(self.avgdl, 4), k1, b, len(self.doc_freq)])
+                                .encode("utf-8")).hexdigest()[:12]
+        self.model = f"bm25-{digest}"
+
+    # ---------------- construction ----------------
+
+    @classmethod
+    def fit(cls, texts: Iterable[str], k1: float = BM25_K1, b: float = BM25_B):
+        doc_freq, n_docs, total_len = Counter(), 0, 0
+        for text in texts:
+            tokens = tokenize(text)
+            n_docs += 1
+            total_len += len(tokens)
+            doc_freq.update({term_id(t) for t in tokens})
+        return cls(dict(doc_freq), n_docs, total_len / n_docs if n_docs else 0.0, k1, b)
+
+    @classmethod
+    def load(cls, path: str = BM25_MODEL_PATH):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        doc_freq = {int(k): v for k, v in data["doc_freq"].items()}
+        return cls(doc_freq, data["n_docs"], data["avgdl"], data.get("k1", BM25_K1), data.get("b", BM25_B))
+
+    @classmethod
+    def load_or_fit(cls, path: str = BM25_MODEL_PATH, texts: Optional[Iterable[str]] = None,
+                    corpus: str = BM25_CORPUS):
+        """The saved model; else fitted on texts (or the corpus CSVs) and saved to path."""
+        if path and os.path.exists(path):
+            return cls.load(path)
+        model = cls.fit(texts if texts is not None else corpus_texts(corpus))
+        if model.n_docs and path:
+            model.save(path)
+        return model
+
+    def save(self, path: str = BM25_MODEL_PATH):
+        data = {"model": self.model, "n_docs": self.n_docs, "avgdl": self.avgdl, "k1": self.k1, "b": self.b,
+                "doc_freq": {str(k): v for k, v in self.doc_freq.items()}}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    # ---------------- encoding ----------------
+
+    def idf(self, tid: int) -> float:
+        df = self.doc_freq.get(tid, 0)
+        return math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def encode_document(self, text: str) -> models.SparseVector:
+        counts = Counter(term_id(t) for t in tokenize(text))
+        norm = self.k1 * (1 - self.b + self.b * sum(counts.values()) / self.avgdl)
+        indices = sorted(counts)
+        return models.SparseVector(
+            indices=indices, values=[(self.k1 + 1) * counts[i] / (counts[i] + norm) for i in indices])
+
+    def encode_documents(self, texts: List[str]) -> List[models.SparseVector]:
+        return [self.encode_document(t) for t in texts]
+
+    def encode_query(self, text: str) -> models.SparseVector:
+        indices = sorted({term_id(t) for t in tokenize(text)})
+        return models.SparseVector(indices=indices, values=[self.idf(i) for i in indices])
+
+
+_shared_encoder = None
+_shared_lock = threading.Lock()
+
+
+def bm25_encoder(path: str = BM25_MODEL_PATH) -> Optional[BM25Encoder]:
+    """Process-wide encoder (loaded, or fitted on BM25_CORPUS once); None when neither is available."""
+    global _shared_encoder
+    with _shared_lock:
+        if _shared_encoder is None:
+            encoder = BM25Encoder.load_or_fit(path)
+            _shared_encoder = encoder if encoder.n_docs else False
+        return _shared_encoder or None
+
+
+# ---------------- Qdrant ----------------
+
+def sparse_vectors_config() -> Dict[str, models.SparseVectorParams]:
+    """create_collection(sparse_vectors_config=...); weights are precomputed, so no server-side IDF modifier."""
+    return {SPARSE_VECTOR_NAME: models.SparseVectorParams()}
+
+
+def has_sparse_vector(client, collection_name: str) -> bool:
+    sparse = client.get_collection(collection_name).config.params.sparse_vectors or {}
+    return SPARSE_VECTOR_NAME in sparse
+
+
+def hybrid_prefetch(dense: List[float], sparse: models.SparseVector, limit: int,
+                    query_filter: Optional[models.Filter] = None,
+                    search_params: Optional[models.SearchParams] = None) -> List[models.Prefetch]:
+    """One dense and one BM25 candidate list (limit each), to be fused with fusion_query()."""
+    return [
+        models.Prefetch(query=dense, filter=query_filter, params=search_params, limit=limit),
+        models.Prefetch(query=sparse, using=SPARSE_VECTOR_NAME, filter=query_filter, limit=limit),
+    ]
+
+
+def fusion_query() -> models.FusionQuery:
+    return models.FusionQuery(fusion=models.Fusion.RRF)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != "fit":
+        print("usage: python sparse_bm25.py fit   (BM25_CORPUS / BM25_MODEL_PATH / BM25_K1 / BM25_B via env)")
+        sys.exit(1)
+    model = BM25Encoder.fit(corpus_texts(BM25_CORPUS))
+    if not model.n_docs:
+        print(f"No texts found in {BM25_CORPUS}")
+        sys.exit(1)
+    model.save(BM25_MODEL_PATH)
+    print(f"Fitted {model.model} on {model.n_docs:,} texts ({len(model.doc_freq):,} terms, "
+          f"avgdl {model.avgdl:.1f}); saved to {BM25_MODEL_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+sql_cache.py
+
+Memoization for NL -> SQL generation.
+
+Generated statements are keyed by the normalized question text plus a
+fingerprint of the database schema, so a schema change (rebuilt DB, new
+tables/columns) automatically misses. Only single SELECT statements that
+have already executed successfully are stored.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from answer_cache import normalize_message
+
+
+def schema_fingerprint(db_path: str) -> str:
+    """Hash of every CREATE statement in sqlite_master."""
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY type, name"
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return "unavailable"
+    h = hashlib.sha256()
+    for row in rows:
+        h.update("\x00".join(str(v) for v in row).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def is_single_select(sql: str) -> bool:
+    """True for one SELECT (or WITH ... SELECT) statement."""
+    s = (sql or "").strip().rstrip(";").strip()
+    if not s or ";" in s:
+        return False
+    head = s.split(None, 1)[0].lower()
+    return head in ("select", "with")
+
+
+class SQLGenerationCache:
+    """In-process LRU of validated generated SQL with TTL and hit/miss metrics."""
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 86400):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (normalized question, fingerprint) -> (sql, stored_at)
+        self._lock = threading.Lock()
+        self.stats_counters = {"hits": 0, "misses": 0, "stores": 0, "rejected": 0, "evictions": 0}
+
+    def get(self, question: str, fingerprint: str) -> Optional[str]:
+        key = (normalize_message(question), fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                self.stats_counters["evictions"] += 1
+                entry = None
+            if entry is None:
+                self.stats_counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats_counters["hits"] += 1
+            return entry[0]
+
+    def put(self, question: str, fingerprint: str, sql: str) -> bool:
+        """Store SQL that executed successfully; non-SELECT statements are rejected."""
+        if not is_single_select(sql):
+            with self._lock:
+                self.stats_counters["rejected"] += 1
+            return False
+        key = (normalize_message(question), fingerprint)
+        with self._lock:
+            self._entries[key] = (sql.strip().rstrip(";").strip(), time.time())
+            self._entries.move_to_end(key)
+            self.stats_counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats_counters["evictions"] += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        c = dict(self.stats_counters)
+        lookups = c["hits"] + c["misses"]
+        c["hit_rate"] = round(c["hits"] / lookups, 4) if lookups else 0.0
+        c["entries"] = len(self._entries)
+        return c
@@ -0,0 +1,243 @@
+"""
+sql_guard.py
+
+Execution guardrails for LLM-generated SQL.
+
+SQLGovernor wraps a query in three checks:
+- Plan check: EXPLAIN QUERY PLAN is inspected before running. A plan that
+  scans more than one large table in the same join loop (a nested loop of
+  full scans, i.e. a cartesian-style or unindexed join), or that scans a
+  large table inside a correlated subquery (once per outer row), is
+  rejected. Scans inside views (payments_aggregated, ...) count against
+  the view's base tables.
+  A single full scan of a large table is allowed: it is linear, the row cap
+  below stops row-producing scans early, and the time budget bounds scans
+  that must finish before the first row (aggregates, ORDER BY sorts).
+- Row cap: the statement is rewritten to "SELECT * FROM (...) LIMIT cap+1"
+  so SQLite stops producing rows early, and the result is flagged truncated.
+- Time budget: a progress handler aborts the statement once the per-request
+  wall-clock budget is spent.
+
+Every abort raises QueryAbortedError, which carries a machine-readable
+reason so callers can return a structured error.
+"""
+
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# SQLite VM instructions between progress-handler calls
+PROGRESS_STEPS = 10000
+
+# "FROM t", "JOIN t AS x", ", t x" (comma joins); select-list items also match but are harmless
+TABLE_REF_RE = re.compile(
+    r'(?:\bfrom|\bjoin|,)\s+"?(\w+)"?(?:\s+(?:as\s+)?'
+    r'(?!(?:on|where|join|left|inner|cross|natural|group|order|limit|from|union)\b)(\w+))?',
+    re.IGNORECASE,
+)
+# "SCAN orders", "SCAN o", "SCAN TABLE orders AS o" (older SQLite). A covering-index
+# scan still reads every row, so it counts too; "SEARCH ..." lookups do not.
+FULL_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?", re.IGNORECASE)
+
+
+def strip_terminator(sql: str) -> str:
+    """SQL without trailing whitespace and ';' (LLMs often end statements with one)."""
+    return re.sub(r"[\s;]+$", "", sql or "")
+
+
+def limit_wrapped(sql: str, limit: int) -> str:
+    """SELECT * FROM (<sql>) LIMIT limit, for SQLite and DuckDB alike.
+
+    The terminator is stripped first and the newline before ")" ends a
+    trailing "-- comment", either of which would otherwise break the wrapper.
+    """
+    return f"SELECT * FROM ({strip_terminator(sql)}\n) LIMIT {int(limit)}"
+
+
+class QueryAbortedError(Exception):
+    """A query was stopped by the governor; reason is 'timeout' or 'plan_rejected'."""
+
+    def __init__(self, reason: str, message: str, sql: str = "", hint: str = ""):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.sql = sql
+        self.hint = hint
+
+    def to_dict(self) -> dict:
+        return {
+            "error": "query_aborted",
+            "reason": self.reason,
+            "message": self.message,
+            "sql": self.sql,
+            "hint": self.hint,
+        }
+
+    def to_context(self) -> str:
+        """Text block the synthesis LLM can explain to the user."""
+        return (
+            "SQL Query Aborted:\n"
+            f"reason: {self.reason}\n"
+            f"detail: {self.message}\n"
+            f"sql: {self.sql}\n"
+            f"hint: {self.hint}"
+        )
+
+
+class SQLGovernor:
+    """Time budget, row cap and plan pre-check for read-only SELECTs."""
+
+    def __init__(
+        self,
+        time_budget_s: float = 5.0,
+        max_rows: int = 5000,
+        large_table_rows: int = 50000,
+        table_rows: Optional[Callable[[], Dict[str, int]]] = None,
+    ):
+        self.time_budget_s = time_budget_s
+        self.max_rows = max_rows
+        self.large_table_rows = large_table_rows
+        self.table_rows = table_rows or (lambda: {})
+
+    # ---------------- plan check ----------------
+
+    @staticmethod
+    def _aliases(sql: str) -> Dict[str, str]:
+        aliases = {}
+        for table, alias in TABLE_REF_RE.findall(sql):
+            aliases[table.lower()] = table.lower()
+            if alias:
+                aliases[alias.lower()] = table.lower()
+        return aliases
+
+    @staticmethod
+    def _view_bases(conn: sqlite3.Connection, aliases: Dict[str, str]) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+        """For the views the query references (recursively): ({view: base tables},
+        {alias used inside a view: "base (via view)"})."""
+        schema = conn.execute("SELECT type, name, sql FROM sqlite_master WHERE type IN ('table', 'view')").fetchall()
+        views = {name.lower(): body for kind, name, body in schema if kind == "view"}
+        tables = {name.lower() for kind, name, _ in schema if kind == "table"}
+        bases, inner = {}, {}
+
+        def resolve(view: str, stack: tuple) -> List[str]:
+            if view not in bases:
+                bases[view] = []
+                for name, table in SQLGovernor._aliases(views[view]).items():
+                    if table in views:
+                        found = resolve(table, stack + (view,)) if table not in stack else []
+                    elif table not in tables:
+                        continue    # select-list words the alias regex also matches
+                    else:
+                        found = [table]
+                        if name not in aliases:
+                            inner.setdefault(name, f"{table} (via {view})")
+                    bases[view].extend(t for t in found if t not in bases[view])
+            return bases[view]
+
+        for table in set(aliases.values()):
+            if table in views:
+                resolve(table, ())
+        return bases, inner
+
+    def large_scans(self, conn: sqlite3.Connection, sql: str) -> Tuple[List[str], List[str]]:
+        """(large tables fully scanned inside the same join loop, large tables scanned in a correlated subquery)."""
+        rows = self.table_rows()
+        lowered = {k.lower(): v for k, v in rows.items() if v is not None}
+        aliases = self._aliases(sql)
+        view_bases, inner = self._view_bases(conn, aliases)
+        aliases.update(inner)
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {strip_terminator(sql)}").fetchall()
+        parents = {node: parent for node, parent, _, _ in plan}
+        correlated = {node for node, _, _, detail in plan if detail.startswith("CORRELATED")}
+        by_loop, per_row = {}, []
+        for node, parent, _, detail in plan:
+            m = FULL_SCAN_RE.match(detail.strip())
+            if not m:
+                continue
+            name = (m.group(2) or m.group(1)).lower()
+            table = aliases.get(name, name)
+            if table in view_bases:
+                # scan of a materialized view: as large as its largest base table
+                size = max((lowered.get(t, 0) for t in view_bases[table]), default=0)
+                table = f"{table} (view over {', '.join(view_bases[table])})"
+            else:
+                size = lowered.get(table.split(" ")[0], 0)
+            if size < self.large_table_rows:
+                continue
+            by_loop.setdefault(parent, []).append(table)
+            ancestor = parent
+            while ancestor in parents and ancestor not in correlated:
+                ancestor = parents[ancestor]
+            if ancestor in correlated:
+                per_row.append(table)
+        return max(by_loop.values(), key=len, default=[]), per_row
+
+    def check_plan(self, conn: sqlite3.Connection, sql: str):
+        nested, per_row = self.large_scans(conn, sql)
+        if len(nested) > 1:
+            raise QueryAbortedError(
+                "plan_rejected",
+                f"Query plan full-scans several large tables in a nested loop ({', '.join(nested)}); "
+                "this is usually a missing or wrong JOIN condition.",
+                sql=sql,
+                hint="Join the tables on their keys (order_id, product_id, seller_id, customer_id) "
+                     "or query a pre-aggregated table.",
+            )
+        if per_row:
+            raise QueryAbortedError(
+                "plan_rejected",
+                f"Query plan full-scans a large table once per outer row in a correlated subquery "
+                f"({', '.join(per_row)}).",
+                sql=sql,
+                hint="Rewrite the subquery as a JOIN or GROUP BY on the key (order_id, product_id, ...), "
+                     "or filter the subquery on an indexed column.",
+            )
+
+    # ---------------- execution ----------------
+
+    def cap_rows(self, sql: str) -> str:
+        """Rewrite so SQLite stops after max_rows + 1 rows."""
+        return limit_wrapped(sql, self.max_rows + 1)
+
+    @contextmanager
+    def budget(self, conn: sqlite3.Connection, sql: str = ""):
+        """Abort the running statement once the time budget is spent."""
+        deadline = time.monotonic() + self.time_budget_s
+        state = {"expired": False}
+
+        def handler():
+            if time.monotonic() > deadline:
+                state["expired"] = True
+                return 1
+            return 0
+
+        conn.set_progress_handler(handler, PROGRESS_STEPS)
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            if state["expired"]:
+                raise QueryAbortedError(
+                    "timeout",
+                    f"Query exceeded the {self.time_budget_s:g}s time budget and was stopped.",
+                    sql=sql,
+                    hint="Ask a narrower question (one category, a date range) or an aggregate instead of raw rows.",
+                ) from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    def execute(self, conn: sqlite3.Connection, sql: str) -> Tuple[List[str], list, bool]:
+        """Plan-check, run under the time budget and return (columns, rows, truncated)."""
+        with self.budget(conn, sql):
+            self.check_plan(conn, sql)
+            cur = conn.cursor()
+            try:
+                cur.execute(self.cap_rows(sql))
+                columns = [d[0] for d in cur.description or []]
+                rows = cur.fetchall()
+            finally:
+                cur.close()
+        truncated = len(rows) > self.max_rows
+        return columns, rows[: self.max_rows], truncated
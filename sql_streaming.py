@@ -0,0 +1,562 @@
+"""
+sql_streaming.py
+
+Incremental result delivery for the /sqlite and /sqlite/raw endpoints.
+
+- Pagination: opaque keyset page tokens carrying the SQL and the position
+  after the last row sent; no server-side state is kept and rows are never
+  skipped or repeated between pages.
+  * Single-table queries (SELECT ... FROM t [WHERE ...], no joins,
+    aggregates, DISTINCT, GROUP BY / ORDER BY / LIMIT) are paged in rowid
+    order: the token holds the last rowid and the next page resumes with
+    "rowid > ?", an index seek, so each page costs O(page size).
+  * Any other SELECT is paged in its own ORDER BY, with every output column
+    appended as tie-breaker (so the order is total and stable). The token
+    holds the last row's key values and the next page resumes with a
+    lexicographic "(keys) > (last)". ORDER BY terms must name output
+    columns (or be ordinals). SQLite cannot seek into a derived result, so
+    every page re-runs and re-sorts the whole query: paging through it all
+    costs O(pages x full query). Use format=ndjson|arrow to read large
+    results of such queries in one pass.
+- Streaming: NDJSON and Arrow IPC generators that pull rows from the SQLite
+  cursor with fetchmany(), so memory stays flat regardless of result size
+  and the first rows go out as soon as SQLite produces them (Arrow's
+  opt-in exact types mode first makes one pass to type the columns).
+
+User SQL is always wrapped as "(<sql>\\n)" so a trailing "-- comment" cannot
+swallow the closing parenthesis.
+"""
+
+import base64
+import json
+import re
+import sqlite3
+from typing import Iterator, List, Optional, Tuple
+
+STREAM_BATCH_ROWS = 1000
+MAX_PAGE_SIZE = 10000
+MAX_SAFE_FLOAT_INT = 2 ** 53          # larger ints do not survive a float64 round trip
+ROWID_ALIAS = "__page_rowid__"
+STREAM_VIEW = "_stream_source"
+
+
+class PageTokenError(ValueError):
+    """Raised for malformed or tampered page tokens, or SQL that cannot be paged."""
+
+
+def wrap_sql(sql: str) -> str:
+    """(<sql>) as a subquery; the newline ends a trailing line comment."""
+    return f"({sql}\n)"
+
+
+# ---------------- page tokens ----------------
+
+def _encode_value(v):
+    return {"b64": base64.b64encode(v).decode("ascii")} if isinstance(v, bytes) else v
+
+
+def _decode_value(v):
+    return base64.b64decode(v["b64"]) if isinstance(v, dict) else v
+
+
+def encode_page_token(sql: str, cursor: dict) -> str:
+    data = {"sql": sql, **cursor}
+    if "after" in data:
+        data["after"] = [_encode_value(v) for v in data["after"]]
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_page_token(token: str) -> Tuple[str, dict]:
+    """(sql, cursor) where cursor is {"rowid": n} or {"after": [...], "dup": n}."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        sql = data["sql"]
+        if "rowid" in data:
+            cursor = {"rowid": int(data["rowid"])}
+        else:
+            cursor = {"after": [_decode_value(v) for v in data["after"]], "dup": int(data.get("dup", 0))}
+    except Exception as e:
+        raise PageTokenError(f"Invalid page_token: {e}")
+    if not isinstance(sql, str) or cursor.get("dup", 0) < 0:
+        raise PageTokenError("Invalid page_token")
+    return sql, cursor
+
+
+# ---------------- SQL scanning ----------------
+
+_WORD = re.compile(r"[A-Za-z_][\w$]*")
+
+
+def _top_level(sql: str) -> List[Tuple[str, int, int]]:
+    """(token, start, end) at parenthesis depth 0: upper-cased words, ',' and other
+    single characters; strings, quoted identifiers and comments are skipped."""
+    tokens, depth, i, n = [], 0, 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch in "'\"`[":
+            close = "]" if ch == "[" else ch
+            j = i + 1
+            while j < n:
+                if sql[j] == close:
+                    if close != "]" and j + 1 < n and sql[j + 1] == close:
+                        j += 2
+                        continue
+                    break
+                j += 1
+            if depth == 0:
+                tokens.append((sql[i:j + 1], i, j + 1))
+            i = j + 1
+        elif sql.startswith("--", i):
+            j = sql.find("\n", i)
+            i = n if j < 0 else j + 1
+        elif sql.startswith("/*", i):
+            j = sql.find("*/", i + 2)
+            i = n if j < 0 else j + 2
+        elif ch == "(":
+            if depth == 0:
+                tokens.append(("(", i, i + 1))
+            depth += 1
+            i += 1
+        elif ch == ")":
+            depth -= 1
+            i += 1
+        elif ch.isspace():
+            i += 1
+        else:
+            m = _WORD.match(sql, i)
+            if m:
+                if depth == 0:
+                    tokens.append((m.group(0).upper(), i, m.end()))
+                i = m.end()
+            else:
+                if depth == 0:
+                    tokens.append((ch, i, i + 1))
+                i += 1
+    return tokens
+
+
+def _unquote(name: str) -> str:
+    if len(name) >= 2 and name[0] in "\"`[" and name[-1] in "\"`]":
+        return name[1:-1]
+    return name
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+_AGGREGATES = {"COUNT", "SUM", "AVG", "MIN", "MAX", "TOTAL", "GROUP_CONCAT", "STRING_AGG", "OVER"}
+_NOT_SIMPLE = {"JOIN", "GROUP", "ORDER", "LIMIT", "UNION", "EXCEPT", "INTERSECT", "HAVING", "WINDOW",
+               "DISTINCT", "ALL", "WITH", "VALUES", "OFFSET"}
+
+
+def _rowid_plan(conn: sqlite3.Connection, sql: str) -> Optional[dict]:
+    """{table, alias, cols, where} for a single rowid-table SELECT, else None."""
+    tokens = _top_level(sql)
+    words = [t for t, _, _ in tokens]
+    if not words or words[0] != "SELECT" or words.count("FROM") != 1 or words.count("SELECT") != 1:
+        return None
+    if _NOT_SIMPLE & set(words) or _AGGREGATES & {w for w, _, _ in _top_level_all_words(sql)}:
+        return None
+    f = words.index("FROM")
+    rest = tokens[f + 1:]
+    where_at = next((k for k, (t, _, _) in enumerate(rest) if t == "WHERE"), len(rest))
+    source = rest[:where_at]
+    if not source or source[0][0] in ("(", ","):
+        return None
+    alias = None
+    if len(source) == 2:
+        alias = source[1][0]
+    elif len(source) == 3 and source[1][0] == "AS":
+        alias = source[2][0]
+    elif len(source) != 1:
+        return None
+    table = _unquote(sql[source[0][1]:source[0][2]])
+    row = conn.execute("SELECT type, sql FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE",
+                       (table,)).fetchone()
+    if row is None or "WITHOUT ROWID" in (row[1] or "").upper():
+        return None
+    alias_text = sql[source[-1][1]:source[-1][2]] if alias else _quote(table)
+    return {
+        "cols": sql[tokens[0][2]:tokens[f][1]].strip() + "\n",
+        "source": sql[source[0][1]:source[-1][2]],
+        "ref": alias_text,
+        "where": sql[rest[where_at][2]:].strip() if where_at < len(rest) else None,
+    }
+
+
+def _top_level_all_words(sql: str) -> List[Tuple[str, int, int]]:
+    """Every word, at any depth (used to spot aggregate / window calls)."""
+    flat = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    return [(m.group(0).upper(), m.start(), m.end()) for m in _WORD.finditer(flat)]
+
+
+def _order_keys(sql: str, columns: List[str]) -> List[Tuple[int, bool, bool]]:
+    """(column index, descending, nulls_first) for the top-level ORDER BY, then every other column."""
+    tokens = _top_level(sql)
+    keys = []
+    starts = [k for k in range(len(tokens) - 1) if tokens[k][0] == "ORDER" and tokens[k + 1][0] == "BY"]
+    if starts:
+        k = starts[-1] + 2
+        end = next((j for j in range(k, len(tokens)) if tokens[j][0] in ("LIMIT", ")")), len(tokens))
+        limit_at = tokens[end][1] if end < len(tokens) else len(sql)
+        terms, current = [], []
+        for tok in tokens[k:end]:
+            if tok[0] == ",":
+                terms.append((current, tok[1]))
+                current = []
+            else:
+                current.append(tok)
+        terms.append((current, limit_at))
+        normalized = [re.sub(r"\s+", "", c).lower() for c in columns]
+        for term, term_end in terms:
+            words = [t for t, _, _ in term]
+            if "COLLATE" in words or not term:
+                raise PageTokenError("Paging does not support ORDER BY ... COLLATE; order by a selected column")
+            desc, nulls_first, cut = False, None, len(term)
+            if len(words) >= 2 and words[-2] == "NULLS" and words[-1] in ("FIRST", "LAST"):
+                nulls_first, cut = words[-1] == "FIRST", cut - 2
+            if cut and words[cut - 1] in ("ASC", "DESC"):
+                desc, cut = words[cut - 1] == "DESC", cut - 1
+            expr = sql[term[0][1]:term[cut][1] if cut < len(term) else term_end].strip() if cut else ""
+            expr = re.sub(r"--[^\n]*|/\*.*?\*/", "", expr, flags=re.S).strip()
+            index = _column_index(expr, columns, normalized)
+            if index is None:
+                raise PageTokenError(f"Paging needs ORDER BY terms that are output columns; {expr!r} is not "
+                                     f"one of {columns} (add it to the SELECT list or order by its alias)")
+            # SQLite default: NULLs first ascending, last descending
+            keys.append((index, desc, (not desc) if nulls_first is None else nulls_first))
+    used = {k[0] for k in keys}
+    keys.extend((i, False, True) for i in range(len(columns)) if i not in used)
+    return keys
+
+
+def _column_index(expr: str, columns: List[str], normalized: List[str]) -> Optional[int]:
+    if expr.isdigit():
+        i = int(expr) - 1
+        return i if 0 <= i < len(columns) else None
+    candidates = [re.sub(r"\s+", "", expr).lower()]
+    last = _unquote(expr.split(".")[-1].strip())
+    candidates.append(re.sub(r"\s+", "", last).lower())
+    for c in candidates:
+        if c in normalized:
+            return normalized.index(c)
+    return None
+
+
+def _after(col: str, value, desc: bool, nulls_first: bool) -> Tuple[str, list]:
+    """Rows strictly after value in this key's order."""
+    if value is None:
+        return ("1 = 0", []) if not nulls_first else (f"{col} IS NOT NULL", [])
+    cmp = "<" if desc else ">"
+    if nulls_first:
+        return f"{col} {cmp} ?", [value]
+    return f"({col} {cmp} ? OR {col} IS NULL)", [value]
+
+
+def _keyset_predicate(keys, last: list) -> Tuple[str, list]:
+    """Rows at or after last in the key order (lexicographic over keys)."""
+    clauses, params = [], []
+    for depth, (index, desc, nulls_first) in enumerate(keys + [(None, False, True)]):
+        parts, part_params = [], []
+        for prev, _, _ in keys[:depth]:
+            parts.append(f"c{prev} IS ?")
+            part_params.append(last[prev])
+        if index is not None:
+            cond, cond_params = _after(f"c{index}", last[index], desc, nulls_first)
+            parts.append(cond)
+            part_params.extend(cond_params)
+        clauses.append("(" + " AND ".join(parts or ["1"]) + ")")
+        params.extend(part_params)
+    return " OR ".join(clauses), params
+
+
+def _order_sql(keys) -> str:
+    return ", ".join(f"c{i} {'DESC' if desc else 'ASC'} NULLS {'FIRST' if nf else 'LAST'}" for i, desc, nf in keys)
+
+
+def _columns(cursor: sqlite3.Cursor) -> List[str]:
+    return [d[0] for d in cursor.description or []]
+
+
+def _fetch_rowid_page(conn, sql, plan, page_size, cursor):
+    where = f" AND ({plan['where']}\n)" if plan["where"] else ""
+    page_sql = (f"SELECT {plan['ref']}.rowid AS {ROWID_ALIAS}, {plan['cols']} FROM {plan['source']} "
+                f"WHERE {plan['ref']}.rowid > ?{where} ORDER BY {plan['ref']}.rowid LIMIT ?")
+    cur = conn.cursor()
+    try:
+        cur.execute(page_sql, ((cursor or {}).get("rowid", -2 ** 63), page_size + 1))
+        columns = _columns(cur)[1:]
+        raw = cur.fetchall()
+    finally:
+        cur.close()
+    rows = [r[1:] for r in raw[:page_size]]
+    next_cursor = {"rowid": raw[page_size - 1][0]} if len(raw) > page_size else None
+    return columns, rows, next_cursor
+
+
+def _fetch_keyset_page(conn, sql, page_size, cursor):
+    """Re-runs and re-sorts the whole query for every page (see module docstring)."""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT * FROM {wrap_sql(sql)} LIMIT 0")
+        columns = _columns(cur)
+        keys = _order_keys(sql, columns)
+        names = ", ".join(f"c{i}" for i in range(len(columns)))
+        where, params, skip = "", [], 0
+        if cursor and cursor.get("after") is not None:
+            if len(cursor["after"]) != len(columns):
+                raise PageTokenError("page_token does not match the query's columns")
+            predicate, params = _keyset_predicate(keys, cursor["after"])
+            where, skip = f" WHERE {predicate}", cursor["dup"]
+        page_sql = (f"WITH _page({names}) AS {wrap_sql(sql)} SELECT * FROM _page{where} "
+                    f"ORDER BY {_order_sql(keys)} LIMIT ?")
+        cur.execute(page_sql, (*params, skip + page_size + 1))
+        raw = cur.fetchall()[skip:]
+    finally:
+        cur.close()
+    rows = raw[:page_size]
+    next_cursor = None
+    if len(raw) > page_size:
+        last = rows[-1]
+        # identical copies of the last row already sent; the next page starts at >= last and skips them
+        dup = 0
+        for r in reversed(rows):
+            if r != last:
+                break
+            dup += 1
+        if dup == len(rows) and cursor and cursor.get("after") is not None and tuple(cursor["after"]) == last:
+            dup += cursor["dup"]
+        next_cursor = {"after": list(last), "dup": dup}
+    return columns, rows, next_cursor
+
+
+def fetch_page(conn: sqlite3.Connection, sql: str, page_size: int, cursor: Optional[dict] = None) -> dict:
+    """One page of rows after cursor (None: first page) plus the token for the next page (None on the last)."""
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    plan = _rowid_plan(conn, sql)
+    if cursor and ("rowid" in cursor) != (plan is not None):
+        raise PageTokenError("page_token does not belong to this query")
+    if plan is not None:
+        columns, rows, next_cursor = _fetch_rowid_page(conn, sql, plan, page_size, cursor)
+    else:
+        columns, rows, next_cursor = _fetch_keyset_page(conn, sql, page_size, cursor)
+    return {
+        "columns": columns,
+        "rows": [dict(zip(columns, r)) for r in rows],
+        "page_size": page_size,
+        "next_page_token": encode_page_token(sql, next_cursor) if next_cursor else None,
+    }
+
+
+# ---------------- streaming ----------------
+
+def iter_batches(conn: sqlite3.Connection, sql: str, batch_rows: int = STREAM_BATCH_ROWS):
+    """Yield (columns, rows) batches straight from the cursor; closes conn when done."""
+    cur = conn.cursor()
+    try:
+        cur.execute(sql)
+        columns = _columns(cur)
+        while True:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                break
+            yield columns, rows
+    finally:
+        cur.close()
+        conn.close()
+
+
+def stream_ndjson(conn: sqlite3.Connection, sql: str) -> Iterator[bytes]:
+    """First line is {"columns": [...]}, then one JSON object per row."""
+    header_sent = False
+    for columns, rows in iter_batches(conn, sql):
+        chunk = []
+        if not header_sent:
+            chunk.append(json.dumps({"columns": columns}))
+            header_sent = True
+        chunk.extend(json.dumps(dict(zip(columns, r)), default=str) for r in rows)
+        yield ("\n".join(chunk) + "\n").encode("utf-8")
+    if not header_sent:
+        yield b'{"columns": []}\n'
+
+
+def _affinity(decltype: str) -> str:
+    """SQLite column affinity of a declared type (https://sqlite.org/datatype3.html, 3.1)."""
+    t = (decltype or "").upper()
+    if "INT" in t:
+        return "integer"
+    if "CHAR" in t or "CLOB" in t or "TEXT" in t:
+        return "text"
+    if not t or "BLOB" in t:
+        return "blob"
+    if "REAL" in t or "FLOA" in t or "DOUB" in t:
+        return "real"
+    return "numeric"
+
+
+class ArrowSchemaConflict(ValueError):
+    """A value after the first batch does not fit the Arrow schema already sent."""
+
+
+def _declare_view(conn: sqlite3.Connection, sql: str) -> list:
+    """PRAGMA table_info rows of a TEMP view over the query (declared types; nothing is executed)."""
+    conn.execute("PRAGMA query_only=OFF")    # TEMP objects only; the connection is opened mode=ro
+    try:
+        conn.execute(f"DROP VIEW IF EXISTS temp.{STREAM_VIEW}")
+        conn.execute(f"CREATE TEMP VIEW {STREAM_VIEW} AS {sql}\n")
+    finally:
+        conn.execute("PRAGMA query_only=ON")
+    return conn.execute(f"PRAGMA temp.table_info({STREAM_VIEW})").fetchall()
+
+
+def declared_affinities(conn: sqlite3.Connection, sql: str) -> List[Tuple[str, str]]:
+    """Per output column: (name, affinity of its declared type; "blob" for expressions)."""
+    return [(name, _affinity(decltype)) for _, name, decltype, _, _, _ in _declare_view(conn, sql)]
+
+
+def _kinds_of(values) -> Tuple[set, bool]:
+    """(storage classes present, has ints beyond 2**53) in one column of a batch."""
+    present, big = set(), False
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, int):
+            present.add("integer")
+            big = big or abs(v) > MAX_SAFE_FLOAT_INT
+        elif isinstance(v, float):
+            present.add("real")
+        elif isinstance(v, str):
+            present.add("text")
+        else:
+            present.add("blob")
+    return present, big
+
+
+def column_kinds(conn: sqlite3.Connection, sql: str) -> List[Tuple[str, str, set, bool]]:
+    """Per output column: (name, declared affinity, storage classes present, has ints beyond 2**53).
+
+    Exact-types mode: one typeof() pass over the whole result (SQLite does not
+    enforce declared types), so it costs a second evaluation of the query
+    before the first byte. Run it in the same read transaction as the stream
+    so the data cannot change in between.
+    """
+    info = _declare_view(conn, sql)
+    if not info:
+        return []
+    checks = []
+    for _, name, _, _, _, _ in info:
+        col = _quote(name)
+        checks.extend([
+            f"max(typeof({col}) = 'integer')", f"max(typeof({col}) = 'real')", f"max(typeof({col}) = 'text')",
+            f"max(typeof({col}) = 'blob')",
+            f"max(typeof({col}) = 'integer' AND abs({col}) > {MAX_SAFE_FLOAT_INT})",
+        ])
+    seen = conn.execute(f"SELECT {', '.join(checks)} FROM temp.{STREAM_VIEW}").fetchone()
+    kinds = []
+    for k, (_, name, decltype, _, _, _) in enumerate(info):
+        flags = seen[5 * k:5 * k + 5]
+        present = {kind for kind, flag in zip(("integer", "real", "text", "blob"), flags) if flag}
+        kinds.append((name, _affinity(decltype), present, bool(flags[4])))
+    return kinds
+
+
+def _arrow_type(pa, affinity: str, present: set, big_ints: bool):
+    """Narrowest Arrow type holding every value seen without loss (declared type when none was seen).
+
+    A declared TEXT / REAL column keeps that type when the values seen fit
+    it, which leaves later batches less room to conflict.
+    """
+    if not present:
+        return {"integer": pa.int64(), "real": pa.float64(), "text": pa.string()}.get(affinity, pa.string())
+    if "blob" in present:
+        return pa.binary()
+    if "text" in present or affinity == "text":
+        return pa.string()
+    if "integer" in present and big_ints:
+        return pa.string()
+    if present == {"integer"} and affinity != "real":
+        return pa.int64()
+    return pa.float64()
+
+
+def _arrow_values(pa, field, values):
+    """values converted to field's type without loss; ArrowSchemaConflict where that is impossible."""
+    type_ = field.type
+    if pa.types.is_string(type_):
+        return [v if v is None or isinstance(v, str) else repr(v) if isinstance(v, float)
+                else v.hex() if isinstance(v, bytes) else str(v) for v in values]
+    if pa.types.is_binary(type_):
+        return [v if v is None or isinstance(v, bytes) else (v if isinstance(v, str) else repr(v)).encode("utf-8")
+                for v in values]
+    out = []
+    for v in values:
+        if v is None:
+            out.append(None)
+        elif pa.types.is_floating(type_) and (isinstance(v, float) or
+                                              (isinstance(v, int) and abs(v) <= MAX_SAFE_FLOAT_INT)):
+            out.append(float(v))
+        elif pa.types.is_integer(type_) and (isinstance(v, int) or (isinstance(v, float) and v.is_integer())):
+            out.append(int(v))
+        else:
+            raise ArrowSchemaConflict(
+                f"Column {field.name!r}: value {v!r} does not fit the {type_} type taken from the first "
+                f"{STREAM_BATCH_ROWS} rows. CAST the column in the query, or enable exact types "
+                f"(SQL_ARROW_EXACT_TYPES=1, one extra pass over the result before streaming).")
+    return out
+
+
+def stream_arrow(conn: sqlite3.Connection, sql: str, exact_types: bool = False) -> Iterator[bytes]:
+    """Arrow IPC stream: schema message followed by one record batch per fetchmany().
+
+    An IPC stream's schema is fixed with its first message, so column types
+    are chosen up front and every value is converted without loss: int64 for
+    integer-only columns, float64 when reals appear (string when ints beyond
+    2**53 do), string when text appears or the column is declared TEXT,
+    binary for blobs, the declared type for columns with only NULLs.
+
+    Default: the types come from the first batch plus the declared column
+    types (free: the first batch is fetched anyway). A later value that does
+    not fit raises ArrowSchemaConflict mid-stream. exact_types=True reads the
+    storage classes of the whole result first (column_kinds), which cannot
+    conflict but evaluates the query twice. Requires pyarrow.
+    """
+    import io
+    import pyarrow as pa
+
+    conn.execute("BEGIN")    # one snapshot for the declared types / type pass and the stream
+    if exact_types:
+        kinds = column_kinds(conn, sql)
+    else:
+        kinds = [(name, affinity, set(), False) for name, affinity in declared_affinities(conn, sql)]
+    writer = None
+    sink = io.BytesIO()
+    schema = None
+    for columns, rows in iter_batches(conn, sql):
+        cols = list(zip(*rows))
+        if schema is None:
+            if not exact_types:
+                kinds = [(name, affinity, *_kinds_of(vals)) for (name, affinity, _, _), vals in zip(kinds, cols)]
+            schema = pa.schema([(name, _arrow_type(pa, *kind[1:])) for name, kind in zip(columns, kinds)])
+            writer = pa.ipc.new_stream(sink, schema)
+        arrays = [pa.array(_arrow_values(pa, field, vals), type=field.type) for field, vals in zip(schema, cols)]
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is None:
+        # no rows: still a typed schema from the declared column types
+        schema = pa.schema([(kind[0], _arrow_type(pa, *kind[1:])) for kind in kinds])
+        writer = pa.ipc.new_stream(sink, schema)
+    writer.close()
+    yield sink.getvalue()
+
+
+def arrow_available() -> bool:
+    """True when the optional pyarrow dependency is installed."""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
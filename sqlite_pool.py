@@ -0,0 +1,130 @@
+"""
+sqlite_pool.py
+
+Pooled SQLite connections for the query paths.
+
+Readers are thread-local connections opened read-only via the URI
+"file:...?mode=ro", with query_only, mmap and a large page cache, so each
+worker thread reuses one warm connection instead of reconnecting per query.
+Writes (chat_history) go through one shared writer connection guarded by a
+lock. Connections are reopened automatically when the DB file is replaced
+(e.g. rebuilt by preprocess_sql.py).
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Tunables (override via env)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_SIZE_KIB", str(64 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+class SQLitePool:
+    """Thread-local read-only connections plus a single writer connection."""
+
+    def __init__(self, db_path: str, mmap_size: int = SQLITE_MMAP_SIZE, cache_size_kib: int = SQLITE_CACHE_SIZE_KIB):
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._writer = None
+        self._writer_id = None
+        self._writer_lock = threading.Lock()
+
+    def _file_identity(self):
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def _tune(self, conn: sqlite3.Connection):
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        # Negative cache_size is in KiB rather than pages
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_kib}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+
+    def reader(self) -> sqlite3.Connection:
+        """Read-only connection owned by the calling thread. Do not close it."""
+        file_id = self._file_identity()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.file_id == file_id:
+            return conn
+        if conn is not None:
+            self._discard(conn)
+        # check_same_thread=False only so close_all() can close it from another thread
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._tune(conn)
+        conn.execute("PRAGMA query_only=ON")
+        self._local.conn = conn
+        self._local.file_id = file_id
+        with self._readers_lock:
+            self._readers.append(conn)
+        return conn
+
+    def open_reader(self) -> sqlite3.Connection:
+        """Dedicated tuned read-only connection for long-lived cursors (caller closes it).
+
+        Used for streaming responses, whose cursor outlives the request thread
+        and must not share the thread-local connection.
+        """
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._tune(conn)
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._readers_lock:
+            if conn in self._readers:
+                self._readers.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def writer(self):
+        """Serialized access to the writer connection; commits on success.
+
+        The SQLite write lock is taken before the file check: preprocess_sql.py
+        holds it while it copies chat_history into a rebuild and renames the
+        rebuild into place, so a write waiting on it must go to the new file.
+        """
+        with self._writer_lock:
+            for _ in range(2):
+                file_id = self._file_identity()
+                if self._writer is None or self._writer_id != file_id:
+                    if self._writer is not None:
+                        self._writer.close()
+                    self._writer = sqlite3.connect(self.db_path, check_same_thread=False)
+                    self._tune(self._writer)
+                    self._writer_id = self._file_identity()
+                self._writer.execute("BEGIN IMMEDIATE")
+                if self._file_identity() == self._writer_id:
+                    break
+                self._writer.rollback()    # replaced while waiting for the lock
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def close_all(self):
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
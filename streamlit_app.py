@@ -47,9 +47,9 @@ with st.sidebar:
     # Agent mode selector
     st.session_state.agent_mode = st.selectbox(
         "Agent Mode",
-        options=["auto", "sql", "qdrant"],
+        options=["auto", "sql", "qdrant", "hybrid"],
         index=0,
-        help="Auto: Let AI choose | SQL: Structured data | Qdrant: Product reviews"
+        help="Auto: Let AI choose | SQL: Structured data | Qdrant: Product reviews | Hybrid: SQL + reviews in parallel"
     )
 
     st.divider()
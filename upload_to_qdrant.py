@@ -1,28 +1,97 @@
 # upload_to_qdrant.py
+"""
+Embed merged_per_product_docbase.csv and upsert it into Qdrant.
+
+The upload is a producer/consumer pipeline so embedding and network I/O
+overlap instead of alternating:
+
+    token-packed batches -> embed_queue -> N embed workers
+        -> upsert_queue (UPSERT_CHUNK_SIZE points) -> M upsert workers
+
+Batches are packed up to EMBED_BATCH_MAX_TOKENS tokens (tiktoken) and at most
+QDRANT_BATCH_SIZE documents, and every embedding request goes through one
+shared adaptive token bucket (see embedding_batcher.py) that backs off on
+429 / Retry-After.
+
+Both queues are bounded, so at most a few batches of vectors are held in
+memory. Every embed batch and every upsert chunk retries on its own with
+exponential backoff; an item that still fails is reported at the end
+without stalling the others. Throughput (docs/sec) is printed when done.
+
+Point ids are UUIDv5 of product_id, so CSV order no longer matters, and each
+payload carries a sha256 content_hash of its document. QDRANT_UPLOAD_MODE=sync
+(default) compares hashes with a local manifest (QDRANT_MANIFEST), embeds and
+upserts only new or changed products, and deletes points whose product
+disappeared. The manifest is checkpointed while uploading, so an interrupted
+run resumes where it stopped. Without a manifest (or with QDRANT_RESCAN=1) it
+is rebuilt by scrolling the collection's payloads. QDRANT_UPLOAD_MODE=full
+re-embeds everything.
+
+The collection is created with the storage/search profile from
+qdrant_profiles.py (QDRANT_PROFILE_OLIST_PRODUCTS or QDRANT_PROFILE);
+QDRANT_APPLY_PROFILE=1 moves an existing collection to it. EMBEDDING_DIMENSIONS
+(256/512/1024) creates it with reduced text-embedding-3 vectors; app.py and
+cfapp.py embed their queries at whatever size the collection has.
+
+New collections also get a sparse "bm25" vector per point (sparse_bm25.py,
+IDF fitted locally on the docbase into BM25_MODEL_PATH when missing) for
+app.py's hybrid dense + lexical search; QDRANT_SPARSE=0 uploads dense only.
+An existing dense-only collection has to be re-created to gain it.
+"""
+import hashlib
+import json
+import math
 import os
+import queue
+import random
 import sys
+import threading
 import time
-import toml
+import uuid
+
 import pandas as pd
+import toml
 from tqdm import tqdm
-import math
 
-from langchain_openai import OpenAIEmbeddings
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 
+from embedding_batcher import TokenBatchedEmbeddings
+from embedding_cache import model_cache_name
+from embedding_providers import (
+    EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, EMBEDDING_PROVIDER, embedding_dimension, is_local, make_embeddings,
+)
+from create_qdrant_index import ensure_payload_indexes
+from qdrant_profiles import collection_vector_size, profile_for
+from sparse_bm25 import BM25_MODEL_PATH, SPARSE_VECTOR_NAME, BM25Encoder, has_sparse_vector, sparse_vectors_config
+
 # -----------------------
 # Config
 # -----------------------
 INPUT_CSV = "merged_per_product_docbase.csv"
 COLLECTION_NAME = "olist_products"
-EMBEDDING_MODEL = "text-embedding-3-small"
-EMBEDDING_DIM = 1536
+EMBEDDING_DIM = 1536                 # fallback only; the size comes from EMBEDDING_MODEL / EMBEDDING_DIMENSIONS
 # You can override these via env vars for troubleshooting large uploads
-BATCH_SIZE = int(os.getenv("QDRANT_BATCH_SIZE", "128"))
+BATCH_SIZE = int(os.getenv("QDRANT_BATCH_SIZE", "128"))                # max docs per embedding request
 UPSERT_CHUNK_SIZE = int(os.getenv("QDRANT_UPSERT_CHUNK_SIZE", "32"))
 QDRANT_TIMEOUT = float(os.getenv("QDRANT_TIMEOUT", "60"))
 MAX_PAYLOAD_TEXT = int(os.getenv("QDRANT_MAX_PAYLOAD_TEXT", "400"))  # trim stored text to avoid huge payloads
+# pipeline concurrency
+EMBED_WORKERS = int(os.getenv("QDRANT_EMBED_WORKERS", "4"))
+UPSERT_WORKERS = int(os.getenv("QDRANT_UPSERT_WORKERS", "2"))
+QUEUE_BATCHES = int(os.getenv("QDRANT_QUEUE_BATCHES", "4"))      # embedded batches buffered ahead of upserts
+MAX_ATTEMPTS = int(os.getenv("QDRANT_MAX_ATTEMPTS", "5"))
+RETRY_BACKOFF = float(os.getenv("QDRANT_RETRY_BACKOFF", "2"))    # seconds, doubled per attempt
+# incremental sync
+UPLOAD_MODE = os.getenv("QDRANT_UPLOAD_MODE", "sync").lower()     # sync | full
+MANIFEST_FILE = os.getenv("QDRANT_MANIFEST", "qdrant_manifest.json")
+RESCAN = os.getenv("QDRANT_RESCAN", "0") == "1"
+CHECKPOINT_EVERY = int(os.getenv("QDRANT_CHECKPOINT_EVERY", "512"))  # uploaded docs between manifest saves
+# collection profile (HNSW / quantization / on-disk), see qdrant_profiles.py
+APPLY_PROFILE = os.getenv("QDRANT_APPLY_PROFILE", "0") == "1"   # update an existing collection's config
+SPARSE_ENABLED = os.getenv("QDRANT_SPARSE", "1") == "1"             # BM25 sparse vectors next to the dense ones
+DELETE_CHUNK_SIZE = 256
+POINT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "cahyo-intel/olist_products")
 
 # -----------------------
 # Load secrets (if secret.toml exists)
@@ -42,62 +111,147 @@ QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-if not QDRANT_URL or not QDRANT_API_KEY or not OPENAI_API_KEY:
-    print("ERROR: QDRANT_URL, QDRANT_API_KEY, and OPENAI_API_KEY must be set (env or secret.toml).")
-    sys.exit(1)
 
 # -----------------------
-# Load CSV
+# Payload helpers (sanitize values for JSON)
 # -----------------------
-if not os.path.exists(INPUT_CSV):
-    print(f"ERROR: input CSV not found: {INPUT_CSV}")
-    sys.exit(1)
+def sane_str(v):
+    if pd.isna(v):
+        return ""
+    return str(v)
 
-df = pd.read_csv(INPUT_CSV)
-if "document" not in df.columns:
-    print("ERROR: input CSV must contain a 'document' column.")
-    sys.exit(1)
 
-texts = df["document"].fillna("").astype(str).tolist()
-n_docs = len(texts)
-print(f"Loaded {n_docs} documents from {INPUT_CSV}")
+def sane_int(v):
+    if pd.isna(v):
+        return None
+    try:
+        vv = float(v)
+        if math.isfinite(vv):
+            return int(vv)
+        return None
+    except Exception:
+        return None
 
-# -----------------------
-# Connect to Qdrant
-# -----------------------
-print("Connecting to Qdrant...")
-# prefer_grpc=True generally improves throughput and stability; increase timeout for large batches
-client = QdrantClient(
-    url=QDRANT_URL,
-    api_key=QDRANT_API_KEY,
-    prefer_grpc=True,
-    timeout=QDRANT_TIMEOUT,
-)
 
-try:
-    info = client.get_collections()
-    print("Connected to Qdrant. Collections:", [c.name for c in info.collections])
-except Exception as e:
-    print("ERROR: unable to list collections:", repr(e))
-    sys.exit(1)
-
-# create collection if not exists
-if not client.collection_exists(COLLECTION_NAME):
-    print(f"Collection '{COLLECTION_NAME}' not found. Creating...")
-    client.create_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=models.VectorParams(size=EMBEDDING_DIM, distance=models.Distance.COSINE)
-    )
-    print("Collection created.")
-else:
-    print(f"Collection '{COLLECTION_NAME}' exists. Proceeding to upload.")
+def sane_float(v):
+    if pd.isna(v):
+        return None
+    try:
+        vv = float(v)
+        return vv if math.isfinite(vv) else None
+    except Exception:
+        return None
+
+
+def point_id(product_id: str) -> str:
+    """Deterministic Qdrant point id for a product (stable across CSV reorders and reruns)."""
+    return str(uuid.uuid5(POINT_NAMESPACE, product_id))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_payload(row, text_hash: str) -> dict:
+    return {
+        "product_id": sane_str(row.get("product_id", "")),
+        "product_category": sane_str(row.get("product_category_name", "")),
+        "product_category_en": sane_str(row.get("product_category_name_english", "")),
+        "num_reviews": sane_int(row.get("num_reviews", None)) if "num_reviews" in row else None,
+        "avg_review_score": sane_float(row.get("avg_review_score", None)) if "avg_review_score" in row else None,
+        # store trimmed document to inspect later; keep full doc offline if needed
+        "text": sane_str(row.get("document", ""))[:MAX_PAYLOAD_TEXT],
+        "content_hash": text_hash,
+    }
+
 
 # -----------------------
-# Prepare embeddings
+# Manifest (what is in Qdrant; also the resume checkpoint)
 # -----------------------
-emb = OpenAIEmbeddings(model=EMBEDDING_MODEL, openai_api_key=OPENAI_API_KEY)
+class SyncManifest:
+    """product_id -> content hash of the point stored in Qdrant, saved atomically as JSON."""
+
+    def __init__(self, path: str, collection: str, model: str):
+        self.path = path
+        self.collection = collection
+        self.model = model
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.dirty = 0
+
+    def load(self) -> bool:
+        """True when a manifest for this collection and embedding model was found."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable manifest {self.path}: {e!r}")
+            return False
+        if data.get("collection") != self.collection or data.get("embedding_model") != self.model:
+            print(f"Manifest {self.path} is for {data.get('collection')}/{data.get('embedding_model')}; ignoring it.")
+            return False
+        self.entries = dict(data.get("entries", {}))
+        return True
 
-def embed_texts_batch(text_list):
+    def mark(self, hashes: dict):
+        with self.lock:
+            self.entries.update(hashes)
+            self.dirty += len(hashes)
+            due = self.dirty >= CHECKPOINT_EVERY
+        if due:
+            self.save()
+
+    def forget(self, product_ids):
+        with self.lock:
+            for pid in product_ids:
+                self.entries.pop(pid, None)
+            self.dirty += 1
+
+    def save(self):
+        with self.lock:
+            data = {"collection": self.collection, "embedding_model": self.model,
+                    "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "entries": self.entries}
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+            self.dirty = 0
+
+
+def scan_collection(client, collection: str):
+    """Seed a manifest from Qdrant payloads.
+
+    Returns ({product_id: content_hash}, [point ids not addressable by product_id]) —
+    the latter are legacy row-position ids or points without a product_id.
+    """
+    entries, orphans = {}, []
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name=collection, limit=1024, offset=offset,
+                                       with_payload=["product_id", "content_hash"], with_vectors=False)
+        for p in points:
+            payload = p.payload or {}
+            pid = payload.get("product_id")
+            if pid and str(p.id) == point_id(pid):
+                # points uploaded before content hashes get "" and are re-embedded once
+                entries[pid] = payload.get("content_hash", "")
+            else:
+                orphans.append(p.id)
+        if offset is None:
+            return entries, orphans
+
+
+def delete_points(client, ids: list):
+    for off in range(0, len(ids), DELETE_CHUNK_SIZE):
+        chunk = ids[off:off + DELETE_CHUNK_SIZE]
+        with_retries(lambda: client.delete(collection_name=COLLECTION_NAME,
+                                           points_selector=models.PointIdsList(points=chunk)),
+                     f"Delete {len(chunk)} points", threading.Event())
+
+
+def embed_texts_batch(emb, text_list):
     """
     Try to use a batch embed function if provided; otherwise fall back to per-item embed_query.
     Returns list of vectors in same order.
@@ -111,102 +265,364 @@ def embed_texts_batch(text_list):
             vectors.append(emb.embed_query(t))
         return vectors
 
+
+def with_retries(fn, label: str, stop: threading.Event, max_attempts: int = MAX_ATTEMPTS,
+                 backoff: float = RETRY_BACKOFF):
+    """Call fn() until it succeeds; exponential backoff with jitter, per work item."""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            attempt += 1
+            if attempt >= max_attempts or stop.is_set():
+                raise
+            delay = backoff * 2 ** (attempt - 1) * random.uniform(0.75, 1.25)
+            print(f"{label} failed ({e!r}); retry {attempt}/{max_attempts - 1} in {delay:.1f}s")
+            if stop.wait(delay):
+                raise
+
+
 # -----------------------
-# Upload in batches
+# Pipeline
 # -----------------------
-print(f"Uploading embeddings to Qdrant in batches of {BATCH_SIZE} ...")
-
-# create deterministic integer ids (0..n-1)
-start_idx = 0
-for start in range(0, n_docs, BATCH_SIZE):
-    end = min(n_docs, start + BATCH_SIZE)
-    batch_texts = texts[start:end]
-    # embed
-    try:
-        vectors = embed_texts_batch(batch_texts)
-    except Exception as e:
-        print(f"ERROR during embedding batch {start}-{end-1}:", repr(e))
-        print("Retrying once after 5s...")
-        time.sleep(5)
-        try:
-            vectors = embed_texts_batch(batch_texts)
-        except Exception as e2:
-            print("Second attempt failed:", repr(e2))
-            sys.exit(1)
+class UploadPipeline:
+    """Concurrent embed -> upsert pipeline over the given rows of a DataFrame of documents."""
 
-    # prepare payloads and ids
-    ids = list(range(start, end))
-    # helpers to sanitize payload values for JSON
-    def sane_str(v):
-        if pd.isna(v):
-            return ""
-        return str(v)
-
-    def sane_int(v):
-        if pd.isna(v):
-            return None
-        try:
-            vv = float(v)
-            if math.isfinite(vv):
-                return int(vv)
-            return None
-        except Exception:
-            return None
-
-    def sane_float(v):
-        if pd.isna(v):
-            return None
+    def __init__(self, client, emb, df: pd.DataFrame, texts: list, rows: list = None, hashes: list = None,
+                 manifest: SyncManifest = None, sparse: BM25Encoder = None, embed_workers: int = EMBED_WORKERS, upsert_workers: int = UPSERT_WORKERS,
+                 batch_size: int = BATCH_SIZE, upsert_chunk_size: int = UPSERT_CHUNK_SIZE,
+                 queue_batches: int = QUEUE_BATCHES):
+        self.client = client
+        self.emb = emb
+        self.df = df
+        self.texts = texts
+        self.rows = list(range(len(texts))) if rows is None else list(rows)
+        self.hashes = hashes if hashes is not None else [content_hash(t) for t in texts]
+        self.product_ids = df["product_id"].astype(str).tolist()
+        self.manifest = manifest
+        self.sparse = sparse
+        self.embed_workers = max(1, embed_workers)
+        self.upsert_workers = max(1, upsert_workers)
+        self.batch_size = batch_size
+        self.upsert_chunk_size = upsert_chunk_size
+        chunks_per_batch = math.ceil(batch_size / upsert_chunk_size)
+        self.embed_queue = queue.Queue(maxsize=max(1, queue_batches))
+        self.upsert_queue = queue.Queue(maxsize=max(1, queue_batches * chunks_per_batch))
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.failed = []                                   # (stage, first_product_id, last_product_id, error)
+        self.busy = {"embed": 0.0, "upsert": 0.0}          # summed worker seconds per stage
+        self.uploaded = 0
+        self.progress = None
+
+    def _timed(self, stage: str, fn):
+        start = time.perf_counter()
         try:
-            vv = float(v)
-            return vv if math.isfinite(vv) else None
-        except Exception:
-            return None
-
-    payloads = []
-    for i, idx in enumerate(range(start, end)):
-        row = df.iloc[idx]
-        payload = {
-            "product_id": sane_str(row.get("product_id", "")),
-            "product_category": sane_str(row.get("product_category_name", "")),
-            "product_category_en": sane_str(row.get("product_category_name_english", "")),
-            "num_reviews": sane_int(row.get("num_reviews", None)) if "num_reviews" in row else None,
-            "avg_review_score": sane_float(row.get("avg_review_score", None)) if "avg_review_score" in row else None,
-            # store trimmed document to inspect later; keep full doc offline if needed
-            "text": sane_str(row.get("document", ""))[:MAX_PAYLOAD_TEXT],
-        }
-        payloads.append(payload)
+            return fn()
+        finally:
+            with self.lock:
+                self.busy[stage] += time.perf_counter() - start
+
+    def _label(self, rows: list) -> str:
+        return f"{self.product_ids[rows[0]]}..{self.product_ids[rows[-1]]} ({len(rows)})"
 
-    # upsert in smaller chunks with retries to avoid timeouts
-    def chunks(lst, size):
-        for i in range(0, len(lst), size):
-            yield i, lst[i:i+size]
+    def _fail(self, stage: str, rows: list, error: Exception):
+        print(f"ERROR: {stage} {self._label(rows)} gave up after {MAX_ATTEMPTS} attempts: {error!r}")
+        with self.lock:
+            self.failed.append((stage, self.product_ids[rows[0]], self.product_ids[rows[-1]], repr(error)))
 
-    for offset, _ in chunks(ids, UPSERT_CHUNK_SIZE):
-        sub_ids = ids[offset: offset + UPSERT_CHUNK_SIZE]
-        sub_vectors = vectors[offset: offset + UPSERT_CHUNK_SIZE]
-        sub_payloads = payloads[offset: offset + UPSERT_CHUNK_SIZE]
+    def _embed_worker(self):
+        while True:
+            item = self.embed_queue.get()
+            if item is None:
+                return
+            rows = item
+            if self.stop.is_set():
+                continue
+            try:
+                vectors = self._timed("embed", lambda: with_retries(
+                    lambda: embed_texts_batch(self.emb, [self.texts[i] for i in rows]),
+                    f"Embedding batch {self._label(rows)}", self.stop))
+            except Exception as e:
+                self._fail("embed", rows, e)
+                continue
+            ids = [point_id(self.product_ids[i]) for i in rows]
+            payloads = [build_payload(self.df.iloc[i], self.hashes[i]) for i in rows]
+            sparse = self.sparse.encode_documents([self.texts[i] for i in rows]) if self.sparse else None
+            for off in range(0, len(rows), self.upsert_chunk_size):
+                sl = slice(off, off + self.upsert_chunk_size)
+                self.upsert_queue.put((rows[sl], ids[sl], vectors[sl], sparse[sl] if sparse else None, payloads[sl]))
 
-        attempts = 0
-        max_attempts = 3
-        backoff = 3
+    def _upsert_worker(self):
         while True:
+            item = self.upsert_queue.get()
+            if item is None:
+                return
+            rows, ids, vectors, sparse, payloads = item
+            if self.stop.is_set():
+                continue
+            if sparse is not None:
+                vectors = {"": vectors, SPARSE_VECTOR_NAME: sparse}
             try:
-                client.upsert(
-                    collection_name=COLLECTION_NAME,
-                    points=models.Batch(ids=sub_ids, vectors=sub_vectors, payloads=sub_payloads)
-                )
-                break
+                self._timed("upsert", lambda: with_retries(
+                    lambda: self.client.upsert(
+                        collection_name=COLLECTION_NAME,
+                        points=models.Batch(ids=ids, vectors=vectors, payloads=payloads),
+                    ),
+                    f"Upsert {self._label(rows)}", self.stop))
             except Exception as e:
-                attempts += 1
-                if attempts >= max_attempts:
-                    print(f"ERROR during upsert batch {start}-{end-1} (sub {offset}-{offset+len(sub_ids)-1}):", repr(e))
-                    sys.exit(1)
-                else:
-                    print(f"Upsert timeout/error on sub-batch {offset}-{offset+len(sub_ids)-1}. Retrying in {backoff}s...")
-                    time.sleep(backoff)
-                    backoff *= 2
-
-    print(f"Uploaded batch {start}-{end-1} ({end-start} items)")
-
-print("Upload complete.")
-print(f"Total uploaded: {n_docs} vectors to collection '{COLLECTION_NAME}'")
+                self._fail("upsert", rows, e)
+                continue
+            if self.manifest is not None:
+                # checkpoint: a rerun skips everything already confirmed by Qdrant
+                self.manifest.mark({self.product_ids[i]: self.hashes[i] for i in rows})
+            with self.lock:
+                self.uploaded += len(ids)
+            self.progress.update(len(ids))
+
+    def _batches(self) -> list:
+        """Row batches: token-packed when the embedder can plan them, else fixed batch_size."""
+        if isinstance(self.emb, TokenBatchedEmbeddings):
+            plan, _ = self.emb.plan([self.texts[i] for i in self.rows])
+            return [[self.rows[j] for j in batch] for batch in plan]
+        return [self.rows[start:start + self.batch_size] for start in range(0, len(self.rows), self.batch_size)]
+
+    def run(self) -> dict:
+        n_docs = len(self.rows)
+        started = time.perf_counter()
+        self.progress = tqdm(total=n_docs, unit="doc", desc="Uploading")
+        embedders = [threading.Thread(target=self._embed_worker, name=f"embed-{i}", daemon=True)
+                     for i in range(self.embed_workers)]
+        upserters = [threading.Thread(target=self._upsert_worker, name=f"upsert-{i}", daemon=True)
+                     for i in range(self.upsert_workers)]
+        for t in embedders + upserters:
+            t.start()
+        try:
+            # producer: bounded queue applies backpressure when embedding falls behind
+            for batch in self._batches():
+                if self.stop.is_set():
+                    break
+                self.embed_queue.put(batch)
+        except KeyboardInterrupt:
+            print("Interrupted; draining in-flight batches...")
+            self.stop.set()
+        finally:
+            for _ in embedders:
+                self.embed_queue.put(None)
+            for t in embedders:
+                t.join()
+            for _ in upserters:
+                self.upsert_queue.put(None)
+            for t in upserters:
+                t.join()
+            self.progress.close()
+            if self.manifest is not None:
+                self.manifest.save()
+
+        elapsed = time.perf_counter() - started
+        return {
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "elapsed_s": elapsed,
+            "docs_per_s": self.uploaded / elapsed if elapsed else 0.0,
+            "embed_busy_s": self.busy["embed"],
+            "upsert_busy_s": self.busy["upsert"],
+        }
+
+
+def plan_sync(product_ids: list, hashes: list, manifest: SyncManifest, mode: str = UPLOAD_MODE):
+    """Rows to (re-)embed and product_ids to delete, given what the manifest says is stored."""
+    if mode == "full":
+        rows = list(range(len(product_ids)))
+    else:
+        rows = [i for i, (pid, h) in enumerate(zip(product_ids, hashes)) if manifest.entries.get(pid) != h]
+    current = set(product_ids)
+    vanished = [pid for pid in manifest.entries if pid not in current]
+    return rows, vanished
+
+
+def manifest_matches_collection(client, manifest: SyncManifest) -> bool:
+    """Cheap consistency check: the collection holds exactly one point per manifest entry."""
+    points = client.count(collection_name=COLLECTION_NAME, exact=True).count
+    if points != len(manifest.entries):
+        print(f"Manifest {manifest.path} lists {len(manifest.entries)} products but collection "
+              f"'{COLLECTION_NAME}' holds {points} points; rebuilding it.")
+        return False
+    return True
+
+
+def sync_collection(client, emb, df: pd.DataFrame, manifest: SyncManifest, mode: str = UPLOAD_MODE,
+                    rescan: bool = RESCAN, created: bool = False, **pipeline_kwargs) -> dict:
+    """Bring the collection in line with df: upsert new/changed documents, delete vanished products.
+
+    created=True (the collection was just created) starts from an empty
+    manifest: one left over from an earlier collection of the same name
+    would mark every product unchanged and leave the new collection empty.
+    """
+    texts = df["document"].fillna("").astype(str).tolist()
+    product_ids = df["product_id"].astype(str).tolist()
+    hashes = [content_hash(t) for t in texts]
+
+    orphans = []
+    if created:
+        print(f"Collection '{COLLECTION_NAME}' is new; starting from an empty manifest.")
+        manifest.entries = {}
+        manifest.save()
+    elif rescan or not manifest.load() or not manifest_matches_collection(client, manifest):
+        print(f"Building manifest from collection '{COLLECTION_NAME}' payloads...")
+        manifest.entries, orphans = scan_collection(client, COLLECTION_NAME)
+        manifest.save()
+    rows, vanished = plan_sync(product_ids, hashes, manifest, mode)
+    print(f"Sync plan ({mode}): {len(rows)} new/changed, {len(product_ids) - len(rows)} unchanged, "
+          f"{len(vanished)} vanished, {len(orphans)} legacy/orphan points")
+
+    stats = UploadPipeline(client, emb, df, texts, rows=rows, hashes=hashes, manifest=manifest,
+                           **pipeline_kwargs).run()
+
+    stale_ids = [point_id(pid) for pid in vanished] + orphans
+    if stale_ids:
+        print(f"Deleting {len(stale_ids)} points no longer in {INPUT_CSV} ...")
+        delete_points(client, stale_ids)
+        manifest.forget(vanished)
+        manifest.save()
+    stats.update({"planned": len(rows), "unchanged": len(product_ids) - len(rows), "deleted": len(stale_ids)})
+    return stats
+
+
+def main():
+    # a local Qdrant (docker, offline CI) needs no API key; the local provider needs no OpenAI key
+    if not QDRANT_URL or not (OPENAI_API_KEY or is_local()):
+        print("ERROR: QDRANT_URL and OPENAI_API_KEY must be set (env or secret.toml); "
+              "QDRANT_API_KEY for Qdrant Cloud.")
+        sys.exit(1)
+    try:
+        profile = profile_for(COLLECTION_NAME)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    if is_local():
+        # in-process CPU model: nothing to batch by tokens or rate limit
+        emb = make_embeddings()
+    else:
+        # max_retries=0: 429s reach the shared token bucket, which backs off for every worker
+        emb = TokenBatchedEmbeddings(
+            make_embeddings(model=EMBEDDING_MODEL, openai_api_key=OPENAI_API_KEY, max_retries=0),
+            max_batch_items=BATCH_SIZE,
+        )
+    embedding_dim = embedding_dimension(emb, EMBEDDING_DIM)
+    print(f"Embedding provider: {EMBEDDING_PROVIDER} ({model_cache_name(emb)}, {embedding_dim}-d)")
+
+    # -----------------------
+    # Load CSV
+    # -----------------------
+    if not os.path.exists(INPUT_CSV):
+        print(f"ERROR: input CSV not found: {INPUT_CSV}")
+        sys.exit(1)
+
+    df = pd.read_csv(INPUT_CSV)
+    if "document" not in df.columns:
+        print("ERROR: input CSV must contain a 'document' column.")
+        sys.exit(1)
+
+    if "product_id" not in df.columns:
+        print("ERROR: input CSV must contain a 'product_id' column (point ids are derived from it).")
+        sys.exit(1)
+    missing = df["product_id"].isna()
+    if missing.any():
+        print(f"Warning: skipping {int(missing.sum())} rows without product_id")
+        df = df[~missing]
+    dupes = df["product_id"].astype(str).duplicated()
+    if dupes.any():
+        print(f"Warning: {int(dupes.sum())} duplicate product_id rows; keeping the first of each")
+        df = df[~dupes]
+    df = df.reset_index(drop=True)
+    n_docs = len(df)
+    print(f"Loaded {n_docs} documents from {INPUT_CSV}")
+
+    # -----------------------
+    # Connect to Qdrant
+    # -----------------------
+    print("Connecting to Qdrant...")
+    # prefer_grpc=True generally improves throughput and stability; increase timeout for large batches
+    client = QdrantClient(
+        url=QDRANT_URL,
+        api_key=QDRANT_API_KEY,
+        prefer_grpc=True,
+        timeout=QDRANT_TIMEOUT,
+    )
+
+    try:
+        info = client.get_collections()
+        print("Connected to Qdrant. Collections:", [c.name for c in info.collections])
+    except Exception as e:
+        print("ERROR: unable to list collections:", repr(e))
+        sys.exit(1)
+
+    bm25 = None
+    if SPARSE_ENABLED:
+        bm25 = BM25Encoder.load_or_fit(BM25_MODEL_PATH, texts=df["document"].fillna("").astype(str))
+        print(f"BM25 sparse vectors: {bm25.model} ({bm25.n_docs:,} docs, {len(bm25.doc_freq):,} terms) "
+              f"from {BM25_MODEL_PATH}")
+
+    # create collection if not exists
+    created = not client.collection_exists(COLLECTION_NAME)
+    if created:
+        print(f"Collection '{COLLECTION_NAME}' not found. Creating with profile '{profile.name}' "
+              f"({profile.description})...")
+        sparse_config = {"sparse_vectors_config": sparse_vectors_config()} if bm25 else {}
+        client.create_collection(collection_name=COLLECTION_NAME, **profile.create_collection_kwargs(embedding_dim),
+                                 **sparse_config)
+        print("Collection created.")
+    else:
+        size = collection_vector_size(client, COLLECTION_NAME)
+        if size is not None and size != embedding_dim:
+            hint = "use another collection or re-create it"
+            if not is_local():
+                hint = f"set EMBEDDING_DIMENSIONS={size}, " + hint
+            print(f"ERROR: collection '{COLLECTION_NAME}' stores {size}-d vectors but the {EMBEDDING_PROVIDER} "
+                  f"provider makes {embedding_dim}-d ones ({EMBEDDING_MODEL}, EMBEDDING_DIMENSIONS="
+                  f"{EMBEDDING_DIMENSIONS or 'full'}); {hint}.")
+            sys.exit(1)
+        if APPLY_PROFILE:
+            # Qdrant rebuilds the index / quantized vectors in the background
+            client.update_collection(collection_name=COLLECTION_NAME, **profile.update_collection_kwargs())
+            print(f"Applied profile '{profile.name}' to existing collection '{COLLECTION_NAME}'.")
+        if bm25 and not has_sparse_vector(client, COLLECTION_NAME):
+            # sparse vectors cannot be added to an existing collection
+            print(f"Warning: collection '{COLLECTION_NAME}' has no '{SPARSE_VECTOR_NAME}' sparse vector; uploading "
+                  f"dense vectors only. Re-create it for hybrid search.")
+            bm25 = None
+        print(f"Collection '{COLLECTION_NAME}' exists. Proceeding to upload.")
+    # keyword / numeric payload indexes for filtered search (create_qdrant_index.py); idempotent
+    index_actions = {f: a for f, a in ensure_payload_indexes(client, COLLECTION_NAME).items() if a != "ok"}
+    if index_actions:
+        print(f"Payload indexes: {index_actions}")
+
+    # -----------------------
+    # Embed + upload (pipelined, only the delta in sync mode)
+    # -----------------------
+    token_budget = f"<= {emb.max_batch_tokens} tokens / " if isinstance(emb, TokenBatchedEmbeddings) else ""
+    print(f"Uploading embeddings to Qdrant: batches of {token_budget}{BATCH_SIZE} docs, "
+          f"upsert chunks of {UPSERT_CHUNK_SIZE}, {EMBED_WORKERS} embed / {UPSERT_WORKERS} upsert workers ...")
+    # a different vector layout (sparse on / off) invalidates the manifest
+    vector_model = model_cache_name(emb) + (f"+{SPARSE_VECTOR_NAME}" if bm25 else "")
+    manifest = SyncManifest(MANIFEST_FILE, COLLECTION_NAME, vector_model)
+    stats = sync_collection(client, emb, df, manifest, created=created, sparse=bm25)
+
+    print("Upload complete." if not stats["failed"] else "Upload finished with failures (rerun to resume).")
+    print(f"Total uploaded: {stats['uploaded']}/{stats['planned']} new/changed vectors to collection "
+          f"'{COLLECTION_NAME}' ({stats['unchanged']} unchanged, {stats['deleted']} deleted, {n_docs} documents)")
+    print(f"Throughput: {stats['docs_per_s']:.1f} docs/sec over {stats['elapsed_s']:.1f}s "
+          f"(embed busy {stats['embed_busy_s']:.1f}s, upsert busy {stats['upsert_busy_s']:.1f}s)")
+    if isinstance(emb, TokenBatchedEmbeddings):
+        print(f"Embedding rate limiter: {emb.stats()}")
+    if stats["failed"]:
+        for stage, first, last, error in stats["failed"]:
+            print(f"  failed {stage}: products {first}..{last}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()